@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+Command line interface of the LISST-Holo processing.
+
+One entry point for the processing steps, with the options of the tools as
+arguments instead of paths in the scripts:
+
+    python antics.py metadata FOLDER_OR_FILES... [-o metadata.csv] [--store]
+    python antics.py clean METADATA OUTPUT.csv
+    python antics.py zmin FOLDER [--n 51] [--workers 4] [--max-memory 8G]
+    python antics.py reconstruct FOLDER [--no-gif] [--stack-format hdf5]
+    python antics.py greyness FOLDER [-o greyness.csv]
+    python antics.py ecotaxa FOLDER NAME [--lat 50.1] [--lon -4.2] [--date 2022-11-04]
+
+Run `python antics.py COMMAND --help` for the options of a command.
+
+Packages are imported by the commands that use them: `metadata` without
+--store only needs the standard library (see tools/LISST_Holo_metadata.py)
+and starts in a fraction of a second, so it can be run as many small
+cluster jobs, e.g. one per folder or per slice of files. The exit status is
+1 if a hologram failed.
+
+"""
+
+import argparse
+import os
+import sys
+
+
+# ---- Commands ----
+
+def _holograms(paths, ext):
+    """Holograms of folders (files matching ext, sorted) and single files"""
+    from pathlib import Path
+
+    image_fns = []
+    for path in map(Path, paths):
+        image_fns += sorted(path.glob(ext)) if path.is_dir() else [path]
+    return image_fns
+
+
+def metadata(args):
+    """Metadata of holograms as .csv table, or into the Parquet metadata store of the folder"""
+    image_fns = _holograms(args.paths, args.ext)
+
+    if args.store:
+        from tools.LISST_Holo_tools import MetadataStore
+
+        store = MetadataStore(args.store)
+        meta = store.update(image_fns, cruise = args.cruise, event = args.event)
+        failed = meta.failed
+        print(len(meta), "new holograms, metadata store:", store.path, file = sys.stderr)
+        if args.output is not None:
+            store.read().drop(columns = "File").to_csv(args.output if args.output != "-" else sys.stdout,
+                                                        index = False)
+    else:
+        from tools.LISST_Holo_metadata import write_metadata_csv
+
+        output = args.output or "-"
+        _, failed = write_metadata_csv(image_fns, sys.stdout if output == "-" else output,
+                                       cruise = args.cruise, event = args.event)
+
+    for image_fn in failed:
+        print("Failed to process " + str(image_fn) + ": file too short to hold metadata", file = sys.stderr)
+    return 1 if failed else 0
+
+
+def clean(args):
+    """Cast phases of the metadata, keeping the down- and upcasts below a depth"""
+    import importlib
+
+    cleaning = importlib.import_module("preprocessing.2_cleaning_casts")
+    cleaning.filter_metadata(args.input, args.output, rolling_window = args.rolling_window,
+                             tolerance = args.tolerance, depth_threshold = args.depth_threshold,
+                             cast_column = args.cast_column)
+    return 0
+
+
+def _batch_options(args):
+    """Keyword arguments shared by zmin_batch and reconstruct_batch"""
+    options = dict(n = args.n, ext = args.ext, workers = args.workers or os.cpu_count(),
+                   chunksize = args.chunksize, precision = args.precision, resume = not args.no_resume,
+                   index = args.index, phases = args.phases, png_compression = args.png_compression,
+                   encoder_threads = args.encoder_threads, prefetch = args.prefetch,
+                   max_memory = args.max_memory)
+    if args.background:
+        options['background'] = {'frames': args.background, 'statistic': args.background_statistic,
+                                 'mode': args.background_mode}
+    return options
+
+
+def _run_instrumented(func, args, *func_args, **kwargs):
+    """Run a batch with telemetry if asked for; returns 1 if a hologram failed"""
+    from tools.LISST_Holo_tools import TELEMETRY
+
+    if args.telemetry or args.progress:
+        TELEMETRY.enable(progress = args.progress)
+    results = func(*func_args, **kwargs)
+    if args.telemetry:
+        TELEMETRY.to_csv(args.telemetry)
+        print(TELEMETRY.summary().to_string())
+        print("Telemetry saved to:", args.telemetry)
+    return 1 if any(error is not None for _, _, error in results) else 0
+
+
+def zmin(args):
+    """z-min image of each hologram"""
+    from tools.LISST_Holo_tools import zmin_batch
+
+    return _run_instrumented(zmin_batch, args, args.folder, **_batch_options(args))
+
+
+def reconstruct(args):
+    """Focal stack, gif and z-min of each hologram"""
+    from tools.LISST_Holo_tools import reconstruct_batch
+
+    return _run_instrumented(reconstruct_batch, args, args.folder, make_stack = not args.no_stack,
+                             make_gif = not args.no_gif, make_z_min = not args.no_zmin,
+                             stack_format = args.stack_format, gif_downsample = args.gif_downsample,
+                             **_batch_options(args))
+
+
+def greyness(args):
+    """Depth-binned greyness profile of a cast"""
+    from tools.LISST_Holo_tools import greyness_profile
+
+    profile, frames = greyness_profile(args.folder, ext = args.ext, bin_size = args.bin_size,
+                                       per_bin = args.per_bin, n = args.n, medium_index = args.medium_index,
+                                       workers = args.workers or os.cpu_count(), precision = args.precision,
+                                       index = args.index, phases = args.phases)
+    profile.to_csv(args.output if args.output != "-" else sys.stdout, index = False)
+    if args.frames:
+        frames.to_csv(args.frames, index = False)
+    return 0
+
+
+def ecotaxa(args):
+    """EcoTaxa table and images of a folder of particle images, zipped for upload"""
+    from scripts.morphocut_pipelines import make_ecotaxa_folder
+
+    make_ecotaxa_folder(args.name, lat = args.lat, lon = args.lon, date = args.date, ext = args.ext,
+                        raw_folder_path = args.folder)
+    return 0
+
+
+# ---- Arguments ----
+
+def _add_batch_arguments(parser, n = 51):
+    """Options shared by the reconstruction commands"""
+    parser.add_argument("folder", help = "folder of the raw holograms")
+    parser.add_argument("--ext", default = "*.pgm", help = "pattern of the hologram files. Default: *.pgm")
+    parser.add_argument("--n", type = int, default = n, help = "number of focus planes. Default: %d" % n)
+    parser.add_argument("--workers", type = int, default = 1,
+                        help = "number of processes, 0 for all CPUs (or as many as fit in --max-memory). Default: 1")
+    parser.add_argument("--precision", choices = ["double", "single"], default = "double",
+                        help = "precision of the reconstruction. Default: double")
+    parser.add_argument("--index", help = "cast index (.csv) listing the holograms to process")
+    parser.add_argument("--phases", nargs = "+", help = "phases of the cast index to process, e.g. Downcasting")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog = "antics", description = "LISST-Holo hologram processing")
+    commands = parser.add_subparsers(dest = "command", metavar = "COMMAND")
+    commands.required = True
+
+    # metadata
+    p = commands.add_parser("metadata", help = metadata.__doc__, description = metadata.__doc__)
+    p.add_argument("paths", nargs = "+", help = "folders of holograms and/or hologram files")
+    p.add_argument("--ext", default = "*.pgm", help = "pattern of the hologram files in folders. Default: *.pgm")
+    p.add_argument("-o", "--output", help = "output .csv file, - for standard output. Default: standard output, "
+                                            "none with --store")
+    p.add_argument("--cruise", help = "name of the cruise, e.g. DY086")
+    p.add_argument("--event", help = "name of the event, deployment or profile, e.g. 034")
+    p.add_argument("--store", help = "add the new holograms to this Parquet metadata store (folder) instead; "
+                                     "imports pandas and pyarrow")
+    p.set_defaults(func = metadata)
+
+    # clean
+    p = commands.add_parser("clean", help = clean.__doc__, description = clean.__doc__)
+    p.add_argument("input", help = "metadata store (folder) or metadata .csv")
+    p.add_argument("output", help = "output .csv file")
+    p.add_argument("--rolling-window", type = int, default = 5, help = "depth smoothing window. Default: 5")
+    p.add_argument("--tolerance", type = float, default = 0.15,
+                   help = "depth tolerance of the phase detection in m. Default: 0.15")
+    p.add_argument("--depth-threshold", type = float, default = 5, help = "minimum depth in m. Default: 5")
+    p.add_argument("--cast-column", help = "column identifying the cast, to clean many casts at once")
+    p.set_defaults(func = clean)
+
+    # zmin and reconstruct
+    for name, func in (("zmin", zmin), ("reconstruct", reconstruct)):
+        p = commands.add_parser(name, help = func.__doc__, description = func.__doc__)
+        _add_batch_arguments(p)
+        p.add_argument("--chunksize", type = int, help = "holograms handed to a process at a time")
+        p.add_argument("--no-resume", action = "store_true", help = "redo the holograms that are up to date")
+        p.add_argument("--max-memory", help = "memory budget, e.g. 8G; chooses workers, precision and "
+                                              "planes in memory to fit")
+        p.add_argument("--background", type = int, metavar = "FRAMES",
+                       help = "remove a rolling background of this many preceding holograms")
+        p.add_argument("--background-statistic", choices = ["median", "mean"], default = "median",
+                       help = "statistic of the rolling background. Default: median")
+        p.add_argument("--background-mode", choices = ["subtract", "divide"], default = "subtract",
+                       help = "how the background is removed. Default: subtract")
+        p.add_argument("--png-compression", type = int, default = 6,
+                       help = "PNG compression level 0 (fastest) - 9 (smallest). Default: 6")
+        p.add_argument("--encoder-threads", type = int, default = 2,
+                       help = "threads writing the images. Default: 2")
+        p.add_argument("--prefetch", type = int, default = 2, help = "holograms read ahead. Default: 2")
+        p.add_argument("--telemetry", help = "save the time and memory of each stage to this .csv file")
+        p.add_argument("--progress", type = float,
+                       help = "print the throughput and ETA at most every this many seconds")
+        p.set_defaults(func = func)
+        if name == "reconstruct":
+            p.add_argument("--no-stack", action = "store_true", help = "do not save the focal stacks")
+            p.add_argument("--no-gif", action = "store_true", help = "do not save the gifs")
+            p.add_argument("--no-zmin", action = "store_true", help = "do not save the z-min images")
+            p.add_argument("--stack-format", choices = ["png", "hdf5"], default = "png",
+                           help = "one .png per plane or one .h5 file per hologram. Default: png")
+            p.add_argument("--gif-downsample", type = int, default = 1,
+                           help = "average the gif frames over this many pixels. Default: 1")
+
+    # greyness
+    p = commands.add_parser("greyness", help = greyness.__doc__, description = greyness.__doc__)
+    _add_batch_arguments(p, n = 20)
+    p.add_argument("-o", "--output", default = "-", help = "output .csv file of the profile. Default: standard output")
+    p.add_argument("--frames", help = "output .csv file of the holograms used")
+    p.add_argument("--bin-size", type = float, default = 5.0, help = "depth bin size in m. Default: 5")
+    p.add_argument("--per-bin", type = int, default = 3, help = "holograms per depth bin. Default: 3")
+    p.add_argument("--medium-index", type = float, default = 1.333,
+                   help = "refractive index of the medium. Default: 1.333")
+    p.set_defaults(func = greyness)
+
+    # ecotaxa
+    p = commands.add_parser("ecotaxa", help = ecotaxa.__doc__, description = ecotaxa.__doc__)
+    p.add_argument("folder", help = "folder of the particle images")
+    p.add_argument("name", help = "name of the output, e.g. the event")
+    p.add_argument("--lat", type = float, help = "latitude, South negative")
+    p.add_argument("--lon", type = float, help = "longitude, West negative")
+    p.add_argument("--date", help = "date of sampling, YYYY-MM-DD")
+    p.add_argument("--ext", default = ".png", help = "extension of the images. Default: .png")
+    p.set_defaults(func = ecotaxa)
+
+    return parser
+
+
+def main(argv = None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+# the guard keeps worker processes from re-running the command
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,31 @@
 from pathlib import Path
-import pandas as pd
-from tools.LISST_Holo_tools import HoloMetadata
+from tools.LISST_Holo_tools import MetadataStore
 
 
-def extract_metadata_and_save(folder_path):
+def extract_metadata_and_save(folder_path, csv=False):
     """
-    Reads a folder path, extracts metadata from LISST-Holo holograms using HoloMetadata class,
-    and saves the metadata as a CSV file in the same folder.
+    Reads a folder path, extracts metadata from LISST-Holo holograms using HoloMetadataBatch class,
+    and adds it to the metadata store (metadata_store folder) in the same folder.
+    Holograms already in the store are skipped, so re-running after new data arrived
+    only reads the new files. With csv=True, the whole store is also saved as CSV file.
     """
     folder = Path(folder_path)
     if not folder.exists() or not folder.is_dir():
         raise ValueError(f"Invalid folder path: {folder_path}")
 
-    output_file = folder / "metadata_overview.csv"
-    metadata_records = []
+    store = MetadataStore(folder / "metadata_store")
 
-    for image_file in folder.glob("*.pgm"):
-        try:
-            metadata = HoloMetadata(str(image_file))
-            metadata_records.append(metadata.metadata)
-        except Exception as e:
-            print(f"Failed to process {image_file}: {e}")
+    # only the metadata trailers of new files are read, for all files at once
+    metadata = store.update(sorted(folder.glob("*.pgm")))
+    for image_file in metadata.failed:
+        print(f"Failed to process {image_file}: file too short to hold metadata")
 
-    if metadata_records:
-        df = pd.DataFrame(metadata_records, columns=metadata.var_name)
-        df.to_csv(output_file, index=False)
-        print(f"Metadata saved to: {output_file}")
+    if store.parts():
+        print(f"{len(metadata)} new holograms, metadata store: {store.path}")
+        if csv:
+            output_file = folder / "metadata_overview.csv"
+            store.read().drop(columns="File").to_csv(output_file, index=False)
+            print(f"Metadata saved to: {output_file}")
     else:
         print("No valid hologram files found.")
 
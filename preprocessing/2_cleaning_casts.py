@@ -1,5 +1,6 @@
 import os
 import pandas as pd
+from tools.LISST_Holo_tools import MetadataStore, cast_phases
 
 
 def filter_metadata(
@@ -7,54 +8,39 @@ def filter_metadata(
     output_csv,
     rolling_window=5,
     tolerance=0.15,
-    depth_threshold=5
+    depth_threshold=5,
+    cast_column=None
 ):
     """
     Filters metadata to include only Downcasting and Upcasting phases with depth >= threshold.
 
     Parameters:
-    - input_csv (str): Path to the input CSV file.
+    - input_csv (str): Path to the metadata store folder (see 1_extract_metadata.py) or to a CSV file.
     - output_csv (str): Path to save the filtered CSV file.
     - rolling_window (int): Window size for rolling mean to smooth depth data.
     - tolerance (float): Tolerance to handle minor sensor fluctuations in depth.
     - depth_threshold (float): Minimum depth value to include in the filtered data.
+    - cast_column (str): Optional. Column identifying the cast (e.g. "Event"), to clean many casts in one call.
     """
-    # Load metadata CSV
-    metadata_df = pd.read_csv(input_csv)
+    # Load metadata from the store, or from CSV
+    if os.path.isdir(input_csv):
+        metadata_df = MetadataStore(input_csv).read().drop(columns="File")
+    else:
+        metadata_df = pd.read_csv(input_csv)
 
-    # Sort the data by Image column
-    df_sorted = metadata_df.sort_values(by="Image").reset_index(drop=True)
+    # Sort the data by cast and Image column
+    sort_by = ["Image"] if cast_column is None else [cast_column, "Image"]
+    df_sorted = metadata_df.sort_values(by=sort_by).reset_index(drop=True)
 
-    # Apply a rolling average to smooth depth data
-    df_sorted['Smoothed_Depth'] = df_sorted['Depth'].rolling(
-        window=rolling_window, center=True, min_periods=1).mean()
+    # Apply a rolling average (per cast) to smooth depth data
+    depth = df_sorted['Depth'] if cast_column is None else df_sorted.groupby(cast_column, sort=False)['Depth']
+    df_sorted['Smoothed_Depth'] = depth.rolling(
+        window=rolling_window, center=True, min_periods=1).mean().to_numpy()
 
-    # Initialize variables for phase tracking
-    current_phase = "Initial"
-    phases = []
-
-    # Phase determination
-    for i in range(len(df_sorted)):
-        if i == 0:
-            # Start with Phase 1 (Initial)
-            current_phase = "Initial"
-        else:
-            depth_change = df_sorted.loc[i, "Smoothed_Depth"] - df_sorted.loc[i - 1, "Smoothed_Depth"]
-            if current_phase == "Initial" and depth_change < -tolerance:
-                # Transition from Initial to Phase 2 (Return Phase)
-                current_phase = "Return"
-            elif current_phase == "Return" and depth_change > tolerance:
-                # Transition from Phase 2 (Return) to Phase 3 (Downcasting)
-                current_phase = "Downcasting"
-            elif current_phase == "Downcasting" and depth_change < -tolerance:
-                # Transition from Phase 3 (Downcasting) to Phase 4 (Upcasting)
-                current_phase = "Upcasting"
-
-        # Append the current phase to the list
-        phases.append(current_phase)
-
-    # Add the phases as a new column in the dataframe
-    df_sorted["Phase"] = phases
+    # Phase determination: Initial -> Return -> Downcasting -> Upcasting,
+    # all frames (and casts) at once
+    casts = None if cast_column is None else df_sorted[cast_column].to_numpy()
+    df_sorted["Phase"] = cast_phases(df_sorted["Smoothed_Depth"].to_numpy(), tolerance, casts)
 
     # Filter to include only Downcasting (Phase 3) and Upcasting (Phase 4)
     filtered_data = df_sorted[df_sorted["Phase"].isin(["Downcasting", "Upcasting"])].reset_index(drop=True)
@@ -67,15 +53,16 @@ def filter_metadata(
     print(f"Filtered data saved to: {output_csv}")
 
 
-# Example usage
-folder_path = r'D:\mojmas\files\data\hologram\station_02'
-input_csv = os.path.join(folder_path, "metadata_overview.csv")
-output_csv = os.path.join(folder_path, "filtered_metadata.csv")
+if __name__ == "__main__":
+    # Example usage
+    folder_path = r'D:\mojmas\files\data\hologram\station_02'
+    input_csv = os.path.join(folder_path, "metadata_store")
+    output_csv = os.path.join(folder_path, "filtered_metadata.csv")
 
-filter_metadata(
-    input_csv=input_csv,
-    output_csv=output_csv,
-    rolling_window=5,      # Smoothing window
-    tolerance=0.15,        # Tolerance for sensor fluctuations
-    depth_threshold=5      # Depth threshold for filtering
-)
+    filter_metadata(
+        input_csv=input_csv,
+        output_csv=output_csv,
+        rolling_window=5,      # Smoothing window
+        tolerance=0.15,        # Tolerance for sensor fluctuations
+        depth_threshold=5      # Depth threshold for filtering
+    )
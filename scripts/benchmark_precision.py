@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the single precision (complex64) reconstruction.
+
+Reconstructs holograms in double and in single precision and reports the run
+time of both and the largest deviation of the single precision uint8 outputs
+(z-min and rescaled stack planes) from the double precision ones.
+
+Run from the repository root:
+    python -m scripts.benchmark_precision hologram1.pgm [hologram2.pgm ...] [--n 51]
+
+"""
+
+import argparse
+import time
+import numpy as np
+from skimage.util import img_as_ubyte
+from skimage.exposure import rescale_intensity
+from tools.LISST_Holo_tools import (load_hologram, iter_planes, amplitudes, run_reducers,
+                                    ZMin, SpilledStack, get_fft_backend)
+
+
+def reconstruct(image_fn, n, precision):
+    """z-min and stack of a hologram as uint8, and the reconstruction time"""
+    raw_holo = load_hologram(image_fn)
+    zstack = np.linspace(0, 100000, n)
+
+    start = time.perf_counter()
+    focal_planes = iter_planes(raw_holo.pixels, zstack, cfsp = 3, precision = precision)
+    z_min, stack = run_reducers(amplitudes(focal_planes), [ZMin(), SpilledStack(n)])
+    run_time = time.perf_counter() - start
+
+    z_min = img_as_ubyte(rescale_intensity(z_min))
+    planes = np.array([plane for _, _, plane in stack.rescaled_planes()])
+    stack.close()
+
+    return run_time, z_min, planes
+
+
+def max_deviation(a, b):
+    """largest absolute difference and fraction of differing pixels of two uint8 arrays"""
+    diff = np.abs(a.astype(int) - b.astype(int))
+    return diff.max(), (diff > 0).mean()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare single with double precision reconstruction")
+    parser.add_argument("holograms", nargs = "+", help = "raw LISST-Holo holograms (.pgm)")
+    parser.add_argument("--n", type = int, default = 51, help = "number of focus planes. Default: 51")
+    args = parser.parse_args()
+
+    print("FFT backend:", get_fft_backend().name, "with", get_fft_backend().threads, "threads")
+
+    # warm up (FFT plans)
+    for precision in ("double", "single"):
+        reconstruct(args.holograms[0], 2, precision)
+
+    rows = []
+    for image_fn in args.holograms:
+        t_double, z_min_double, stack_double = reconstruct(image_fn, args.n, "double")
+        t_single, z_min_single, stack_single = reconstruct(image_fn, args.n, "single")
+
+        z_min_dev, z_min_frac = max_deviation(z_min_single, z_min_double)
+        stack_dev, stack_frac = max_deviation(stack_single, stack_double)
+        rows.append((t_double, t_single, z_min_dev, stack_dev))
+
+        print(image_fn)
+        print("  time double: %.2f s, single: %.2f s (speed-up %.2f)" % (t_double, t_single, t_double / t_single))
+        print("  z-min max deviation: %d (%.4f%% of pixels differ)" % (z_min_dev, 100 * z_min_frac))
+        print("  stack max deviation: %d (%.4f%% of pixels differ)" % (stack_dev, 100 * stack_frac))
+
+    rows = np.array(rows)
+    print("Overall: speed-up %.2f, max deviation z-min %d, stack %d"
+          % (rows[:, 0].sum() / rows[:, 1].sum(), rows[:, 2].max(), rows[:, 3].max()))
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Performance benchmark of the processing stages on synthetic holograms.
+
+Writes a synthetic cast (see synthetic_cast in tools/LISST_Holo_tools.py)
+and times each stage: metadata extraction, loading, transfer function build,
+propagation, z-min, image encoding and cast cleaning, and the whole z-min
+batch for each worker count. The propagation stages are timed for each
+number of planes. Results are reported as frames/s and peak RSS, and saved
+as JSON to be compared between releases.
+
+Run from the repository root:
+    python -m scripts.benchmark_suite [--frames 40] [--planes 11 51] [--workers 1 2] [--output results.json]
+
+"""
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+from tools.LISST_Holo_tools import (synthetic_cast, HoloMetadataBatch, load_hologram, iter_trans_func,
+                                    iter_planes, amplitudes, run_reducers, ZMin, SpilledStack,
+                                    PngStackWriter, ImageEncoder, rescale_to_ubyte, zmin_batch,
+                                    get_fft_backend, IMAGE_SHAPE, SPACING, MEDIUM_INDEX, ILLUM_WAVELEN)
+
+
+def reset_peak_rss():
+    """Reset the peak RSS of this process, where Linux allows it"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak RSS of this process in MB, since the last reset_peak_rss on Linux"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20
+
+
+def children_peak_rss_mb():
+    """Largest peak RSS of the finished worker processes in MB"""
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 2 ** 20
+
+
+def timed(results, stage, frames, func, n_planes = None, workers = 1):
+    """Run func, print and append the result of a stage"""
+    reset_peak_rss()
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+    result = {"stage": stage, "n_planes": n_planes, "workers": workers, "frames": frames,
+              "seconds": seconds, "frames_per_s": frames / seconds if seconds > 0 else None,
+              "peak_rss_mb": peak_rss_mb()}
+    if workers > 1:
+        result["peak_rss_workers_mb"] = children_peak_rss_mb()
+    results.append(result)
+    print("%-10s planes %4s workers %2d: %8.2f frames/s, %7.3f s, peak RSS %6.0f MB"
+          % (stage, n_planes or "-", workers, result["frames_per_s"] or 0, seconds, result["peak_rss_mb"]))
+    return result
+
+
+def git_version():
+    """git describe of the repository, or None"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output = True, text = True,
+                              cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(folder, frames, planes, workers, sample, version):
+    """Benchmark all stages on a synthetic cast written to folder; returns the list of results"""
+    raw = os.path.join(folder, "raw")
+    cast = synthetic_cast(raw, n_frames = frames, version = version)
+    image_fns = [str(f) for f in cast["File"]]
+    sampled = image_fns[:sample]
+    results = []
+
+    meta = []
+    timed(results, "metadata", len(image_fns), lambda: meta.append(HoloMetadataBatch(image_fns)))
+    timed(results, "load", len(image_fns), lambda: [np.array(load_hologram(f).pixels) for f in image_fns])
+
+    # cast cleaning of the metadata table (preprocessing/2_cleaning_casts.py)
+    cleaning = importlib.import_module("preprocessing.2_cleaning_casts")
+    metadata_csv = os.path.join(folder, "metadata.csv")
+    meta[0].to_dataframe().to_csv(metadata_csv, index = False)
+    timed(results, "cleaning", len(image_fns),
+          lambda: cleaning.filter_metadata(metadata_csv, os.path.join(folder, "cleaned.csv")))
+
+    encoder = ImageEncoder(threads = 0)
+    for n in planes:
+        zstack = np.linspace(0, 100000, n)
+        holo = load_hologram(sampled[0]).pixels
+
+        def kernels():
+            for _ in iter_trans_func(IMAGE_SHAPE, SPACING, zstack, ILLUM_WAVELEN / MEDIUM_INDEX, cfsp = 3,
+                                     shifted = False):
+                pass
+        timed(results, "kernels", 1, kernels, n_planes = n)
+
+        def propagation():
+            for f in sampled:
+                for _ in amplitudes(iter_planes(load_hologram(f).pixels, zstack, cfsp = 3)):
+                    pass
+        timed(results, "propagate", len(sampled), propagation, n_planes = n)
+
+        def z_min():
+            for f in sampled:
+                z_min, = run_reducers(amplitudes(iter_planes(load_hologram(f).pixels, zstack, cfsp = 3)), [ZMin()])
+                rescale_to_ubyte(z_min)
+        timed(results, "z_min", len(sampled), z_min, n_planes = n)
+
+        # encoding of the rescaled stack of one hologram, as .png per plane
+        stack, = run_reducers(amplitudes(iter_planes(holo, zstack, cfsp = 3)), [SpilledStack(n)])
+        planes_out = os.path.join(folder, "stacks")
+        os.makedirs(planes_out, exist_ok = True)
+
+        def encoding():
+            for k in range(len(sampled)):
+                run_reducers(stack.rescaled_planes(), [PngStackWriter(planes_out, "frame%d" % k, encoder = encoder)])
+            encoder.flush()
+        timed(results, "encode", len(sampled), encoding, n_planes = n)
+        stack.close()
+
+        for w in workers:
+            timed(results, "zmin_batch", len(image_fns),
+                  lambda: zmin_batch(raw, n = n, workers = w, resume = False),
+                  n_planes = n, workers = w)
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the processing stages on synthetic holograms")
+    parser.add_argument("--frames", type = int, default = 40, help = "holograms of the synthetic cast. Default: 40")
+    parser.add_argument("--planes", type = int, nargs = "+", default = [11, 51],
+                        help = "numbers of focus planes. Default: 11 51")
+    parser.add_argument("--workers", type = int, nargs = "+", default = [1, 2],
+                        help = "worker counts of the batch. Default: 1 2")
+    parser.add_argument("--sample", type = int, default = 5,
+                        help = "holograms of the single-process stages. Default: 5")
+    parser.add_argument("--version", type = int, default = 2, choices = [1, 2],
+                        help = "LISST-Holo version of the metadata. Default: 2")
+    parser.add_argument("--folder", help = "folder for the synthetic data. Default: temporary, deleted after")
+    parser.add_argument("--output", help = "JSON file of the results. Default: print only")
+    args = parser.parse_args()
+
+    def suite(folder):
+        return run_suite(folder, args.frames, args.planes, args.workers, args.sample, args.version)
+
+    if args.folder:
+        results = suite(args.folder)
+    else:
+        with tempfile.TemporaryDirectory() as folder:
+            results = suite(folder)
+
+    report = {"version": git_version(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(),
+              "numpy": np.__version__,
+              "platform": platform.platform(),
+              "cpu_count": os.cpu_count(),
+              "fft_backend": get_fft_backend().name,
+              "fft_threads": get_fft_backend().threads,
+              "frames": args.frames,
+              "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent = 2)
+        print("Results saved to", args.output)
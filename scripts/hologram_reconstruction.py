@@ -10,12 +10,13 @@ Created on Tue Jun 07 11:34:13 2022
 import time
 timer1 = time.perf_counter()
 
-import holopy as hp
 import numpy as np
 import os
 import glob
-import shutil
 import pandas as pd
+# tools/ has to be importable, e.g. with the repository in PYTHONPATH
+from tools.LISST_Holo_tools import (load_hologram, iter_planes, amplitudes, run_reducers, SpilledStack,
+                                    Hdf5StackWriter)
 
 
 #%%  set working directory as file directory
@@ -110,8 +111,9 @@ df = pd.DataFrame(data, columns=['Filename', 'Depth'])
 ## image propogation: define distance between image plane and reconstruction plane
 zstack = np.linspace(0, 100000, 217)
 
-# create a list of numbers for sliced hologram filenames
-num_list = [str(i).zfill(3) for i in range(1,218)]
+# the 217 slices of all holograms are saved in one chunked, compressed file
+# instead of a .png per slice (read with HoloStackFile)
+stack_fn = os.path.join(wd, "stacks.h5")
 
 
 for jlop in range(len(filein)):
@@ -121,22 +123,17 @@ for jlop in range(len(filein)):
     fileout= fileout[-1][0:-4]
     print(fileout)
     depth = hologram_depth(filein[jlop])    
- 
-    # create individual filenames for each slice
-    fileout3=[]
-    for ilop in num_list:
-        a=fileout+"\\"+fileout+"_" + ilop +".png"
-        fileout3.append(a)
-    os.mkdir(fileout)
     
     # load in the and propogate hologram
-    raw_holo = hp.load_image(filein[jlop], spacing=4.4, medium_index = 1, illum_wavelen = 0.658)
-    rec_vol = hp.propagate(raw_holo, zstack, cfsp = 3)
+    raw_holo = load_hologram(filein[jlop])
+    rec_vol = iter_planes(raw_holo.pixels, zstack, spacing = 4.4, medium_index = 1, illum_wavelen = 0.658, cfsp = 3)
+    stack, = run_reducers(amplitudes(rec_vol), [SpilledStack(len(zstack))])
     
-    
-    # save 217 images slices in hologram-specific directory
-    hp.core.save_images(fileout3, rec_vol, scaling=('auto'), depth=8)
-    shutil.move(filein[jlop], fileout+"\\")
+    # save 217 images slices as a frame of the stack file
+    writer = Hdf5StackWriter(stack_fn, fileout, zstack, in_range = stack.in_range,
+                             attrs = {'spacing': 4.4, 'medium_index': 1, 'illum_wavelen': 0.658})
+    run_reducers(stack.rescaled_planes(), [writer])
+    stack.close()
     
     # for f in fileout[101:]: # [:13] deletes the first 13, current deletes the last 13
     #    os.remove(f)
@@ -13,8 +13,6 @@ Created on Fri Nov  4 13:02:20 2022
  
 # ---- Required packages ----
 import os, os.path
-import tkinter as tk
-from tkinter import filedialog
 from morphocut.core import Pipeline, Call
 from morphocut.file import Find, Glob
 from morphocut.image import ImageProperties, ImageReader
@@ -23,7 +21,7 @@ from morphocut.str import Format
 from morphocut.contrib.ecotaxa import EcotaxaWriter
 from morphocut.contrib.zooprocess import CalculateZooProcessFeatures
 
-def make_ecotaxa_folder(folder_name, lat = None, lon = None, date = None, ext = ".png"):
+def make_ecotaxa_folder(folder_name, lat = None, lon = None, date = None, ext = ".png", raw_folder_path = None):
     """
     Make ecotaxa table and pack table and all images into folder (zipped) for direct upload into Ecotaxa.
     
@@ -39,6 +37,8 @@ def make_ecotaxa_folder(folder_name, lat = None, lon = None, date = None, ext =
         Date of sampling
     ext: str
         Extension of images (e.g. ".bmp", ".png")
+    raw_folder_path: str
+        Optional. Folder of the images. Default: chosen in a dialog
     
     Returns
     --------
@@ -51,11 +51,16 @@ def make_ecotaxa_folder(folder_name, lat = None, lon = None, date = None, ext =
     """
     
     # prompt for choosing folder
-    root = tk.Tk()
-    root.attributes('-topmost', 1)
-    root.withdraw()
-    raw_folder_path = filedialog.askdirectory()
-    root.update()
+    if raw_folder_path is None:
+        import tkinter as tk
+        from tkinter import filedialog
+
+        root = tk.Tk()
+        root.attributes('-topmost', 1)
+        root.withdraw()
+        raw_folder_path = filedialog.askdirectory()
+        root.update()
+    raw_folder_path = os.path.abspath(raw_folder_path)
     os.chdir(raw_folder_path)
     
     # make directory for extraction
@@ -67,52 +72,50 @@ def make_ecotaxa_folder(folder_name, lat = None, lon = None, date = None, ext =
     print("Files will be extracted to: " + output_path)
     
     # MorphoCut pipeline
-    if __name__ == "__main__":
-    
-        with Pipeline() as p:
+    with Pipeline() as p:
     
-            # [Stream] Find path of .bmp files in input path
-            fn = Find(raw_folder_path, [ext])
+        # [Stream] Find path of .bmp files in input path
+        fn = Find(raw_folder_path, [ext])
     
-            # --- metadata table ---
-            # Extract file path (Corresponds to `for path in glob(pattern):`)
-            path = Glob(fn)
-            
-            # Remove path and extension from the filename
-            basename = Call(lambda x: os.path.splitext(os.path.basename(x))[0], path)
-            
-            thisdict = {
-              "id": Format("{object_id}", object_id = basename),
-              "lat": lat,
-              "lon": lon,
-              "date": date,
-            }
+        # --- metadata table ---
+        # Extract file path (Corresponds to `for path in glob(pattern):`)
+        path = Glob(fn)
+        
+        # Remove path and extension from the filename
+        basename = Call(lambda x: os.path.splitext(os.path.basename(x))[0], path)
+        
+        thisdict = {
+          "id": Format("{object_id}", object_id = basename),
+          "lat": lat,
+          "lon": lon,
+          "date": date,
+        }
     
-            # --- image processing ---
-            # [Stream] Read and open image from path. Note, it's already black-and-white
-            img = ImageReader(fn)
-                      
-            # Make object mask
-            mask = img < 120
-          
-            # Calculate object properties (area, eccentricity, equivalent_diameter, mean_intensity, ...). See skimage.measure.regionprops.
-            regionprops = ImageProperties(mask, img)           
+        # --- image processing ---
+        # [Stream] Read and open image from path. Note, it's already black-and-white
+        img = ImageReader(fn)
+                  
+        # Make object mask
+        mask = img < 120
+      
+        # Calculate object properties (area, eccentricity, equivalent_diameter, mean_intensity, ...). See skimage.measure.regionprops.
+        regionprops = ImageProperties(mask, img)           
        
-            # Append object properties to metadata in a ZooProcess-like format
-            meta = CalculateZooProcessFeatures(regionprops, thisdict)
-            # End of parallel execution
+        # Append object properties to metadata in a ZooProcess-like format
+        meta = CalculateZooProcessFeatures(regionprops, thisdict)
+        # End of parallel execution
     
-            # [Stream] Here, three different versions are written. Remove what you do not need.
-            EcotaxaWriter(
-                os.path.join(output_path, "EcoTaxa_" + folder_name + ".zip"),
-                [
-                    # The original RGB image
-                    (Format("{object_id}.jpg", object_id = basename), img),
-                ],
-                object_meta = meta,
-            )
+        # [Stream] Here, three different versions are written. Remove what you do not need.
+        EcotaxaWriter(
+            os.path.join(output_path, "EcoTaxa_" + folder_name + ".zip"),
+            [
+                # The original RGB image
+                (Format("{object_id}.jpg", object_id = basename), img),
+            ],
+            object_meta = meta,
+        )
     
-            # Progress bar
-            Progress(fn)
+        # Progress bar
+        Progress(fn)
     
-        p.run()# Requires MorphoCut developer version.
\ No newline at end of file
+    p.run()# Requires MorphoCut developer version.
\ No newline at end of file
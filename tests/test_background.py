@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from tools.LISST_Holo_tools import RollingBackground
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.int16, np.float32, np.float64])
+@pytest.mark.parametrize("frames", [1, 2, 3, 5, 8])
+def test_median_matches_numpy(dtype, frames):
+    rng = np.random.default_rng(frames)
+    # values above 127 and repeated values, around the range of raw holograms
+    stack = rng.integers(100, 256, size = (3 * frames + 4, 6, 7)).astype(dtype)
+    if dtype in (np.float32, np.float64):
+        stack += rng.random(stack.shape).astype(dtype)
+    background = RollingBackground(frames = frames, statistic = 'median')
+    for k, frame in enumerate(stack):
+        result = background.update(frame)
+        expected = np.median(stack[max(0, k + 1 - frames):k + 1].astype(np.float64), axis = 0)
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_median_of_bright_constant_frames():
+    background = RollingBackground(frames = 5, statistic = 'median')
+    for _ in range(5):
+        result = background.update(np.full((4, 4), 200, dtype = np.uint8))
+    assert np.all(result == 200)
+
+
+def test_mean_matches_numpy():
+    rng = np.random.default_rng(0)
+    stack = rng.integers(0, 256, size = (12, 5, 5), dtype = np.uint8)
+    background = RollingBackground(frames = 4, statistic = 'mean')
+    for k, frame in enumerate(stack):
+        result = background.update(frame)
+        np.testing.assert_allclose(result, stack[max(0, k - 3):k + 1].mean(axis = 0))
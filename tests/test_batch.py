@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+
+import pytest
+
+from tools.LISST_Holo_tools import reconstruct_batch, synthetic_cast
+
+pytest.importorskip("skimage")
+
+
+@pytest.fixture(scope = "module")
+def cast(tmp_path_factory):
+    """Three synthetic holograms, written once"""
+    folder = tmp_path_factory.mktemp("cast").joinpath("raw")
+    synthetic_cast(folder, n_frames = 3, particles = (0, 2))
+    return folder
+
+
+@pytest.fixture
+def raw(cast, tmp_path):
+    """A copy of the cast to process"""
+    return shutil.copytree(cast, tmp_path.joinpath("raw"))
+
+
+def _run(raw, **kwargs):
+    """Reconstruct gifs and z-mins; {hologram: kinds of output made} and {hologram: error}"""
+    results = reconstruct_batch(raw, n = 3, make_stack = False, gif_downsample = 8, **kwargs)
+    return ({image_fn.name: sorted(result) for image_fn, result, _ in results if result is not None},
+            {image_fn.name: error for image_fn, _, error in results if error is not None})
+
+
+def _records(manifest_fn):
+    """Last record of each input of a manifest"""
+    with open(manifest_fn) as f:
+        return {record['input']: record for record in map(json.loads, f)}
+
+
+def test_rerun_skips_everything(raw):
+    done, failed = _run(raw)
+    assert len(done) == 3 and not failed
+    assert _run(raw) == ({}, {})
+
+
+def test_changed_input_is_redone(raw):
+    _run(raw)
+    first, second = sorted(raw.glob("*.pgm"))[:2]
+    # a touched hologram with the same content is still up to date
+    os.utime(first, (0, 0))
+    data = bytearray(second.read_bytes())
+    data[100] ^= 0xFF
+    second.write_bytes(bytes(data))
+    assert _run(raw) == ({second.name: ['gif', 'z_min']}, {})
+    assert _run(raw) == ({}, {})
+
+
+def test_missing_output_is_redone(raw):
+    _run(raw)
+    gif_fn = sorted(raw.parent.joinpath("gifs").glob("*.gif"))[1]
+    gif_fn.unlink()
+    done, failed = _run(raw)
+    assert list(done.values()) == [['gif']] and not failed
+    assert gif_fn.exists()
+
+
+def test_truncated_input_is_failed_and_retried(raw):
+    bad_fn = raw.joinpath("truncated.pgm")
+    bad_fn.write_bytes(sorted(raw.glob("*.pgm"))[0].read_bytes()[:1000])
+    done, failed = _run(raw)
+    assert len(done) == 3 and list(failed) == [bad_fn.name]
+    record = _records(raw.parent.joinpath("z_min", "manifest.jsonl"))[str(bad_fn.resolve())]
+    assert record['status'] == 'failed' and record['size'] == 1000
+
+    # failed holograms are retried, the others are skipped
+    done, failed = _run(raw)
+    assert not done and list(failed) == [bad_fn.name]
+
+
+def test_unreadable_input_is_failed(raw):
+    # a hologram of the cast index that is no longer on disk
+    missing_fn = raw.joinpath("missing.pgm")
+    index_fn = raw.joinpath("index.csv")
+    index_fn.write_text("File,Phase\n" + "".join(f.name + ",Downcasting\n"
+                                                 for f in sorted(raw.glob("*.pgm")) + [missing_fn]))
+    done, failed = _run(raw, index = index_fn)
+    assert len(done) == 3 and list(failed) == [missing_fn.name]
+    for kind in ("gifs", "z_min"):
+        record = _records(raw.parent.joinpath(kind, "manifest.jsonl"))[str(missing_fn.resolve())]
+        assert record['status'] == 'failed' and record['sha1'] is None
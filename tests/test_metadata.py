@@ -0,0 +1,27 @@
+import io
+
+import numpy as np
+
+from tools.LISST_Holo_metadata import write_metadata_csv
+from tools.LISST_Holo_tools import HoloMetadataBatch, write_hologram
+
+
+def test_stdlib_reader_matches_bulk_reader(tmp_path):
+    pixels = np.zeros((1200, 1600), dtype = np.uint8)
+    image_fns = []
+    for k, (version, depth, temperature) in enumerate([(1, 3.2, 14.5), (2, 57.25, 6.1), (2, 0.0, 21.0),
+                                                        (1, 120.0, 2.5)]):
+        image_fns.append(tmp_path.joinpath("holo_v%d_%d.pgm" % (version, k)))
+        write_hologram(image_fns[-1], pixels, depth = depth, temperature = temperature,
+                       epoch = 1650000000 + 2 * k, version = version)
+    short_fn = tmp_path.joinpath("short.pgm")
+    short_fn.write_bytes(image_fns[0].read_bytes()[:5000])
+    image_fns.insert(2, short_fn)
+
+    meta = HoloMetadataBatch(image_fns, cruise = "DY086", event = "034")
+    expected = meta.to_dataframe().to_csv(index = False, lineterminator = "\n")
+
+    output = io.StringIO()
+    written, failed = write_metadata_csv(image_fns, output, cruise = "DY086", event = "034")
+    assert output.getvalue() == expected
+    assert written == 4 and failed == [short_fn] and list(meta.failed) == [short_fn]
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+import tools.LISST_Holo_tools as tools
+from tools.LISST_Holo_tools import (FFT_BACKENDS, ILLUM_WAVELEN, MEDIUM_INDEX, SPACING, ReconstructionWorkspace,
+                                    TransferFunctionCache, iter_planes, propagate_array, set_fft_backend,
+                                    trans_func)
+
+
+def test_recurrence_setup_is_reused(monkeypatch):
+    rng = np.random.default_rng(0)
+    d = np.linspace(0, 100000, 11)
+    cache = TransferFunctionCache()
+    calls = []
+    kz = tools._kz
+
+    def counted_kz(*args):
+        calls.append(args)
+        return kz(*args)
+
+    monkeypatch.setattr(tools, "_kz", counted_kz)
+
+    first = [field.copy() for _, _, field in iter_planes(rng.random((32, 48)), d, cache = cache)]
+    assert len(calls) == 1 and cache.misses == 1
+
+    holo = rng.random((32, 48))
+    second = [field.copy() for _, _, field in iter_planes(holo, d, cache = cache)]
+    assert len(calls) == 1 and cache.hits == 1
+    assert not np.array_equal(first[1], second[1])
+
+    uncached = [field.copy() for _, _, field in iter_planes(holo, d, cache = None)]
+    np.testing.assert_array_equal(np.array(second), np.array(uncached))
+
+
+@pytest.fixture(params = sorted(FFT_BACKENDS))
+def fft_backend(request, monkeypatch, tmp_path):
+    # the backend is global and kept in the environment, both are restored afterwards
+    monkeypatch.setattr(tools, "_fft_backend", None)
+    monkeypatch.setenv("ANTICS_FFT_BACKEND", request.param)
+    monkeypatch.setenv("ANTICS_FFT_THREADS", "1")
+    kwargs = {}
+    if request.param == 'pyfftw':
+        kwargs = {'wisdom_fn': tmp_path.joinpath("wisdom"), 'planner_effort': 'FFTW_ESTIMATE'}
+    try:
+        return set_fft_backend(request.param, threads = 1, **kwargs)
+    except ImportError:
+        pytest.skip(request.param + " is not installed")
+
+
+def _reference(holo, d):
+    """Planes propagated with numpy and exact transfer functions, in double precision"""
+    ft = np.fft.fft2(holo)
+    med_wavelen = ILLUM_WAVELEN / MEDIUM_INDEX
+    return np.array([holo if z == 0 else
+                     np.fft.ifft2(ft * np.fft.ifftshift(trans_func(holo.shape, SPACING, z, med_wavelen,
+                                                                   method = 'exact')[0]))
+                     for z in d])
+
+
+@pytest.mark.parametrize("precision", ["double", "single"])
+@pytest.mark.parametrize("method", ["exact", "auto"])
+@pytest.mark.parametrize("cached", [False, True])
+@pytest.mark.parametrize("d", [np.linspace(0, 100000, 11), np.array([0, 2000, 7000, 30000, 31000, 90000])],
+                         ids = ["even", "uneven"])
+def test_planes_match_exact(fft_backend, precision, method, cached, d):
+    holo = np.random.default_rng(1).random((40, 56)) * 255
+    expected = _reference(holo, d)
+    atol = np.abs(expected).max() * (1e-9 if precision == 'double' else 1e-4)
+    cache = TransferFunctionCache() if cached else None
+
+    # the second hologram through the cache takes the transfer functions of the first
+    for _ in range(2 if cached else 1):
+        planes = propagate_array(holo, d, cache = cache, method = method, precision = precision)
+        np.testing.assert_allclose(planes, expected, rtol = 0, atol = atol)
+
+    workspace = ReconstructionWorkspace(holo.shape, precision = precision)
+    for i, z, field in iter_planes(holo, d, cache = cache, method = method, workspace = workspace):
+        np.testing.assert_allclose(field, expected[i], rtol = 0, atol = atol)
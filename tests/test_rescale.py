@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from tools.LISST_Holo_tools import rescale_to_ubyte
+
+img_as_ubyte = pytest.importorskip("skimage").img_as_ubyte
+rescale_intensity = pytest.importorskip("skimage.exposure").rescale_intensity
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+@pytest.mark.parametrize("in_range", ['image', (0.2, 0.7), (-0.5, 0.5), (0.3, 0.3)])
+@pytest.mark.parametrize("offset", [0.0, -0.6])
+def test_rescale_matches_skimage(dtype, in_range, offset):
+    image = (np.random.default_rng(2).random((30, 40)) + offset).astype(dtype)
+    expected = img_as_ubyte(rescale_intensity(image, in_range = in_range))
+    np.testing.assert_array_equal(rescale_to_ubyte(image, in_range = in_range), expected)
+
+    # with the buffers of a workspace
+    out, work = np.empty(image.shape, dtype = np.uint8), np.empty_like(image)
+    assert rescale_to_ubyte(image, in_range = in_range, out = out, work = work) is out
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_rescale_of_constant_image():
+    image = np.full((5, 5), 0.4)
+    np.testing.assert_array_equal(rescale_to_ubyte(image), img_as_ubyte(rescale_intensity(image)))
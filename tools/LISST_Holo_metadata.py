@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata of raw LISST-Holo holograms with the standard library only.
+
+Light counterpart of the bulk metadata reader of LISST_Holo_tools (see
+HoloMetadataBatch): the file layout and the column names are defined here
+and used by both, and the trailer of each hologram is decoded with struct,
+so metadata-only jobs (e.g. `antics.py metadata`) start without importing
+numpy or pandas.
+
+"""
+
+# ---- Required packages ----
+import csv
+import datetime
+import math
+import struct
+from pathlib import Path
+
+
+# ---- Hologram file layout ----
+
+# Layout of the raw hologram file: PGM header, 1600 x 1200 bytes of pixels,
+# then the two 1024 byte metadata blocks (see HoloMetadata).
+IMAGE_SHAPE = (1200, 1600)
+START_METADATA = 1600*1200+18-1
+TRAILER_BYTES = 2 * 1024
+
+# Block 2 fields as (name, numpy format, offset) (LISST-Holo manual v3, p.69).
+# The "LL" fields in HoloMetadata are read as their first 4 byte word, which
+# is what struct returns on Windows, so only the low word is kept here.
+BLOCK2_FIELDS = [
+    ('epoch', '<u4', 0), ('pressure_counts', '<u4', 8), ('temperature_counts', '<u2', 16),
+    ('voltage_counts', '<u2', 18),
+    ('exposure', '<u2', 20), ('laser_power', '<u2', 22), ('laser_diode', '<u2', 24),
+    ('brightness', '<u2', 26), ('brightness_min', '<u2', 28), ('brightness_max', '<u2', 30),
+    ('shutter', '<u2', 32), ('shutter_min', '<u2', 34), ('shutter_max', '<u2', 36),
+    ('gain', '<u2', 38), ('gain_min', '<u2', 40), ('gain_max', '<u2', 42),
+    ('depth_a', '<f4', 116), ('depth_b', '<f4', 120), ('depth_c', '<f4', 124),
+    ('temp_a', '<f4', 128), ('temp_b', '<f4', 132), ('temp_c', '<f4', 136),
+    ('temp_slope', '<f4', 140), ('temp_offset', '<f4', 144),
+    ('aux2', '<u4', 148), ('aux3', '<u4', 152), ('aux4', '<u4', 156), ('aux5', '<u4', 160),
+    ('aux6', '<u4', 164),
+    ('frame_delay', '<u2', 172), ('timestamp_msec', '<u4', 174), ('serial_number', 'S4', 182),
+    ('reserved', ('u1', 837), 187)]
+
+# Column names shared with HoloMetadata.var_name
+METADATA_COLUMNS = [
+    "Cruise", "Event", "Image", "Datetime", "Depth", "Temperature",
+    "Pressure counts", "Temperature counts", "Power supply voltage counts",
+    "Exposure time in 600ns increments", "Laser power counts",
+    "Laser photo diode reading counts",
+    "Camera brightness", "Camera brightness min", "Camera brightness max",
+    "Camera shutter", "Camera shutter min", "Camera shutter max",
+    "Camera gain", "Camera gain min", "Camera gain max",
+    "Depth coef A", "Depth coef B", "Depth coef C",
+    "Temp coef A", "Temp coef B", "Temp coef C", "Temp coef slope", "Temp coef offset",
+    "Aux channel 2", "Aux channel 3", "Aux channel 4", "Aux channel 5", "Aux channel 6",
+    "Inter-frame delay msec", "Timestamp msec", "Serial number", "LISST-Holo version"]
+
+# struct formats of the numpy formats of BLOCK2_FIELDS
+_STRUCT_FORMATS = {'<u4': '<I', '<u2': '<H', '<f4': '<f', 'S4': '4s'}
+
+
+# ---- Metadata reader ----
+
+def read_block2(image_fn):
+    """
+    Block 2 of a hologram as dict of the BLOCK2_FIELDS, None if the file is
+    too short to hold metadata. Only the trailer of the file is read.
+    """
+    with open(image_fn, 'rb') as f:
+        f.seek(START_METADATA)
+        trailer = f.read(TRAILER_BYTES)
+    if len(trailer) != TRAILER_BYTES:
+        return None
+
+    fields = {}
+    for name, fmt, offset in BLOCK2_FIELDS:
+        if isinstance(fmt, tuple):
+            fields[name] = trailer[offset:offset + fmt[1]]
+        else:
+            fields[name], = struct.unpack_from(_STRUCT_FORMATS[fmt], trailer, offset)
+    # as numpy's bytes fields, without trailing zero bytes
+    fields['serial_number'] = fields['serial_number'].rstrip(b'\0')
+    return fields
+
+
+def calibrate_block2(fields):
+    """
+    Depth (m), temperature (degC) and LISST-Holo version of a hologram.
+
+    Single-hologram version of calibrate_metadata in LISST_Holo_tools, with
+    the same calculations and results, also for counts out of the range of
+    the thermistor calibration (infinite or nan as in numpy).
+    """
+    # The end of block 2 is empty for the LISST-Holo1 (see HoloMetadata)
+    lisst_version = 2 if any(fields['reserved']) else 1
+    holo1 = lisst_version == 1
+
+    p = float(fields['pressure_counts'])
+    t = float(fields['temperature_counts'])
+    a, b, c = fields['depth_a'], fields['depth_b'], fields['depth_c']
+
+    # Depth (in m)
+    depth = p * p * a + p * b + c if holo1 else p * b + c
+
+    # Temperature (in C): convert counts from ADC to resistance
+    V = t * 0.001 if holo1 else t * 4.096 / 65535
+    Rt = _divide(10000 * V if holo1 else 13000.0 * V, 4.096 - V)
+
+    # Approximate the thermistors temperature response curve
+    LRt = _log(Rt)
+    Temp = _divide(1, fields['temp_a'] + fields['temp_b']*LRt + fields['temp_c']*(LRt*LRt*LRt)) - 273.15
+
+    # Temperature adjustment
+    temperature = Temp * fields['temp_slope'] + fields['temp_offset']
+
+    return depth, temperature, lisst_version
+
+
+def _divide(x, y):
+    """x / y, infinite or nan for y = 0 as in numpy"""
+    if y != 0:
+        return x / y
+    if x == 0 or math.isnan(x):
+        return math.nan
+    return math.copysign(math.inf, x) * math.copysign(1.0, y)
+
+
+def _log(x):
+    """Natural logarithm, -inf for 0 and nan for negative x as in numpy"""
+    if x > 0:
+        return math.log(x)
+    return -math.inf if x == 0 else math.nan
+
+
+def metadata_row(image_fn, fields, cruise = None, event = None):
+    """Metadata of a hologram as list in the order of METADATA_COLUMNS (as HoloMetadataBatch.columns)"""
+    depth, temperature, lisst_version = calibrate_block2(fields)
+    # same (local time) conversion as HoloMetadata
+    row = [cruise, event, Path(image_fn).stem, str(datetime.datetime.fromtimestamp(fields['epoch'])),
+           depth, temperature]
+    row += [fields[name] for name, _, _ in BLOCK2_FIELDS[1:31]]
+    row += [fields['serial_number'].decode('ascii', 'replace'), lisst_version]
+    return row
+
+
+def write_metadata_csv(image_fns, csv_file, cruise = None, event = None):
+    """
+    Write the metadata of holograms as .csv, one row per hologram.
+
+    Same table as HoloMetadataBatch(image_fns, cruise, event).to_dataframe().to_csv(index = False),
+    written row by row with the csv module.
+
+    Parameters
+    ----------
+    image_fns: list
+        The file locations of the raw holograms
+    csv_file: str or file
+        Output file name, or an open text file (e.g. sys.stdout)
+    cruise: str
+        Optional. Name of cruise.
+    event: str
+        Optional. Name of event (i.e. deployment number, station).
+
+    Returns
+    --------
+    written: integer
+        Number of holograms written
+    failed: list
+        Files that were too short to hold metadata
+    """
+    if isinstance(csv_file, (str, Path)):
+        with open(csv_file, 'w', newline = '') as f:
+            return write_metadata_csv(image_fns, f, cruise = cruise, event = event)
+
+    writer = csv.writer(csv_file, lineterminator = '\n')
+    writer.writerow(METADATA_COLUMNS)
+    written, failed = 0, []
+    for image_fn in image_fns:
+        fields = read_block2(image_fn)
+        if fields is None:
+            failed.append(image_fn)
+            continue
+        # missing values are empty, as in pandas
+        writer.writerow(['' if v is None or (isinstance(v, float) and math.isnan(v)) else v
+                         for v in metadata_row(image_fn, fields, cruise, event)])
+        written += 1
+    return written, failed
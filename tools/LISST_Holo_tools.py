@@ -9,22 +9,32 @@ Created on Fri Jul 15 13:09:06 2022
 
 # ---- Required packages ----
 import os
+import sys
+import time
 import datetime
 import struct
 import re
+import hashlib
+import tempfile
+import mmap
+import pickle
+import json
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial, wraps
 import pandas as pd
 from pathlib import Path, PurePath
 from dateutil.parser import parse
-import holopy as hp
 import numpy as np
-from skimage import io
 from PIL import Image
-from skimage.util import img_as_ubyte
-from skimage.exposure import rescale_intensity
 from math import log
 import glob
 import shutil
 import ntpath
+# holopy, xarray and skimage are imported where they are used, they take
+# seconds to import and most functions do not need them
+from tools.LISST_Holo_metadata import (IMAGE_SHAPE, START_METADATA, TRAILER_BYTES, BLOCK2_FIELDS,
+                                       METADATA_COLUMNS)
 
 
 # ---- Functions and Classes ----
@@ -328,9 +338,3404 @@ class HoloMetadata:
         self.metadata = meta
         self.var_name = coln
 
-def export_metadata_batch(raw_folder_path, cruise, event, ext = '*.pgm'):
+
+# ---- Bulk metadata reader ----
+
+# The layout of the raw hologram file (IMAGE_SHAPE, START_METADATA,
+# TRAILER_BYTES, BLOCK2_FIELDS) and METADATA_COLUMNS are defined in
+# LISST_Holo_metadata, which reads metadata without numpy.
+
+# Block 2 as a single structured dtype (LISST-Holo manual v3, p.69)
+BLOCK2_DTYPE = np.dtype({
+    'names': [name for name, _, _ in BLOCK2_FIELDS],
+    'formats': [fmt for _, fmt, _ in BLOCK2_FIELDS],
+    'offsets': [offset for _, _, offset in BLOCK2_FIELDS],
+    'itemsize': 1024,
+})
+
+# block 2 fields in the order of METADATA_COLUMNS[6:36]
+_BLOCK2_COLUMNS = BLOCK2_DTYPE.names[1:31]
+
+
+def read_metadata_trailers(image_fns):
+    """
+    Read the two metadata blocks of many holograms into one array.
+
+    Only the 2 KB trailer of each file is read, straight into a preallocated
+    buffer, so no pixel data is touched.
+
+    Parameters
+    ----------
+    image_fns: list
+        File locations of the raw holograms
+
+    Returns
+    --------
+    block2
+        block 2 of every hologram as structured array of BLOCK2_DTYPE
+    block3
+        block 3 (text metadata) of every hologram as (N, 1024) uint8 array
+    ok
+        boolean array, False where the file is too short to hold metadata
+    """
+    trailers = np.zeros((len(image_fns), TRAILER_BYTES), dtype=np.uint8)
+    ok = np.ones(len(image_fns), dtype=bool)
+
+    for i, image_fn in enumerate(image_fns):
+        with open(image_fn, 'rb') as f:
+            f.seek(START_METADATA)
+            ok[i] = f.readinto(trailers[i]) == TRAILER_BYTES
+
+    block2 = trailers[:, :1024].copy().view(BLOCK2_DTYPE).ravel()
+    block3 = trailers[:, 1024:]
+
+    return block2, block3, ok
+
+
+def calibrate_metadata(block2):
+    """
+    Detect the LISST-Holo version and calibrate depth and temperature for all frames at once.
+
+    Vectorised version of the calculations in HoloMetadata.
+
+    Parameters
+    ----------
+    block2: numpy structured array
+        block 2 metadata as returned by read_metadata_trailers
+
+    Returns
+    --------
+    depth
+        depth in m
+    temperature
+        temperature in degC
+    lisst_version
+        1 for LISST-Holo1, 2 for LISST-Holo2
+    """
+    # The end of block 2 is empty for the LISST-Holo1 (see HoloMetadata)
+    lisst_version = np.where(block2['reserved'].any(axis=1), 2, 1)
+    holo1 = lisst_version == 1
+
+    p = block2['pressure_counts'].astype(np.float64)
+    t = block2['temperature_counts'].astype(np.float64)
+    a = block2['depth_a'].astype(np.float64)
+    b = block2['depth_b'].astype(np.float64)
+    c = block2['depth_c'].astype(np.float64)
+
+    # Depth (in m)
+    depth = np.where(holo1, p * p * a + p * b + c, p * b + c)
+
+    # Temperature (in C): convert counts from ADC to resistance
+    V = np.where(holo1, t * 0.001, t * 4.096 / 65535)
+    Rt = np.where(holo1, 10000 * V, 13000.0 * V) / (4.096 - V)
+
+    # Approximate the thermistors temperature response curve
+    with np.errstate(divide='ignore', invalid='ignore'):
+        LRt = np.log(Rt)
+        Temp = (1/(block2['temp_a'].astype(np.float64)
+                   + block2['temp_b'].astype(np.float64)*LRt
+                   + block2['temp_c'].astype(np.float64)*(LRt*LRt*LRt))) - 273.15
+
+    # Temperature adjustment
+    temperature = (Temp * block2['temp_slope'].astype(np.float64)
+                   + block2['temp_offset'].astype(np.float64))
+
+    return depth, temperature, lisst_version
+
+
+class HoloMetadataBatch:
+    """
+    Extract metadata from many LISST-Holo holograms at once.
+
+    Bulk counterpart of HoloMetadata: the block 2 trailers of all files are
+    read into one structured array and depth and temperature are calibrated
+    for all frames at once, which is much faster for casts with many frames.
+
+    Attributes
+    ----------
+    images: file names (stems) of the holograms that could be read
+    block2: block 2 metadata as numpy structured array
+    block3: block 3 (text metadata) as (N, 1024) uint8 array
+    depth: depth in m
+    temperature: temperature in degC
+    lisst_version: version of the LISST-Holo
+    failed: files that were too short to hold metadata
+    var_name: variable names in metadata
+
+    Parameters
+    ----------
+    image_fns: list
+        The file locations of the raw holograms
+    cruise: str
+        Optional. Name of cruise.
+    event: str
+        Optional. Name of event (i.e. deployment number, station).
+    """
+    def __init__(self, image_fns, cruise = None, event = None):
+        image_fns = [Path(f) for f in image_fns]
+        block2, block3, ok = read_metadata_trailers(image_fns)
+
+        self.cruise = cruise
+        self.event = event
+        self.failed = [f for f, good in zip(image_fns, ok) if not good]
+        self.paths = [f for f, good in zip(image_fns, ok) if good]
+        self.images = [f.stem for f in self.paths]
+        self.block2 = block2[ok]
+        self.block3 = block3[ok]
+        self.depth, self.temperature, self.lisst_version = calibrate_metadata(self.block2)
+        self.var_name = list(METADATA_COLUMNS)
+
+    def __len__(self):
+        return len(self.images)
+
+    @property
+    def serial_number(self):
+        return np.char.decode(self.block2['serial_number'], 'ascii', 'replace')
+
+    @property
+    def datetime(self):
+        # same (local time) conversion as HoloMetadata
+        return [str(datetime.datetime.fromtimestamp(e)) for e in self.block2['epoch'].tolist()]
+
+    def columns(self):
+        """Metadata as dict of columns, in the order of var_name"""
+        n = len(self)
+        cols = {
+            "Cruise": [self.cruise] * n,
+            "Event": [self.event] * n,
+            "Image": self.images,
+            "Datetime": self.datetime,
+            "Depth": self.depth,
+            "Temperature": self.temperature,
+        }
+        for name, field in zip(METADATA_COLUMNS[6:36], _BLOCK2_COLUMNS):
+            values = self.block2[field]
+            cols[name] = values.astype(np.float64) if values.dtype.kind == 'f' else values
+        cols["Serial number"] = self.serial_number
+        cols["LISST-Holo version"] = self.lisst_version
+        return cols
+
+    def to_dataframe(self):
+        """Metadata as pandas dataframe, one row per hologram (same layout as HoloMetadata)"""
+        return pd.DataFrame(self.columns(), columns = self.var_name)
+
+    def to_arrow(self):
+        """
+        Metadata as typed pyarrow table.
+
+        Same columns as to_dataframe plus "File" (full path), with Datetime as
+        timestamp, Depth and Temperature as float32 and the block 2 fields in
+        their stored types (uint16, uint32, float32).
+        """
+        import pyarrow as pa
+
+        cols = self.columns()
+        cols["Datetime"] = np.array(self.datetime, dtype = 'datetime64[s]')
+        cols["Depth"] = self.depth.astype(np.float32)
+        cols["Temperature"] = self.temperature.astype(np.float32)
+        for name, field in zip(METADATA_COLUMNS[6:36], _BLOCK2_COLUMNS):
+            cols[name] = self.block2[field]
+        cols["LISST-Holo version"] = self.lisst_version.astype(np.uint8)
+
+        arrays = [pa.array([str(f.resolve()) for f in self.paths], type = pa.string())]
+        for name in self.var_name:
+            values = cols[name]
+            if name in ("Cruise", "Event", "Image", "Serial number"):
+                arrays.append(pa.array(list(values), type = pa.string()))
+            else:
+                arrays.append(pa.array(np.ascontiguousarray(values)))
+        return pa.Table.from_arrays(arrays, names = ["File"] + self.var_name)
+
+
+class MetadataStore:
+    """
+    Incremental, columnar store of hologram metadata.
+
+    The metadata are kept as Parquet part files in a folder. update only
+    reads the holograms that are not in the store yet and appends them as a
+    new part, so adding new data costs time in proportion to the new files.
+    Columns are typed (see HoloMetadataBatch.to_arrow) and read can filter
+    on depth and time, which Parquet applies to whole row groups before
+    reading them.
+
+    Holograms are identified by their full path; a hologram that is changed
+    after it was added is not read again. compact merges the parts into one
+    file, replacing the newest part before the others are removed, so an
+    interrupted compact never loses metadata; rows it left twice are merged
+    by the next compact and skipped by read.
+
+    Parameters
+    ----------
+    path: str
+        Folder of the store, made on first update
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def parts(self):
+        """Part files of the store, oldest first"""
+        return sorted(self.path.glob("part-*.parquet")) if self.path.exists() else []
+
+    def _dataset(self):
+        import pyarrow.dataset as ds
+        return ds.dataset([str(f) for f in self.parts()], format = 'parquet')
+
+    def files(self):
+        """Full paths of the holograms in the store"""
+        if not self.parts():
+            return set()
+        return set(self._dataset().to_table(columns = ["File"]).column("File").to_pylist())
+
+    def update(self, image_fns, cruise = None, event = None):
+        """
+        Add the holograms that are not in the store yet.
+
+        Parameters
+        ----------
+        image_fns: list
+            The file locations of the raw holograms
+        cruise, event: str
+            Optional. See HoloMetadataBatch
+
+        Returns
+        --------
+        HoloMetadataBatch
+            metadata of the new holograms, including those that failed
+        """
+        import pyarrow.parquet as pq
+
+        known = self.files()
+        new = sorted(f for f in map(Path, image_fns) if str(f.resolve()) not in known)
+        meta = HoloMetadataBatch(new, cruise = cruise, event = event)
+
+        if len(meta):
+            if not self.path.exists(): self.path.mkdir(parents = True)
+            part_fn = self.path.joinpath("part-" + datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f") + ".parquet")
+            pq.write_table(meta.to_arrow(), part_fn)
+        return meta
+
+    def read(self, columns = None, depth = None, time = None, filter = None):
+        """
+        Read the metadata, sorted by image name.
+
+        Parameters
+        ----------
+        columns: list
+            Optional. Columns to read. Default: all
+        depth: tuple
+            Optional. (min, max) depth in m, both inclusive
+        time: tuple
+            Optional. (start, end) datetime, both inclusive
+        filter: pyarrow.dataset.Expression
+            Optional. Further filter, e.g. ds.field("Event") == "034"
+
+        Returns
+        --------
+        pandas.DataFrame
+            one row per hologram
+        """
+        import pyarrow.dataset as ds
+
+        if not self.parts():
+            return pd.DataFrame(columns = columns or ["File"] + METADATA_COLUMNS)
+
+        expr = filter
+        for name, bounds in (("Depth", depth), ("Datetime", time)):
+            if bounds is None:
+                continue
+            lo, hi = bounds
+            if name == "Datetime":
+                lo, hi = pd.Timestamp(lo).to_datetime64(), pd.Timestamp(hi).to_datetime64()
+            cond = (ds.field(name) >= lo) & (ds.field(name) <= hi)
+            expr = cond if expr is None else expr & cond
+
+        df = self._dataset().to_table(columns = columns, filter = expr).to_pandas()
+        if "File" in df:
+            df = df.drop_duplicates("File").reset_index(drop = True)
+        if "Image" in df:
+            df = df.sort_values("Image", kind = 'stable').reset_index(drop = True)
+        return df
+
+    def compact(self):
+        """Merge all parts into one, sorted by image name"""
+        import pyarrow.parquet as pq
+
+        parts = self.parts()
+        if len(parts) < 2:
+            return
+        table = self._dataset().to_table()
+        # one row per hologram, also after an interrupted compact
+        _, first = np.unique(table.column("File").to_numpy(zero_copy_only = False), return_index = True)
+        table = table.take(np.sort(first)).sort_by("Image")
+        # the merged part is complete before it replaces the newest part and the others are removed
+        tmp_fn = self.path.joinpath("compact.tmp" + str(os.getpid()))
+        pq.write_table(table, tmp_fn)
+        os.replace(tmp_fn, parts[-1])
+        for part in parts[:-1]:
+            part.unlink()
+
+
+# ---- Cast phases ----
+
+# Phases of a profile, in order
+CAST_PHASES = np.array(["Initial", "Return", "Downcasting", "Upcasting"])
+
+
+def _next_index(idx, after, ends):
+    """First entry of sorted idx at or after `after`, per cast; ends where there is none"""
+    i = np.searchsorted(idx, after)
+    found = np.append(idx, np.iinfo(np.int64).max)[i]
+    return np.minimum(found, ends)
+
+
+def cast_phases(depth, tolerance = 0.15, cast = None):
+    """
+    Phase of each frame of one or more profiles.
+
+    Vectorised version of the Initial -> Return -> Downcasting -> Upcasting
+    state machine of filter_metadata (preprocessing/2_cleaning_casts.py).
+    A cast starts in Initial, turns to Return at the first rise of more than
+    tolerance (depth decreasing), to Downcasting at the next descent of more
+    than tolerance, and to Upcasting at the next rise after that. The
+    transitions are found with one search per phase for all casts at once.
+
+    Parameters
+    ----------
+    depth: array
+        Depth of each frame (usually smoothed), casts in frame order
+    tolerance: float
+        Depth change between frames that is still treated as sensor noise. Default: 0.15
+    cast: array
+        Optional. Cast label of each frame, the frames of a cast must be
+        contiguous. Default: all frames are one cast
+
+    Returns
+    --------
+    array
+        phase name of each frame (see CAST_PHASES)
+    """
+    depth = np.asarray(depth, dtype = float)
+    n = len(depth)
+    if cast is None or n == 0:
+        starts = np.zeros(min(n, 1), dtype = np.int64)
+    else:
+        cast = np.asarray(cast)
+        starts = np.flatnonzero(np.r_[True, cast[1:] != cast[:-1]])
+    ends = np.r_[starts[1:], n]
+
+    # change from the previous frame of the same cast
+    change = np.diff(depth, prepend = np.nan)
+    change[starts] = np.nan
+    down = np.flatnonzero(change < -tolerance)
+    up = np.flatnonzero(change > tolerance)
+
+    # first frame of Return, Downcasting and Upcasting in each cast
+    to_return = _next_index(down, starts, ends)
+    to_down = _next_index(up, to_return + 1, ends)
+    to_up = _next_index(down, to_down + 1, ends)
+
+    # count the transitions passed by each frame within its cast
+    marks = np.zeros(n + 1, dtype = np.int64)
+    for t in (to_return, to_down, to_up):
+        np.add.at(marks, t, t < ends)
+    passed = np.cumsum(marks[:n])
+    passed -= np.repeat(passed[starts] - marks[starts], ends - starts)
+
+    return CAST_PHASES[passed]
+
+
+# ---- Memory-mapped hologram loader ----
+
+# LISST-Holo optics (LISST-Holo manual)
+SPACING = 4.4           # pixel size in um
+MEDIUM_INDEX = 1.333    # refractive index of water
+ILLUM_WAVELEN = 0.658   # illumination wavelength in um (658 nm)
+
+_PGM_HEADER = re.compile(rb'P5\s+(\d+)\s+(\d+)\s+(\d+)\s')
+
+
+class RawHologram:
+    """
+    Memory-mapped LISST-Holo hologram.
+
+    The .pgm file is mapped into memory instead of being decoded, so the pixels
+    and the metadata blocks are zero-copy views of the file. Pages are only read
+    from disk when they are accessed. With data, the views are of the file
+    content already read instead.
+
+    Attributes
+    ----------
+    pixels: (1200, 1600) uint8 view of the hologram data
+    blocks: (2, 1024) uint8 view of metadata blocks 2 and 3 (see HoloMetadata)
+
+    Parameters
+    ----------
+    image_fn: str
+        The file location of the raw hologram
+    data: bytes
+        Optional. Content of the file, e.g. read ahead by another thread
+    """
+    def __init__(self, image_fn, data = None):
+        self.image_fn = Path(image_fn)
+        if data is None:
+            mm = np.memmap(image_fn, dtype=np.uint8, mode='r')
+        else:
+            mm = np.frombuffer(data, dtype=np.uint8)
+
+        header = _PGM_HEADER.match(bytes(mm[:32]))
+        if header is None:
+            raise ValueError("Not a binary PGM file: " + str(image_fn))
+        width, height = int(header.group(1)), int(header.group(2))
+        start = header.end()
+        end = start + width * height
+
+        self.pixels = mm[start:end].reshape(height, width)
+        self.blocks = mm[end:end + TRAILER_BYTES].reshape(-1, 1024)
+
+    @property
+    def block2(self):
+        """Block 2 metadata as structured array of BLOCK2_DTYPE"""
+        return self.blocks[0].view(BLOCK2_DTYPE)[0]
+
+    @property
+    def block3(self):
+        """Block 3 (text metadata) as string"""
+        return self.blocks[1].tobytes().decode(errors='replace')
+
+    def to_holopy(self, spacing = SPACING, medium_index = MEDIUM_INDEX, illum_wavelen = ILLUM_WAVELEN):
+        """Hologram as holopy image, equivalent to hp.load_image with the LISST-Holo optics"""
+        import holopy as hp
+
+        return hp.core.metadata.data_grid(self.pixels.astype(float), spacing = spacing,
+                                          medium_index = medium_index, illum_wavelen = illum_wavelen)
+
+
+# Holograms read ahead by the batch reader (see run_batch), by file name
+_prefetched = {}
+
+
+def load_hologram(image_fn):
+    """
+    Load a LISST-Holo hologram without decoding it.
+
+    In a batch (see run_batch), holograms are read ahead by a reader thread
+    and taken from memory.
+
+    Parameters
+    ----------
+    image_fn: str
+        The file location of the raw hologram
+
+    Returns
+    --------
+    RawHologram
+        memory-mapped hologram; optics metadata is attached by RawHologram.to_holopy
+    """
+    holo = _prefetched.pop(str(image_fn), None)
+    return RawHologram(image_fn) if holo is None else holo
+
+
+# ---- Propagation ----
+# Angular spectrum propagation as in holopy's propagate (see scripts/holopy_convo_prop.py),
+# with the transfer functions kept in a cache. Within a cast the shape, spacing,
+# wavelength, medium index, z-planes and cfsp do not change, so after the first
+# frame propagation only costs an FFT, a multiply and an IFFT.
+
+def ft_coord(n, spacing):
+    """Frequency coordinates of an axis of length n after fftshift (as holopy's ft_coord)"""
+    ext = spacing * n
+    return np.linspace(-n/(2*ext), n/(2*ext), n, endpoint=False)
+
+
+def _kz(shape, spacing, med_wavelen):
+    """Propagation phase per unit distance and mask of propagating frequencies"""
+    sx, sy = np.broadcast_to(np.asarray(spacing, dtype=float), (2,))
+
+    m = ft_coord(shape[0], sx)[:, np.newaxis]
+    n = ft_coord(shape[1], sy)[np.newaxis, :]
+
+    root = 1 - (med_wavelen * n) ** 2 - (med_wavelen * m) ** 2
+    mask = root >= 0
+    return -2j * np.pi / med_wavelen * np.sqrt(root * mask), mask
+
+
+def _uniform_step(d, rtol = 1e-9):
+    """Spacing of d if the planes are evenly spaced, otherwise None"""
+    if len(d) < 3:
+        return None
+    step = d[1] - d[0]
+    if step != 0 and np.allclose(np.diff(d), step, rtol = rtol, atol = 0):
+        return step
+    return None
+
+
+def trans_func(shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0, method = 'auto',
+               dtype = np.complex128):
+    """
+    Calculate the optical transfer function to use in reconstruction.
+
+    NumPy port of holopy's trans_func (Kreis, Handbook of Holographic
+    Interferometry, eq. 3.79). The root term is computed once for all planes.
+
+    Parameters
+    ----------
+    shape: tuple
+        (x, y) shape of the hologram
+    spacing: float or tuple
+        pixel size along x and y
+    d: float or list of floats
+        Reconstruction distances
+    med_wavelen: float
+        The wavelength in the medium you are propagating through
+    cfsp: integer
+        Cascaded free-space propagation factor. Default: 0
+    gradient_filter: float
+        Subtract a second transfer function a distance gradient_filter from each z. Default: 0
+    method: str
+        'exact' computes every plane, 'recurrence' builds evenly spaced planes
+        with trans_func_recurrence, 'auto' uses the recurrence whenever d is
+        evenly spaced. Default: 'auto'
+    dtype: numpy dtype
+        complex64 or complex128. The phases are always computed in double
+        precision. Default: complex128
+
+    Returns
+    --------
+    G
+        complex array of shape (len(d), x, y), in fftshift-ed frequency order
+    """
+    d = np.atleast_1d(np.asarray(d, dtype=float))
+
+    G = np.empty((len(d),) + tuple(shape), dtype=dtype)
+    for i, g in enumerate(iter_trans_func(shape, spacing, d, med_wavelen, cfsp = cfsp,
+                                          gradient_filter = gradient_filter, method = method)):
+        G[i] = g
+
+    return G
+
+
+def iter_trans_func(shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0,
+                    method = 'auto', resync = 32, stats = None, dtype = np.complex128,
+                    shifted = True, out = None, setup = None):
+    """
+    Yield the transfer function plane by plane.
+
+    Generator version of trans_func; at most two planes are held in memory.
+    With the recurrence (see trans_func_recurrence) and `stats`, the largest
+    deviation from the exact transfer functions is stored in
+    stats['max_deviation'], checked every `resync` planes and at the last
+    plane; without `stats` it is not measured. The recurrence is updated in
+    place: a yielded plane is only valid until the next one is requested.
+
+    Parameters
+    ----------
+    shape, spacing, d, med_wavelen, cfsp, gradient_filter, method, dtype:
+        see trans_func
+    resync: integer
+        Number of planes between exact transfer functions for the recurrence. Default: 32
+    stats: dict
+        Optional. Receives 'max_deviation'.
+    shifted: bool
+        True: zero frequency in the centre (fftshift-ed, as trans_func). False:
+        in the corner, as returned by the FFT. Default: True
+    out: array
+        Optional. Buffer of dtype `dtype` every plane is written to.
+    setup: RecurrenceSetup
+        Optional. Setup of the recurrence for the same arguments, e.g. from
+        TransferFunctionCache.recurrence, so that it is made once for many
+        holograms. Default: made here for evenly spaced planes
+    """
+    d = np.atleast_1d(np.asarray(d, dtype=float))
+    step = None if method == 'exact' else _uniform_step(d)
+    if method == 'recurrence' and step is None:
+        raise ValueError("Recurrence needs evenly spaced planes")
+    if step is not None and setup is None:
+        setup = RecurrenceSetup(shape, spacing, d, med_wavelen, cfsp = cfsp, gradient_filter = gradient_filter,
+                                resync = resync, shifted = shifted)
+
+    # the recurrence only needs the phases to check its deviation
+    kz = mask = None
+    if step is None or stats is not None:
+        kz, mask = _kz(shape, spacing, med_wavelen)
+        if not shifted:
+            kz, mask = np.fft.ifftshift(kz), np.fft.ifftshift(mask)
+    G_step = None if step is None else setup.G_step
+
+    max_deviation = 0.0
+    g = None
+    for i, z in enumerate(d):
+        if G_step is None:
+            g = _trans_func_plane(kz, mask, z, cfsp, gradient_filter)
+        elif i % resync == 0:
+            exact = setup.planes[i]
+            if stats is not None and g is not None:
+                max_deviation = max(max_deviation, float(np.abs(exact - g * G_step).max()))
+            # the running product is updated in place, the planes of the setup are kept
+            if g is None:
+                g = np.empty_like(exact)
+            np.copyto(g, exact)
+        else:
+            np.multiply(g, G_step, out = g)
+            if stats is not None and i == len(d) - 1:
+                # also check the planes after the last resync, e.g. all of them for n <= resync
+                exact = _trans_func_plane(kz, mask, z, cfsp, gradient_filter)
+                max_deviation = max(max_deviation, float(np.abs(exact - g).max()))
+
+        if stats is not None:
+            stats['max_deviation'] = max_deviation
+        if out is None:
+            yield g.astype(dtype, copy = False)
+        else:
+            np.copyto(out, g, casting = 'same_kind')
+            yield out
+
+
+class RecurrenceSetup:
+    """
+    Per-plane-set part of the transfer function recurrence (see iter_trans_func).
+
+    The step G_step = exp(i kz dz) and the exact transfer functions of the
+    planes the recurrence restarts from (every `resync` planes) only depend on
+    the optics and the planes, not on the hologram, so they are made once and
+    reused for every hologram with the same parameters.
+
+    Parameters
+    ----------
+    shape, spacing, d, med_wavelen, cfsp, gradient_filter, resync, shifted:
+        see iter_trans_func. d must be evenly spaced.
+
+    Attributes
+    ----------
+    G_step: array
+        complex128 transfer function of one step
+    planes: dict
+        complex128 exact transfer function of each resync plane, by index in d
+    """
+    def __init__(self, shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0, resync = 32,
+                 shifted = True):
+        d = np.atleast_1d(np.asarray(d, dtype=float))
+        step = _uniform_step(d)
+        if step is None:
+            raise ValueError("Recurrence needs evenly spaced planes")
+
+        kz, mask = _kz(shape, spacing, med_wavelen)
+        if not shifted:
+            kz, mask = np.fft.ifftshift(kz), np.fft.ifftshift(mask)
+        self.G_step = np.exp(kz * step)
+        self.planes = {i: _trans_func_plane(kz, mask, d[i], cfsp, gradient_filter)
+                       for i in range(0, len(d), resync)}
+
+    @property
+    def nbytes(self):
+        return self.G_step.nbytes + sum(g.nbytes for g in self.planes.values())
+
+
+def _trans_func_plane(kz, mask, z, cfsp = 0, gradient_filter = 0):
+    """Exact transfer function of a single plane"""
+    if cfsp > 0:
+        cfsp = int(abs(cfsp))  # should be nonnegative integer
+        z = z / cfsp
+
+    g = np.exp(kz * z)
+    if gradient_filter:
+        g -= np.exp(kz * (z + gradient_filter))
+
+    # zero where the sqrt is imaginary
+    g *= mask
+
+    if cfsp > 0:
+        g **= cfsp
+
+    return g
+
+
+def trans_func_recurrence(shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0, resync = 32,
+                          dtype = np.complex128):
+    """
+    Transfer functions of evenly spaced planes by recurrence.
+
+    For evenly spaced planes G(z + dz) = G(z) * exp(i kz dz), also with cfsp
+    and the gradient filter, so each plane is one complex multiplication of
+    the previous one instead of a complex exp (and power for cfsp). Every
+    `resync` planes the exact transfer function is computed and replaces the
+    running product, so rounding errors cannot build up.
+
+    Parameters
+    ----------
+    shape, spacing, d, med_wavelen, cfsp, gradient_filter, dtype:
+        see trans_func. d must be evenly spaced.
+    resync: integer
+        Number of planes between exact transfer functions. Default: 32
+
+    Returns
+    --------
+    G
+        complex array of shape (len(d), x, y), as trans_func
+    max_deviation
+        largest absolute deviation of the recurrence from the exact transfer
+        functions, measured at the resync planes
+    """
+    d = np.atleast_1d(np.asarray(d, dtype=float))
+
+    stats = {}
+    G = np.empty((len(d),) + tuple(shape), dtype=dtype)
+    for i, g in enumerate(iter_trans_func(shape, spacing, d, med_wavelen, cfsp = cfsp,
+                                          gradient_filter = gradient_filter, method = 'recurrence',
+                                          resync = resync, stats = stats)):
+        G[i] = g
+    max_deviation = stats.get('max_deviation', 0.0)
+
+    return G, max_deviation
+
+
+class TransferFunctionCache:
+    """
+    Bounded cache of transfer functions with least-recently-used eviction.
+
+    Transfer functions are keyed on shape, spacing, z-planes, wavelength in the
+    medium, cfsp, gradient filter, method and dtype. If cache_dir is given, transfer
+    functions are also saved there as .npy files and memory-mapped on later runs.
+    For stacks built by recurrence, the deviation from the exact transfer
+    functions is kept in `deviation` (by key). The setups of the recurrence
+    that iter_planes runs on the fly for evenly spaced planes are kept too
+    (see recurrence), in memory only.
+
+    Parameters
+    ----------
+    maxsize: integer
+        Number of transfer function stacks kept in memory. Default: 2
+    cache_dir: str
+        Optional. Folder for the on-disk cache.
+    """
+    def __init__(self, maxsize = 2, cache_dir = None):
+        self.maxsize = maxsize
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+        self.deviation = {}
+        self._store = OrderedDict()
+        self._setups = OrderedDict()
+
+    @staticmethod
+    def key(shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0, method = 'auto',
+            dtype = np.complex128):
+        d = np.atleast_1d(np.asarray(d, dtype=float))
+        if method == 'auto':
+            method = 'exact' if _uniform_step(d) is None else 'recurrence'
+        params = (tuple(int(s) for s in shape),
+                  tuple(np.broadcast_to(np.asarray(spacing, dtype=float), (2,)).tolist()),
+                  tuple(d.tolist()),
+                  float(med_wavelen), int(cfsp), float(gradient_filter or 0), method,
+                  np.dtype(dtype).name)
+        return method + "_" + hashlib.sha1(repr(params).encode()).hexdigest()
+
+    def get(self, shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0, method = 'auto',
+            dtype = np.complex128):
+        """Transfer function for the given parameters, see trans_func"""
+        key = self.key(shape, spacing, d, med_wavelen, cfsp, gradient_filter, method, dtype)
+
+        if key in self._store:
+            self.hits += 1
+            self._store.move_to_end(key)
+            return self._store[key]
+
+        self.misses += 1
+        G = self._load(key)
+        if G is None:
+            if key.startswith('recurrence'):
+                G, self.deviation[key] = trans_func_recurrence(
+                    shape, spacing, d, med_wavelen, cfsp = cfsp, gradient_filter = gradient_filter,
+                    dtype = dtype)
+            else:
+                G = trans_func(shape, spacing, d, med_wavelen, cfsp = cfsp,
+                               gradient_filter = gradient_filter, method = 'exact', dtype = dtype)
+            self._save(key, G)
+
+        self._store[key] = G
+        while len(self._store) > self.maxsize:
+            self._store.popitem(last = False)
+        return G
+
+    def recurrence(self, shape, spacing, d, med_wavelen, cfsp = 0, gradient_filter = 0, resync = 32,
+                   shifted = True):
+        """RecurrenceSetup for the given parameters, see iter_trans_func"""
+        key = "%s_%d_%s" % (self.key(shape, spacing, d, med_wavelen, cfsp, gradient_filter, 'recurrence'),
+                            resync, shifted)
+
+        if key in self._setups:
+            self.hits += 1
+            self._setups.move_to_end(key)
+            return self._setups[key]
+
+        self.misses += 1
+        self._setups[key] = setup = RecurrenceSetup(shape, spacing, d, med_wavelen, cfsp = cfsp,
+                                                    gradient_filter = gradient_filter, resync = resync,
+                                                    shifted = shifted)
+        while len(self._setups) > self.maxsize:
+            self._setups.popitem(last = False)
+        return setup
+
+    def clear(self):
+        self._store.clear()
+        self._setups.clear()
+
+    def _path(self, key):
+        return self.cache_dir.joinpath("trans_func_" + key + ".npy")
+
+    def _load(self, key):
+        if self.cache_dir is None or not self._path(key).exists():
+            return None
+        return np.load(self._path(key), mmap_mode = 'r')
+
+    def _save(self, key, G):
+        if self.cache_dir is None:
+            return
+        if not self.cache_dir.exists(): self.cache_dir.mkdir(parents = True)
+        # write to a temporary file first, so other processes never see half a file
+        tmp_fn = self._path(key).with_suffix(".tmp" + str(os.getpid()))
+        with open(tmp_fn, 'wb') as f:
+            np.save(f, G)
+        os.replace(tmp_fn, self._path(key))
+
+
+# transfer functions are reused by all reconstructions in this process
+TRANS_FUNC_CACHE = TransferFunctionCache()
+
+
+# ---- FFT backends ----
+# The FFTs dominate reconstruction time. The backend is chosen with
+# set_fft_backend or the ANTICS_FFT_BACKEND / ANTICS_FFT_THREADS environment
+# variables: 'pyfftw' (planned, threaded, aligned in-place buffers, wisdom
+# saved between runs), 'scipy' (scipy.fft with workers) or 'numpy'. The
+# default 'auto' takes the first of these that is installed.
+
+class NumpyFFT:
+    """
+    numpy.fft, single-threaded.
+
+    With numpy >= 2.0 results are written straight into `out` (which may be
+    the input), one axis at a time.
+    """
+    name = 'numpy'
+
+    def __init__(self, threads = 1, **kwargs):
+        self.threads = 1
+        self._out = np.lib.NumpyVersion(np.__version__) >= '2.0.0'
+
+    def _fft(self, func, a, out):
+        if out is None:
+            return func(func(a, axis = -1), axis = -2)
+        if not self._out:
+            out[...] = func(func(a, axis = -1), axis = -2)
+            return out
+        func(a, axis = -1, out = out)
+        return func(out, axis = -2, out = out)
+
+    def fft2(self, a, out = None):
+        return self._fft(np.fft.fft, a, out)
+
+    def ifft2(self, a, out = None):
+        return self._fft(np.fft.ifft, a, out)
+
+
+class ScipyFFT:
+    """scipy.fft with `threads` workers"""
+    name = 'scipy'
+
+    def __init__(self, threads = 1, **kwargs):
+        import scipy.fft
+        self._fft = scipy.fft
+        self.threads = threads
+
+    def fft2(self, a, out = None):
+        res = self._fft.fft2(a, workers = self.threads)
+        if out is None:
+            return res
+        out[...] = res
+        return out
+
+    def ifft2(self, a, out = None):
+        res = self._fft.ifft2(a, workers = self.threads, overwrite_x = True)
+        if out is None:
+            return res
+        out[...] = res
+        return out
+
+
+class PyFFTW:
+    """
+    pyFFTW with pre-planned, aligned, in-place buffers.
+
+    One plan is made per shape and direction. Wisdom is loaded from and saved
+    to wisdom_fn, so planning with FFTW_MEASURE is only slow on the first run.
+    Without `out`, the result of ifft2 is the plan's buffer and stays valid
+    until the next ifft2 of the same shape.
+    """
+    name = 'pyfftw'
+
+    def __init__(self, threads = 1, wisdom_fn = None, planner_effort = 'FFTW_MEASURE'):
+        import pyfftw
+        self._pyfftw = pyfftw
+        self.threads = threads
+        self.planner_effort = planner_effort
+        self.wisdom_fn = Path(wisdom_fn or Path.home().joinpath(".antics_fftw_wisdom"))
+        self._plans = {}
+        self._load_wisdom()
+
+    def _plan(self, shape, dtype, direction):
+        dtype = np.result_type(dtype, np.complex64)
+        key = (shape, dtype, direction)
+        if key not in self._plans:
+            buf = self._pyfftw.empty_aligned(shape, dtype = dtype)
+            self._plans[key] = self._pyfftw.FFTW(buf, buf, axes = (-2, -1), direction = direction,
+                                                 flags = (self.planner_effort,), threads = self.threads)
+            self._save_wisdom()
+        return self._plans[key]
+
+    def _load_wisdom(self):
+        # a missing or unreadable (e.g. truncated) file is no wisdom: the plans are made again
+        try:
+            with open(self.wisdom_fn, 'rb') as f:
+                self._pyfftw.import_wisdom(pickle.load(f))
+        except (OSError, EOFError, pickle.UnpicklingError, TypeError, ValueError):
+            pass
+
+    def _save_wisdom(self):
+        # write to a temporary file first, so other processes never load half a file
+        tmp_fn = self.wisdom_fn.with_name(self.wisdom_fn.name + ".tmp" + str(os.getpid()))
+        try:
+            with open(tmp_fn, 'wb') as f:
+                pickle.dump(self._pyfftw.export_wisdom(), f)
+            os.replace(tmp_fn, self.wisdom_fn)
+        except OSError:
+            pass
+
+    def fft2(self, a, out = None):
+        plan = self._plan(a.shape, a.dtype, 'FFTW_FORWARD')
+        plan.input_array[...] = a
+        if out is None:
+            return plan().copy()
+        out[...] = plan()
+        return out
+
+    def ifft2(self, a, out = None):
+        plan = self._plan(a.shape, a.dtype, 'FFTW_BACKWARD')
+        plan.input_array[...] = a
+        if out is None:
+            return plan()
+        out[...] = plan()
+        return out
+
+
+FFT_BACKENDS = {'pyfftw': PyFFTW, 'scipy': ScipyFFT, 'numpy': NumpyFFT}
+
+_fft_backend = None
+
+
+def set_fft_backend(name = 'auto', threads = None, **kwargs):
+    """
+    Select the FFT backend used for reconstruction.
+
+    The choice is also stored in the environment, so worker processes use the
+    same backend.
+
+    Parameters
+    ----------
+    name: str
+        'auto', 'pyfftw', 'scipy' or 'numpy'. 'auto' takes the first one that
+        is installed, in that order. Default: 'auto'
+    threads: integer
+        Number of FFT threads. Default: number of CPUs
+    kwargs:
+        passed on to the backend (e.g. wisdom_fn for pyfftw)
+
+    Returns
+    --------
+    backend
+        the selected backend
+    """
+    global _fft_backend
+    threads = int(threads or os.cpu_count() or 1)
+    names = list(FFT_BACKENDS) if name == 'auto' else [name]
+
+    for backend_name in names:
+        try:
+            _fft_backend = FFT_BACKENDS[backend_name](threads = threads, **kwargs)
+            break
+        except ImportError:
+            if name != 'auto':
+                raise
+
+    os.environ["ANTICS_FFT_BACKEND"] = _fft_backend.name
+    os.environ["ANTICS_FFT_THREADS"] = str(threads)
+    return _fft_backend
+
+
+def get_fft_backend():
+    """The FFT backend in use, set up from the environment on first use"""
+    if _fft_backend is None:
+        set_fft_backend(os.environ.get("ANTICS_FFT_BACKEND", "auto"),
+                        os.environ.get("ANTICS_FFT_THREADS"))
+    return _fft_backend
+
+
+# ---- Streaming reconstruction ----
+# Reconstructed planes are produced one at a time by iter_planes and handed to
+# reducers (running z-min, plane statistics, stack writers), so the full focal
+# stack never has to be held in memory.
+
+# (real, complex) dtypes of the precision options of the reconstruction
+PRECISIONS = {'double': (np.float64, np.complex128), 'single': (np.float32, np.complex64)}
+
+
+def _empty_aligned(shape, dtype, alignment = 64):
+    """Uninitialised array starting on an `alignment` byte boundary (for SIMD and FFTW)"""
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buf = np.empty(nbytes + alignment, dtype = np.uint8)
+    offset = -buf.ctypes.data % alignment
+    return buf[offset:offset + nbytes].view(dtype).reshape(shape)
+
+
+def _ifftshift_into(a, out = None):
+    """np.fft.ifftshift of a 2D array, written into out"""
+    if out is None:
+        return np.fft.ifftshift(a)
+    h, w = a.shape
+    r, c = h // 2, w // 2
+    out[:h - r, :w - c] = a[r:, c:]
+    out[:h - r, w - c:] = a[r:, :c]
+    out[h - r:, :w - c] = a[:r, c:]
+    out[h - r:, w - c:] = a[:r, :c]
+    return out
+
+
+def rescale_to_ubyte(image, in_range = 'image', out = None, work = None):
+    """
+    Rescale a float image to uint8 without temporary arrays.
+
+    Gives the same result as img_as_ubyte(rescale_intensity(image, in_range = in_range)),
+    computed in the buffers out and work.
+
+    Parameters
+    ----------
+    image: array
+        float image
+    in_range: str or tuple
+        'image' (min and max of image) or (min, max). Default: 'image'
+    out: array
+        Optional. uint8 array for the result
+    work: array
+        Optional. Scratch array of the shape and dtype of image
+
+    Returns
+    --------
+    array
+        uint8 image (out)
+    """
+    if isinstance(in_range, str) and in_range == 'image':
+        in_range = (image.min(), image.max())
+    imin, imax = map(float, in_range)
+    if work is None:
+        work = np.empty_like(image)
+    if out is None:
+        out = np.empty(image.shape, dtype = np.uint8)
+
+    # as rescale_intensity: to [0, 1], or to [-1, 1] if imin is negative
+    omin = 0 if imin >= 0 else -1
+    np.clip(image, imin, imax, out = work)
+    if imin != imax:
+        np.subtract(work, imin, out = work)
+        np.divide(work, imax - imin, out = work)
+        if omin:
+            np.multiply(work, 2, out = work)
+            np.subtract(work, 1, out = work)
+    else:
+        np.clip(work, omin, 1, out = work)
+
+    # as skimage's float to uint8 conversion
+    np.multiply(work, 255, out = work)
+    np.rint(work, out = work)
+    np.clip(work, 0, 255, out = work)
+    np.copyto(out, work, casting = 'unsafe')
+    return out
+
+
+class ReconstructionWorkspace:
+    """
+    Preallocated buffers to reconstruct many holograms of the same shape.
+
+    All buffers are allocated once, aligned to 64 bytes, and reused for every
+    hologram and plane: hologram, spectrum, transfer function, reconstructed
+    field, amplitude, running z-min and the uint8 image. The float32 stack of
+    spilled_stack is a memory-mapped temporary file of (n_planes, x, y) that
+    is made on first use and reused as well.
+
+    Pass the workspace to iter_planes, amplitudes, ZMin and rescale_to_ubyte.
+    Results held in the workspace are overwritten by the next hologram.
+
+    Parameters
+    ----------
+    shape: tuple
+        (x, y) shape of the holograms. Default: LISST-Holo image shape
+    precision: str
+        'double' or 'single', see iter_planes. Default: 'double'
+    n_planes: integer
+        Optional. Number of planes of the spilled stack
+    tmp_dir: str
+        Optional. Folder for the stack's temporary file. Default: system temp folder
+    """
+    def __init__(self, shape = IMAGE_SHAPE, precision = 'double', n_planes = None, tmp_dir = None):
+        real, cplx = PRECISIONS[precision]
+        self.shape = tuple(shape)
+        self.precision = precision
+        self.n_planes = n_planes
+        self.tmp_dir = tmp_dir
+
+        self.hologram = _empty_aligned(self.shape, real)
+        self.spectrum = _empty_aligned(self.shape, cplx)
+        self.kernel = _empty_aligned(self.shape, cplx)
+        self.field = _empty_aligned(self.shape, cplx)
+        self.amplitude = _empty_aligned(self.shape, real)
+        self.z_min = _empty_aligned(self.shape, real)
+        self.image = _empty_aligned(self.shape, np.uint8)
+        self._buffers = {}
+        self._stack = None
+
+    def buffer(self, name, dtype):
+        """Scratch buffer of the workspace shape, made on first use"""
+        key = (name, np.dtype(dtype))
+        if key not in self._buffers:
+            self._buffers[key] = _empty_aligned(self.shape, dtype)
+        return self._buffers[key]
+
+    def spilled_stack(self, chunk = None):
+        """A SpilledStack of n_planes planes on the workspace's stack file, see SpilledStack for chunk"""
+        if self._stack is None:
+            self._file = tempfile.TemporaryFile(dir = self.tmp_dir)
+            self._stack = np.memmap(self._file, dtype = np.float32, mode = 'w+',
+                                    shape = (self.n_planes,) + self.shape)
+        return SpilledStack(self.n_planes, buffer = self._stack, workspace = self, chunk = chunk)
+
+    def close(self):
+        if self._stack is not None:
+            del self._stack
+            self._file.close()
+            self._stack = None
+
+
+_workspaces = {}
+
+
+def get_workspace(shape = IMAGE_SHAPE, precision = 'double', n_planes = None):
+    """ReconstructionWorkspace of this process, made on first use and reused for the same arguments"""
+    key = (tuple(shape), precision, n_planes)
+    if key not in _workspaces:
+        _workspaces[key] = ReconstructionWorkspace(shape, precision = precision, n_planes = n_planes)
+    return _workspaces[key]
+
+
+def iter_planes(holo, d, spacing = SPACING, medium_index = MEDIUM_INDEX, illum_wavelen = ILLUM_WAVELEN,
+                cfsp = 0, gradient_filter = 0, cache = TRANS_FUNC_CACHE, method = 'auto',
+                precision = 'double', workspace = None, plane_chunk = None):
+    """
+    Reconstruct a hologram plane by plane.
+
+    The hologram is transformed once; each plane then costs a multiply with its
+    transfer function and an inverse FFT. Evenly spaced planes get their
+    transfer functions by recurrence on the fly (see iter_trans_func), from
+    a setup kept in the cache, other stacks are taken from the cache. Transfer functions are used in the
+    frequency order of the FFT, so the spectrum is never fftshift-ed.
+
+    Parameters
+    ----------
+    holo: array
+        Hologram, e.g. RawHologram.pixels
+    d: float or list of floats
+        Reconstruction distances
+    spacing, medium_index, illum_wavelen: float
+        Optics. Default: LISST-Holo values
+    cfsp, gradient_filter, method:
+        see propagate
+    cache: TransferFunctionCache
+        Cache for transfer functions of unevenly spaced planes and for the
+        recurrence of evenly spaced ones. None computes them plane by plane.
+    precision: str
+        'double' (float64/complex128) or 'single' (float32/complex64). Default: 'double'
+    workspace: ReconstructionWorkspace
+        Optional. Buffers to compute in instead of allocating new arrays; its
+        precision replaces `precision`.
+    plane_chunk: integer
+        Optional. Take the transfer functions of unevenly spaced planes from
+        the cache in stacks of at most plane_chunk planes, to bound their
+        memory (see plan_reconstruction). Default: one stack of all planes
+
+    Yields
+    -------
+    i, z, field
+        Index and distance of the plane and the reconstructed (complex) field.
+        As in propagate, the plane at distance 0 is the hologram itself.
+        The field may be reused for the next plane.
+    """
+    if workspace is None:
+        real, dtype = PRECISIONS[precision]
+        holo = np.asarray(holo, dtype = real)
+        spectrum = kernel = field = None
+    else:
+        real, dtype = PRECISIONS[workspace.precision]
+        np.copyto(workspace.hologram, holo)
+        holo = workspace.hologram
+        spectrum, kernel, field = workspace.spectrum, workspace.kernel, workspace.field
+
+    backend = get_fft_backend()
+    d = np.atleast_1d(np.asarray(d, dtype = float))
+    med_wavelen = illum_wavelen / medium_index
+    nonzero = d[d != 0]
+
+    if cache is None or (method != 'exact' and _uniform_step(nonzero) is not None):
+        setup = None
+        if cache is not None:
+            setup = cache.recurrence(holo.shape, spacing, nonzero, med_wavelen, cfsp = cfsp,
+                                     gradient_filter = gradient_filter, shifted = False)
+        kernels = iter_trans_func(holo.shape, spacing, nonzero, med_wavelen, cfsp = cfsp,
+                                  gradient_filter = gradient_filter, method = method, dtype = dtype,
+                                  shifted = False, out = kernel, setup = setup)
+    else:
+        chunk = plane_chunk or max(1, len(nonzero))
+        stacks = (cache.get(holo.shape, spacing, nonzero[k:k + chunk], med_wavelen, cfsp = cfsp,
+                            gradient_filter = gradient_filter, method = method, dtype = dtype)
+                  for k in range(0, len(nonzero), chunk))
+        kernels = (_ifftshift_into(g, kernel) for G in stacks for g in G)
+
+    ft = backend.fft2(holo, out = spectrum) if len(nonzero) else None
+    for i, z in enumerate(d):
+        if z == 0:
+            yield i, z, holo
+        else:
+            product = np.multiply(ft, next(kernels), out = field)
+            yield i, z, backend.ifft2(product, out = field)
+
+
+def propagate_array(holo, d, spacing = SPACING, medium_index = MEDIUM_INDEX, illum_wavelen = ILLUM_WAVELEN,
+                    cfsp = 0, gradient_filter = 0, cache = TRANS_FUNC_CACHE, method = 'auto',
+                    precision = 'double'):
+    """
+    Propagate a hologram to several distances, NumPy arrays only.
+
+    Lean core of propagate for the hot path: no xarray objects, coordinates or
+    metadata are created. See iter_planes for the parameters.
+
+    Returns
+    -------
+    array
+        complex array of shape (len(d), x, y)
+    """
+    d = np.atleast_1d(np.asarray(d, dtype = float))
+    holo = np.asarray(holo)
+
+    res = np.empty((len(d),) + holo.shape, dtype = PRECISIONS[precision][1])
+    for i, z, field in iter_planes(holo, d, spacing = spacing, medium_index = medium_index,
+                                   illum_wavelen = illum_wavelen, cfsp = cfsp,
+                                   gradient_filter = gradient_filter, cache = cache,
+                                   method = method, precision = precision):
+        res[i] = field
+
+    return res
+
+
+def propagate(data, d, medium_index = None, illum_wavelen = None, cfsp = 0,
+              gradient_filter = False, cache = TRANS_FUNC_CACHE, method = 'auto',
+              precision = 'double'):
+    """
+    Propagate a hologram along the optical axis.
+
+    holopy-compatible wrapper of propagate_array: same as hp.propagate, but
+    the transfer function is taken from a cache and the numbers are computed
+    on plain NumPy arrays. xarray is only used to wrap the result.
+
+    Parameters
+    ----------
+    data: xarray.DataArray
+        Hologram to propagate (e.g. RawHologram.to_holopy())
+    d: float or list of floats
+        Distance to propagate. A list tells to propagate to several distances and return the volume
+    medium_index: float
+        Optional. Overrides the medium index of data.
+    illum_wavelen: float
+        Optional. Overrides the illumination wavelength of data.
+    cfsp: integer
+        Cascaded free-space propagation factor. Default: 0
+    gradient_filter: float
+        Subtract a second propagation a distance gradient_filter away. Default: False
+    cache: TransferFunctionCache
+        Cache to take the transfer function from. None computes it every time.
+    method: str
+        How transfer functions are computed, see trans_func. Default: 'auto'
+    precision: str
+        'double' or 'single'. Default: 'double'
+
+    Returns
+    -------
+    xarray.DataArray
+        The hologram propagated to a distance d from its current location,
+        with dimensions (z, x, y) in the order of d.
+    """
+    import holopy as hp
+    import xarray as xr
+
+    if np.isscalar(d) and d == 0:
+        # Propagating no distance has no effect
+        return data
+
+    data = hp.core.metadata.update_metadata(
+        data, medium_index = medium_index, illum_wavelen = illum_wavelen)
+
+    if data.medium_index is None or data.illum_wavelen is None:
+        raise ValueError("Missing parameter: refractive index and wavelength")
+
+    d = np.atleast_1d(np.asarray(d, dtype=float))
+    spacing = (float(np.diff(data.x)[0]), float(np.diff(data.y)[0]))
+    holo = data.transpose(..., 'x', 'y').values.reshape(len(data.x), len(data.y))
+
+    res = propagate_array(holo, d, spacing = spacing, medium_index = data.medium_index,
+                          illum_wavelen = data.illum_wavelen, cfsp = cfsp,
+                          gradient_filter = gradient_filter, cache = cache, method = method,
+                          precision = precision)
+
+    # attach coordinates and metadata only at the end
+    res = xr.DataArray(res, dims = ['z', 'x', 'y'], coords = {'z': d, 'x': data.x, 'y': data.y},
+                       name = 'propagation')
+    return hp.core.metadata.copy_metadata(data, res)
+
+
+def amplitudes(planes, out = None):
+    """Amplitude of the planes from iter_planes, optionally computed in out (e.g. workspace.amplitude)"""
+    for i, z, field in planes:
+        yield i, z, np.abs(field, out = out)
+
+
+def run_reducers(planes, reducers):
+    """
+    Feed planes to reducers, one plane at a time.
+
+    Parameters
+    ----------
+    planes: iterable
+        (i, z, plane) tuples, e.g. from amplitudes(iter_planes(...))
+    reducers: list
+        PlaneReducer objects
+
+    Returns
+    -------
+    list
+        result of each reducer (PlaneReducer.finish)
+    """
+    for i, z, plane in planes:
+        for reducer in reducers:
+            reducer.update(i, z, plane)
+    return [reducer.finish() for reducer in reducers]
+
+
+class PlaneReducer:
+    """
+    Online consumer of reconstructed planes.
+
+    Subclasses implement update, which is called once per plane in order, and
+    finish, which returns the result once all planes have been seen.
+    """
+    def update(self, i, z, plane):
+        raise NotImplementedError
+
+    def finish(self):
+        return None
+
+
+class ZMin(PlaneReducer):
+    """Running z-min: darkest value of each pixel over all planes, optionally kept in out"""
+    def __init__(self, out = None):
+        self.out = out
+        self.z_min = None
+
+    def update(self, i, z, plane):
+        if self.z_min is None:
+            if self.out is None:
+                self.z_min = np.array(plane)
+            else:
+                self.z_min = self.out
+                np.copyto(self.z_min, plane)
+        else:
+            np.minimum(self.z_min, plane, out = self.z_min)
+
+    def finish(self):
+        return self.z_min
+
+
+class PlaneStats(PlaneReducer):
+    """Mean, standard deviation, minimum and maximum of each plane"""
+    def __init__(self):
+        self.stats = {'z': [], 'mean': [], 'std': [], 'min': [], 'max': []}
+
+    def update(self, i, z, plane):
+        self.stats['z'].append(z)
+        self.stats['mean'].append(plane.mean())
+        self.stats['std'].append(plane.std())
+        self.stats['min'].append(plane.min())
+        self.stats['max'].append(plane.max())
+
+    def finish(self):
+        return {k: np.array(v) for k, v in self.stats.items()}
+
+
+class SpilledStack(PlaneReducer):
+    """
+    Keep the planes in a temporary file while tracking the stack range.
+
+    Stack images and gifs are rescaled with the intensity range of the whole
+    stack, which is only known once all planes are reconstructed. The planes
+    are kept as float32 in a memory-mapped temporary file (deleted when
+    finished) instead of in memory, then rescaled with rescaled_planes.
+
+    Parameters
+    ----------
+    n_planes: integer
+        Number of planes
+    tmp_dir: str
+        Optional. Folder for the temporary file. Default: system temp folder
+    buffer: array
+        Optional. (n_planes, x, y) float32 array to keep the planes in instead
+        of a new temporary file (see ReconstructionWorkspace.spilled_stack)
+    workspace: ReconstructionWorkspace
+        Optional. Buffers for rescaled_planes
+    chunk: integer
+        Optional. Write the planes to the file and release them from memory
+        every chunk planes, so at most chunk planes of the stack are resident
+        (see plan_reconstruction). Default: left to the operating system
+    """
+    def __init__(self, n_planes, tmp_dir = None, buffer = None, workspace = None, chunk = None):
+        self.n_planes = n_planes
+        self.tmp_dir = tmp_dir
+        self.stack = buffer
+        self._own = buffer is None
+        self.workspace = workspace
+        self.chunk = chunk
+        self.z = np.zeros(n_planes)
+        self.in_range = (np.inf, -np.inf)
+
+    def update(self, i, z, plane):
+        if self.stack is None:
+            self._file = tempfile.TemporaryFile(dir = self.tmp_dir)
+            self.stack = np.memmap(self._file, dtype = np.float32, mode = 'w+',
+                                   shape = (self.n_planes,) + plane.shape)
+        self.stack[i] = plane
+        self.z[i] = z
+        self.in_range = (min(self.in_range[0], plane.min()), max(self.in_range[1], plane.max()))
+        if self.chunk and (i + 1) % self.chunk == 0:
+            _release_pages(self.stack)
+
+    def rescaled_planes(self):
+        """
+        Yield (i, z, plane) as uint8, rescaled with the range of the whole stack.
+
+        With a workspace, the uint8 plane is the workspace's image buffer and
+        is overwritten by the next plane.
+        """
+        out = work = None
+        if self.workspace is not None:
+            out, work = self.workspace.image, self.workspace.buffer('rescale', np.float32)
+        if self.chunk:
+            _release_pages(self.stack)
+        for i in range(self.n_planes):
+            yield i, self.z[i], rescale_to_ubyte(self.stack[i], in_range = self.in_range,
+                                                 out = out, work = work)
+            if self.chunk and (i + 1) % self.chunk == 0:
+                _release_pages(self.stack)
+
+    def finish(self):
+        return self
+
+    def close(self):
+        if self.stack is not None:
+            if self._own:
+                del self.stack
+                self._file.close()
+            self.stack = None
+
+
+def _release_pages(stack):
+    """Write a memory-mapped array to its file and drop its pages from the memory of this process"""
+    stack.flush()
+    mapping = getattr(stack, '_mmap', None)
+    # the pages are clean after the flush, they are read back from the file when needed
+    if mapping is not None and hasattr(mmap, 'MADV_DONTNEED'):
+        mapping.madvise(mmap.MADV_DONTNEED)
+
+
+class PngStackWriter(PlaneReducer):
+    """
+    Save uint8 planes as .png, one file per plane.
+
+    Parameters
+    ----------
+    folder: Path
+        Output folder
+    stem: str
+        File name stem, planes are saved as <stem>_planeNN.png
+    encoder: ImageEncoder
+        Optional. Encoder writing the planes in the background. The files are
+        only complete after encoder.flush()
+    """
+    def __init__(self, folder, stem, encoder = None):
+        self.folder = Path(folder)
+        self.stem = stem
+        self.encoder = encoder
+        self.files = []
+
+    def update(self, i, z, plane):
+        plane_fn = self.folder.joinpath(self.stem + "_plane" + str(i).zfill(2) + ".png")
+        if self.encoder is None:
+            from skimage import io
+            io.imsave(plane_fn, plane)
+        else:
+            self.encoder.save_png(plane_fn, plane)
+        self.files.append(plane_fn)
+
+    def finish(self):
+        return self.files
+
+
+class GifWriter(PlaneReducer):
+    """
+    Append uint8 planes to an animated gif, written when finished.
+
+    Parameters
+    ----------
+    gif_fn: Path
+        Output file
+    duration: integer
+        Display time of each plane in ms. Default: 200
+    downsample: integer
+        Average the planes over downsample x downsample pixels, for smaller
+        and faster previews. Default: 1
+    encoder: ImageEncoder
+        Optional. Encoder writing the gif in the background. The file is
+        only complete after encoder.flush()
+    """
+    def __init__(self, gif_fn, duration = 200, downsample = 1, encoder = None):
+        self.gif_fn = gif_fn
+        self.duration = duration
+        self.downsample = downsample
+        self.encoder = encoder
+        self.frames = []
+
+    def update(self, i, z, plane):
+        # frames are copies: the plane may be a reused buffer
+        self.frames.append(gif_frame(plane, self.downsample))
+
+    def finish(self):
+        if self.encoder is None:
+            _save_gif(self.gif_fn, self.frames, self.duration)
+        else:
+            self.encoder.save_gif(self.gif_fn, self.frames, self.duration)
+        self.frames = []
+        return [self.gif_fn]
+
+
+# ---- Stack files ----
+# The focal stacks of one hologram, or of a whole cast, are kept in one HDF5
+# file instead of a .png per plane. Planes are stored in compressed chunks of
+# one tile of one plane, so a stack is written with a few large writes and a
+# plane, or part of it, is read without decoding the others. h5py is only
+# needed for these files.
+
+# (y, x) size of the tiles of a plane stored as one chunk
+STACK_TILE = (300, 400)
+
+
+class Hdf5StackWriter(PlaneReducer):
+    """
+    Save the uint8 planes of a hologram as one frame of an HDF5 stack file.
+
+    The file is created by the first writer; each further hologram is added
+    as a new frame, or replaces the frame of the same name, so that the
+    stacks of a whole cast can be kept in one file (written by one process
+    at a time). Read with HoloStackFile. A file of a single hologram
+    (shared = False) is instead made anew when its planes differ, e.g. when
+    a hologram is reconstructed again with another number of planes.
+
+    File layout
+    -----------
+    stack: (frame, z, y, x) uint8 planes, rescaled per frame (see SpilledStack)
+    z: distances of the planes in um
+    image: name of the hologram of each frame
+    range: (frame, 2) amplitude range of each frame mapped to 0 - 255
+    attributes: attrs given when the file is created, e.g. the optics
+
+    Parameters
+    ----------
+    stack_fn: Path
+        Output file (.h5)
+    image: str
+        Name of the hologram, e.g. the file stem
+    z: list of floats
+        Distances of the planes
+    in_range: tuple
+        Optional. Amplitude range of the planes, e.g. SpilledStack.in_range
+    attrs: dict
+        Optional. Attributes of a new file
+    compression: str
+        HDF5 compression filter, 'gzip' or 'lzf'. Default: 'gzip'
+    compression_opts: integer
+        gzip level. Default: 4
+    shared: bool
+        True if the file holds the stacks of many holograms: a stack with
+        other shape or planes is an error. False to replace it. Default: True
+    """
+    def __init__(self, stack_fn, image, z, in_range = None, attrs = None, compression = 'gzip',
+                 compression_opts = 4, shared = True):
+        self.stack_fn = Path(stack_fn)
+        self.image = str(image)
+        self.z = np.asarray(z, dtype = float)
+        self.in_range = (np.nan, np.nan) if in_range is None else in_range
+        self.attrs = attrs or {}
+        self.compression = compression
+        self.compression_opts = compression_opts if compression == 'gzip' else None
+        self.shared = shared
+        self._file = None
+
+    def _open(self, shape):
+        """Open the file and the frame of the hologram, making either if missing"""
+        import h5py
+
+        self._file = f = h5py.File(self.stack_fn, 'a')
+        stack_shape = (len(self.z),) + tuple(shape)
+        if 'stack' in f and not self._matches(f, stack_shape):
+            if self.shared:
+                self.finish()
+                raise ValueError("Stack of " + self.image + " does not match the stacks in " + str(self.stack_fn))
+            f.close()
+            self._file = f = h5py.File(self.stack_fn, 'w')
+        if 'stack' not in f:
+            chunks = (1, 1) + tuple(min(t, s) for t, s in zip(STACK_TILE, shape))
+            f.create_dataset('stack', shape = (0,) + stack_shape, maxshape = (None,) + stack_shape,
+                             dtype = np.uint8, chunks = chunks, compression = self.compression,
+                             compression_opts = self.compression_opts)
+            f.create_dataset('z', data = self.z)
+            f.create_dataset('image', shape = (0,), maxshape = (None,), dtype = h5py.string_dtype())
+            f.create_dataset('range', shape = (0, 2), maxshape = (None, 2), dtype = np.float64)
+            f.attrs.update(self.attrs)
+
+        images = list(f['image'].asstr()[:])
+        if self.image in images:
+            self.frame = images.index(self.image)
+        else:
+            self.frame = len(images)
+            for name in ('stack', 'image', 'range'):
+                f[name].resize(self.frame + 1, axis = 0)
+            f['image'][self.frame] = self.image
+        f['range'][self.frame] = self.in_range
+
+    def _matches(self, f, stack_shape):
+        """Whether the stacks in the open file f have the shape and planes of this one"""
+        return f['stack'].shape[1:] == stack_shape and f['z'].shape == self.z.shape and np.allclose(f['z'][:], self.z)
+
+    def update(self, i, z, plane):
+        if self._file is None:
+            self._open(plane.shape)
+        self._file['stack'][self.frame, i] = plane
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        return [self.stack_fn]
+
+
+class HoloStackFile:
+    """
+    Read stacks saved by Hdf5StackWriter, lazily.
+
+    Indexing works as on a (frame, z, y, x) array and only reads and decodes
+    the chunks needed, e.g. stacks[0, 30] is plane 30 of the first hologram
+    and stacks[:, :, 500:600, 700:800] a region through all stacks.
+
+    Parameters
+    ----------
+    stack_fn: Path
+        Stack file (.h5)
+
+    Attributes
+    ----------
+    stack: h5py.Dataset of the (frame, z, y, x) uint8 planes
+    z: distances of the planes in um
+    images: names of the holograms of the frames
+    range: (frame, 2) amplitude range of each frame
+    attrs: dict of the file attributes
+
+    Example
+    --------
+    with HoloStackFile("stacks/cast.h5") as stacks:
+        plane = stacks.plane("image001", 30)
+    """
+    def __init__(self, stack_fn):
+        import h5py
+
+        self._file = h5py.File(stack_fn, 'r')
+        self.stack = self._file['stack']
+        self.z = self._file['z'][:]
+        self.images = list(self._file['image'].asstr()[:])
+        self.range = self._file['range'][:]
+        self.attrs = dict(self._file.attrs)
+
+    @property
+    def shape(self):
+        return self.stack.shape
+
+    def __len__(self):
+        return len(self.images)
+
+    def __getitem__(self, key):
+        return self.stack[key]
+
+    def frame(self, image):
+        """Frame number of a hologram, by name or number"""
+        return self.images.index(image) if isinstance(image, str) else int(image)
+
+    def plane(self, image, i, amplitude = False):
+        """
+        Plane i of a hologram (name or frame number) as uint8, or with
+        amplitude = True scaled back to the amplitude range of its stack.
+        """
+        frame = self.frame(image)
+        plane = self.stack[frame, i]
+        if not amplitude:
+            return plane
+        lo, hi = self.range[frame]
+        return lo + plane * ((hi - lo) / 255)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---- Image encoding ----
+# PNG and GIF encoding runs in a pool of threads (PIL releases the GIL while
+# compressing), so the outputs of a hologram are written while the next one
+# is reconstructed. Planes are copied when handed over, as they may be reused
+# buffers.
+
+# Grey palette shared by all gif frames, so no frame has to be quantised
+GREY_PALETTE = np.repeat(np.arange(256, dtype = np.uint8), 3).tolist()
+
+
+def _save_png(image_fn, image, compress_level):
+    Image.fromarray(image).save(image_fn, format = 'PNG', compress_level = compress_level)
+
+
+def _save_gif(gif_fn, frames, duration):
+    frames[0].save(fp = gif_fn, format = 'GIF', append_images = frames[1:], save_all = True,
+                   duration = duration, loop = 0)
+
+
+def gif_frame(plane, downsample = 1):
+    """uint8 plane as gif frame with GREY_PALETTE, optionally averaged over downsample x downsample pixels"""
+    plane = np.asarray(plane)
+    if downsample > 1:
+        h, w = (plane.shape[0] // downsample) * downsample, (plane.shape[1] // downsample) * downsample
+        blocks = plane[:h, :w].reshape(h // downsample, downsample, w // downsample, downsample)
+        plane = np.rint(blocks.mean(axis = (1, 3))).astype(np.uint8)
+    frame = Image.frombytes('P', plane.shape[::-1], np.ascontiguousarray(plane).tobytes())
+    frame.putpalette(GREY_PALETTE)
+    return frame
+
+
+class ImageEncoder:
+    """
+    Write images from a pool of threads.
+
+    At most max_pending images wait to be written; beyond that, saving waits
+    for the oldest one, which bounds the memory held by copies of the planes.
+    Errors are collected per file and returned by flush.
+
+    Parameters
+    ----------
+    threads: integer
+        Number of threads. 0 writes the images right away. Default: 2
+    compress_level: integer
+        PNG compression level, 0 (none, fastest) - 9 (smallest). Default: 6
+    max_pending: integer
+        Optional. Images waiting to be written. Default: 16 per thread
+    """
+    def __init__(self, threads = 2, compress_level = 6, max_pending = None):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.threads = int(threads)
+        self.compress_level = compress_level
+        self.max_pending = max_pending or 16 * max(1, self.threads)
+        self.executor = ThreadPoolExecutor(self.threads) if self.threads > 0 else None
+        # the threads do not carry over to forked processes
+        self.pid = os.getpid()
+        self.pending = []
+        self.failed = {}
+
+    def _collect(self, image_fn, future):
+        try:
+            future.result()
+        except Exception as e:
+            self.failed[str(image_fn)] = repr(e)
+
+    def _submit(self, image_fn, func, *args):
+        if self.executor is None:
+            try:
+                func(image_fn, *args)
+            except Exception as e:
+                self.failed[str(image_fn)] = repr(e)
+            return
+        while len(self.pending) >= self.max_pending:
+            self._collect(*self.pending.pop(0))
+        self.pending.append((image_fn, self.executor.submit(func, image_fn, *args)))
+
+    def save_png(self, image_fn, image):
+        """Write a uint8 image as .png"""
+        self._submit(image_fn, _save_png, np.array(image), self.compress_level)
+
+    def save_gif(self, gif_fn, frames, duration = 200):
+        """Write frames (see gif_frame) as animated gif"""
+        self._submit(gif_fn, _save_gif, list(frames), duration)
+
+    def flush(self):
+        """Wait for all images; returns {file: error} of the images that failed since the last flush"""
+        while self.pending:
+            self._collect(*self.pending.pop(0))
+        failed, self.failed = self.failed, {}
+        return failed
+
+
+# ImageEncoder of this process per setting, see get_encoder
+_encoders = {}
+
+
+def get_encoder(threads = 2, compress_level = 6, max_pending = None):
+    """ImageEncoder of this process, made on first use and reused for the same arguments"""
+    key = (threads, compress_level, max_pending)
+    if key not in _encoders or _encoders[key].pid != os.getpid():
+        _encoders[key] = ImageEncoder(threads, compress_level = compress_level, max_pending = max_pending)
+    return _encoders[key]
+
+
+# ---- Background removal ----
+# Static fringes of the windows and the laser are common to consecutive
+# holograms. They are estimated as the rolling median (or mean) of the last
+# frames, kept in a ring buffer as the holograms stream past, and removed
+# before propagation.
+
+class RollingBackground:
+    """
+    Rolling background of the last frames, removed from each new hologram.
+
+    The frames are kept in a ring buffer. For the median they are also kept
+    sorted per pixel; each new frame replaces the oldest one by shifting the
+    values in between, which is cheaper than a median over all frames.
+
+    Parameters
+    ----------
+    frames: integer
+        Number of frames of the background. Default: 20
+    statistic: str
+        'median' or 'mean'. Default: 'median'
+    mode: str
+        'subtract' the background or 'divide' by it. The result is scaled back
+        to the mean grey value of the background, so it keeps the range of a
+        raw hologram. Default: 'subtract'
+    min_frames: integer
+        Frames needed before the background is removed; a background of
+        fewer frames would hold the particles of the current hologram, so the
+        first holograms after a reset are returned unchanged. Default: 3
+
+    Example
+    --------
+    background = RollingBackground(frames = 20)
+    for image_fn in image_fns:
+        holo = background(load_hologram(image_fn).pixels)
+    """
+    def __init__(self, frames = 20, statistic = 'median', mode = 'subtract', min_frames = 3):
+        if statistic not in ('median', 'mean'):
+            raise ValueError("statistic must be 'median' or 'mean', not %r" % (statistic,))
+        if mode not in ('subtract', 'divide'):
+            raise ValueError("mode must be 'subtract' or 'divide', not %r" % (mode,))
+        if not 0 < frames < 2 ** 15:
+            raise ValueError("frames must be between 1 and 32767, not %r" % (frames,))
+        self.frames = int(frames)
+        self.statistic = statistic
+        self.mode = mode
+        self.min_frames = min(int(min_frames), self.frames)
+        self.reset()
+
+    def reset(self):
+        """Forget all frames, e.g. at a gap in the sequence"""
+        self.count = 0
+        self._next = 0
+        self._ring = self._sorted = self._sum = None
+
+    def _allocate(self, pixels):
+        self._ring = np.empty((self.frames,) + pixels.shape, dtype = pixels.dtype)
+        if self.statistic == 'median':
+            self._sorted = np.empty_like(self._ring)
+            self._rank = np.empty(pixels.shape, dtype = np.int16)
+            self._old_rank = np.empty(pixels.shape, dtype = np.int16)
+            self._masks = np.empty((2,) + pixels.shape, dtype = bool)
+            self._step = np.empty(pixels.shape, dtype = pixels.dtype)
+        else:
+            self._sum = np.zeros(pixels.shape, dtype = np.float64)
+        self._background = np.empty(pixels.shape, dtype = np.float64)
+        self._out = np.empty(pixels.shape, dtype = np.float64)
+
+    def _insert_sorted(self, new, old):
+        """Replace old (None while filling) by new in the sorted frames"""
+        s, r, a = self._sorted, self._rank, self._old_rank
+        n = self.count
+
+        # a: position of the old value, r: position of the new value once
+        # the old one is removed
+        r[...] = 0
+        for j in range(n):
+            np.add(r, s[j] < new, out = r)
+        if old is None:
+            a[...] = n
+        else:
+            a[...] = 0
+            for j in range(n):
+                np.add(a, s[j] < old, out = a)
+            np.subtract(r, old < new, out = r)
+            n -= 1
+
+        # shift the values between both positions by one. For integers as
+        # s[j] += mask * (neighbour - s[j]), which is faster than a masked
+        # copy and exact as the difference wraps around; other types (e.g.
+        # float) are copied, where the difference would round
+        m, step = self._masks, self._step
+        for j in range(n):
+            np.less_equal(a, j, out = m[0])
+            np.logical_and(m[0], np.greater(r, j, out = m[1]), out = m[0])
+            self._shift(j, j + 1, m[0], step)
+        for j in range(n, 0, -1):
+            np.greater_equal(a, j, out = m[0])
+            np.logical_and(m[0], np.less(r, j, out = m[1]), out = m[0])
+            self._shift(j, j - 1, m[0], step)
+        np.put_along_axis(s, r[None].astype(np.intp), new[None], axis = 0)
+
+    def _shift(self, j, k, mask, step):
+        """Set the sorted frame j to frame k where mask is True"""
+        s = self._sorted
+        if s.dtype.kind in 'ui':
+            np.subtract(s[k], s[j], out = step)
+            s[j] += np.multiply(step, mask, out = step)
+        else:
+            np.copyto(s[j], s[k], where = mask)
+
+    def update(self, pixels):
+        """Add a frame, dropping the oldest one once `frames` are kept; returns the background"""
+        pixels = np.asarray(pixels)
+        if self._ring is None or self._ring.shape[1:] != pixels.shape or self._ring.dtype != pixels.dtype:
+            self.reset()
+            self._allocate(pixels)
+
+        old = self._ring[self._next].copy() if self.count == self.frames else None
+        if self.statistic == 'median':
+            self._insert_sorted(pixels, old)
+        else:
+            self._sum += pixels
+            if old is not None:
+                self._sum -= old
+        self._ring[self._next] = pixels
+        self._next = (self._next + 1) % self.frames
+        self.count = min(self.count + 1, self.frames)
+
+        n = self.count
+        if self.statistic == 'median':
+            # in float64: the sum of two uint8 values would wrap around
+            np.add(self._sorted[(n - 1) // 2], self._sorted[n // 2], out = self._background, dtype = np.float64)
+            self._background /= 2
+        else:
+            np.divide(self._sum, n, out = self._background)
+        return self._background
+
+    def __call__(self, pixels):
+        """
+        Add a frame and return it without the background (float64). The
+        returned array is reused by the next call.
+        """
+        background = self.update(pixels)
+        if self.count < self.min_frames:
+            np.copyto(self._out, pixels)
+            return self._out
+        level = background.mean()
+        if self.mode == 'subtract':
+            np.subtract(pixels, background, out = self._out)
+            self._out += level
+        else:
+            np.divide(pixels, np.maximum(background, 1), out = self._out)
+            self._out *= level
+        return self._out
+
+
+# RollingBackground of this process per setting, see get_background
+_backgrounds = {}
+
+
+def get_background(frames = 20, statistic = 'median', mode = 'subtract', min_frames = 3):
+    """
+    RollingBackground of this process, made on first use and reused for the
+    same arguments. run_batch starts each chunk of consecutive holograms with
+    an empty background.
+    """
+    key = (frames, statistic, mode, min_frames)
+    if key not in _backgrounds:
+        _backgrounds[key] = RollingBackground(frames, statistic = statistic, mode = mode, min_frames = min_frames)
+    return _backgrounds[key]
+
+
+# ---- Autofocus ----
+# Instead of reconstructing a dense stack to look for the sharpest plane, the
+# sharpness is evaluated on a coarse grid of distances at low resolution,
+# where the depth of focus is wide, and the bracket around the sharpest plane
+# is narrowed at increasing resolution, ending with a golden-section search at
+# full resolution. Each evaluated distance costs one multiply and inverse FFT,
+# of a downsampled spectrum on the coarse levels.
+
+# Distances of the sampling volume (planes 19 - 51 of the 0 - 100 mm stack,
+# see reconstruct_batch); the hologram plane itself is always the sharpest.
+SAMPLING_VOLUME = (36000, 100000)
+
+
+def sharpness(image, metric = 'tenengrad', regions = None):
+    """
+    Sharpness of an image, as a whole or per region.
+
+    Parameters
+    ----------
+    image: array
+        Amplitude image
+    metric: str
+        'tenengrad' (mean squared Sobel gradient) or 'laplacian' (variance of
+        the Laplacian, more sensitive to noise). Default: 'tenengrad'
+    regions: list
+        Optional. (min_row, min_col, max_row, max_col) bounding boxes, as
+        skimage.measure.regionprops bbox. Default: the whole image
+
+    Returns
+    --------
+    array
+        sharpness of each region (one value without regions)
+    """
+    from scipy import ndimage
+
+    if metric == 'tenengrad':
+        f = ndimage.sobel(image, axis = 0) ** 2 + ndimage.sobel(image, axis = 1) ** 2
+        reduce = np.mean
+    elif metric == 'laplacian':
+        f = ndimage.laplace(image)
+        reduce = np.var
+    else:
+        raise ValueError("Unknown sharpness metric: " + str(metric))
+
+    if regions is None:
+        return np.array([reduce(f)])
+    return np.array([reduce(f[r0:r1, c0:c1]) for r0, c0, r1, c1 in regions])
+
+
+class Refocuser:
+    """
+    Amplitude of a hologram at any distance.
+
+    The hologram is transformed once; each distance then costs a transfer
+    function, a multiply and an inverse FFT (see iter_planes).
+    downsampled gives a Refocuser of the central part of the spectrum, i.e.
+    of a low-pass filtered, downsampled hologram, which is cheaper and has a
+    wider depth of focus.
+
+    Parameters
+    ----------
+    holo: array
+        Hologram, e.g. RawHologram.pixels
+    spacing, medium_index, illum_wavelen, cfsp, precision:
+        see iter_planes
+    """
+    def __init__(self, holo, spacing = SPACING, medium_index = MEDIUM_INDEX, illum_wavelen = ILLUM_WAVELEN,
+                 cfsp = 0, precision = 'double'):
+        real, dtype = PRECISIONS[precision]
+        holo = np.asarray(holo, dtype = real)
+        self._setup(get_fft_backend().fft2(holo), spacing, illum_wavelen / medium_index, cfsp, dtype)
+        self.downsample = 1
+
+    def _setup(self, spectrum, spacing, med_wavelen, cfsp, dtype):
+        self.spectrum = spectrum
+        self.shape = spectrum.shape
+        self.spacing = np.broadcast_to(np.asarray(spacing, dtype = float), (2,))
+        self.med_wavelen = med_wavelen
+        self.cfsp = cfsp
+        self.dtype = dtype
+        kz, mask = _kz(self.shape, self.spacing, med_wavelen)
+        self.kz, self.mask = np.fft.ifftshift(kz), np.fft.ifftshift(mask)
+        self.n_planes = 0
+
+    def downsampled(self, factor):
+        """Refocuser of the hologram downsampled by factor, from the central frequencies"""
+        if factor == 1:
+            return self
+        shape = tuple(max(1, n // factor) for n in self.shape)
+        shifted = np.fft.fftshift(self.spectrum)
+        crop = tuple(slice(n // 2 - m // 2, n // 2 - m // 2 + m) for n, m in zip(self.shape, shape))
+        # keep the amplitude scale of the full hologram
+        spectrum = np.fft.ifftshift(shifted[crop]) * (np.prod(shape) / np.prod(self.shape))
+
+        res = object.__new__(Refocuser)
+        res._setup(spectrum, self.spacing * np.array(self.shape) / np.array(shape),
+                   self.med_wavelen, self.cfsp, self.dtype)
+        res.downsample = self.downsample * factor
+        return res
+
+    def amplitude(self, z):
+        """Amplitude of the hologram propagated to distance z"""
+        g = _trans_func_plane(self.kz, self.mask, z, self.cfsp).astype(self.dtype, copy = False)
+        self.n_planes += 1
+        return np.abs(get_fft_backend().ifft2(np.multiply(self.spectrum, g, out = g), out = g))
+
+
+def _scale_regions(regions, factor, shape, min_size = 8):
+    """Bounding boxes on an image downsampled by factor, at least min_size pixels wide"""
+    if regions is None:
+        return None
+    scaled = []
+    for r0, c0, r1, c1 in regions:
+        box = []
+        for lo, hi, n in ((r0, r1, shape[0]), (c0, c1, shape[1])):
+            lo, hi = lo // factor, -(-hi // factor)
+            grow = max(0, min(min_size, n) - (hi - lo))
+            lo = min(max(0, lo - grow // 2), n - max(hi - lo + grow, 1))
+            box.append((lo, min(n, lo + max(hi - lo + grow, 1))))
+        scaled.append((box[0][0], box[1][0], box[0][1], box[1][1]))
+    return scaled
+
+
+def autofocus(holo, z_range = SAMPLING_VOLUME, n_coarse = 11, n_fine = 5, downsample = 8, tol = 100,
+              metric = 'tenengrad', regions = None, spacing = SPACING, medium_index = MEDIUM_INDEX,
+              illum_wavelen = ILLUM_WAVELEN, cfsp = 0, precision = 'double', stats = None):
+    """
+    Find the distance of best focus by a coarse-to-fine search.
+
+    The sharpness (see sharpness) is evaluated at n_coarse evenly spaced
+    distances on the hologram downsampled by `downsample`. The bracket around
+    the sharpest distance is then sampled at n_fine distances at twice the
+    resolution, until full resolution, where a golden-section search narrows
+    it down to tol. Each region is focused separately. With the defaults this
+    costs about as much as 17 planes of a dense stack (coarse planes are
+    cheaper), instead of hundreds.
+
+    Parameters
+    ----------
+    holo: array
+        Hologram, e.g. RawHologram.pixels
+    z_range: tuple
+        (min, max) distance to search, in um. Default: SAMPLING_VOLUME
+    n_coarse: integer
+        Number of distances of the coarse grid. Default: 11
+    n_fine: integer
+        Number of distances in the bracket at each finer level. Default: 5
+    downsample: integer
+        Downsampling of the coarse grid, a power of 2. Default: 8
+    tol: float
+        Width of the final bracket, in um. Default: 100
+    metric: str
+        'tenengrad' or 'laplacian', see sharpness. Default: 'tenengrad'
+    regions: list
+        Optional. Bounding boxes (min_row, min_col, max_row, max_col) to
+        focus separately. Default: the whole hologram
+    spacing, medium_index, illum_wavelen, cfsp, precision:
+        see iter_planes
+    stats: dict
+        Optional. Receives 'n_planes', the number of planes reconstructed at
+        each downsampling, and 'sharpness', the sharpness at best focus
+
+    Returns
+    --------
+    z
+        distance of best focus of each region (one value without regions)
+    images
+        amplitude image at best focus of each region (cropped to the region)
+    """
+    full = Refocuser(holo, spacing = spacing, medium_index = medium_index,
+                     illum_wavelen = illum_wavelen, cfsp = cfsp, precision = precision)
+    n_regions = 1 if regions is None else len(regions)
+    levels = [full.downsampled(downsample // 2 ** i) for i in range(int(np.log2(downsample)) + 1)]
+
+    evaluated = {}
+
+    def measure(level, z, r):
+        key = (level.downsample, z)
+        if key not in evaluated:
+            evaluated[key] = sharpness(level.amplitude(z), metric = metric,
+                                       regions = _scale_regions(regions, level.downsample, level.shape))
+        return evaluated[key][r]
+
+    z_best = np.empty(n_regions)
+    s_best = np.empty(n_regions)
+    for r in range(n_regions):
+        # ---- coarse grid, then finer grids in the bracket ----
+        a, b = z_range
+        for level, n in zip(levels, [n_coarse] + [n_fine] * (len(levels) - 1)):
+            grid = np.linspace(a, b, n)
+            k = int(np.argmax([measure(level, z, r) for z in grid]))
+            a, b = grid[max(k - 1, 0)], grid[min(k + 1, n - 1)]
+
+        # ---- golden-section search at full resolution ----
+        invphi = (np.sqrt(5) - 1) / 2
+        c, d = b - invphi * (b - a), a + invphi * (b - a)
+        fc, fd = measure(full, c, r), measure(full, d, r)
+        while b - a > tol:
+            if fc > fd:
+                b, d, fd = d, c, fc
+                c = b - invphi * (b - a)
+                fc = measure(full, c, r)
+            else:
+                a, c, fc = c, d, fd
+                d = a + invphi * (b - a)
+                fd = measure(full, d, r)
+        candidates = [grid[k], c, d]
+        best = int(np.argmax([measure(full, z, r) for z in candidates]))
+        z_best[r], s_best[r] = candidates[best], measure(full, candidates[best], r)
+
+    # ---- focused images ----
+    images = [None] * n_regions
+    for z in np.unique(z_best):
+        image = full.amplitude(z)
+        for r in np.flatnonzero(z_best == z):
+            if regions is None:
+                images[r] = image
+            else:
+                r0, c0, r1, c1 = regions[r]
+                images[r] = image[r0:r1, c0:c1].copy()
+
+    if stats is not None:
+        stats['n_planes'] = {level.downsample: level.n_planes for level in levels}
+        stats['sharpness'] = s_best
+
+    return z_best, images
+
+
+# ---- Particle reconstruction ----
+# On sparse holograms only a few small regions hold particles. These are
+# detected on the z-min image, and only a window around each particle is
+# reconstructed, with small FFTs. Window sizes are powers of 2, so their
+# transfer functions are shared between particles and holograms.
+
+# Transfer functions of the particle windows, a few window sizes
+WINDOW_CACHE = TransferFunctionCache(maxsize = 8)
+
+
+def detect_particles(z_min, sigma = 5.0, threshold = None, min_area = 20, max_particles = None):
+    """
+    Detect dark objects on a z-min image.
+
+    Parameters
+    ----------
+    z_min: array
+        z-min image (e.g. saved by zmin_batch)
+    sigma: float
+        Threshold in robust standard deviations (1.4826 * MAD) below the median. Default: 5.0
+    threshold: float
+        Optional. Grey value below which pixels belong to an object, overrides sigma
+    min_area: integer
+        Smallest object in pixels. Default: 20
+    max_particles: integer
+        Optional. Keep only the largest objects
+
+    Returns
+    --------
+    pandas.DataFrame
+        one row per object: label, row, col (centroid), area and the bounding
+        box min_row, min_col, max_row, max_col
+    """
+    from scipy import ndimage
+    from skimage import measure
+
+    z_min = np.asarray(z_min, dtype = float)
+    if threshold is None:
+        median = np.median(z_min)
+        spread = max(1.4826 * np.median(np.abs(z_min - median)), 1.0)
+        threshold = median - sigma * spread
+
+    # fringes around a particle are dark rings enclosing it, filled into one object
+    labels = measure.label(ndimage.binary_fill_holes(z_min < threshold))
+    rows = [(p.label, p.centroid[0], p.centroid[1], p.area) + tuple(p.bbox)
+            for p in measure.regionprops(labels) if p.area >= min_area]
+    particles = pd.DataFrame(rows, columns = ["label", "row", "col", "area",
+                                              "min_row", "min_col", "max_row", "max_col"])
+    particles = particles.sort_values("area", ascending = False, kind = 'stable')
+    if max_particles is not None:
+        particles = particles.iloc[:max_particles]
+    return particles.reset_index(drop = True)
+
+
+def _particle_window(bbox, pad, shape):
+    """Slices of the power of 2 sized window around bbox plus pad, shifted to lie inside shape"""
+    window = []
+    for lo, hi, n in ((bbox[0], bbox[2], shape[0]), (bbox[1], bbox[3], shape[1])):
+        size = min(n, 1 << int(np.ceil(np.log2(hi - lo + 2 * pad))))
+        start = min(max(0, (lo + hi) // 2 - size // 2), n - size)
+        window.append(slice(start, start + size))
+    return tuple(window)
+
+
+def reconstruct_particles(holo, particles, d = None, pad = 64, margin = 8, metric = 'tenengrad',
+                          spacing = SPACING, medium_index = MEDIUM_INDEX, illum_wavelen = ILLUM_WAVELEN,
+                          cfsp = 0, cache = WINDOW_CACHE, precision = 'double'):
+    """
+    Reconstruct windows around particles and find their best focus.
+
+    For each particle a window of the hologram, the bounding box plus pad on
+    each side rounded up to a power of 2, is reconstructed at the distances d
+    (see iter_planes). The sharpest plane within the bounding box plus margin
+    (see sharpness) is taken as in focus.
+
+    Parameters
+    ----------
+    holo: array
+        Hologram, e.g. RawHologram.pixels
+    particles: pandas.DataFrame
+        Bounding boxes (min_row, min_col, max_row, max_col), e.g. from detect_particles
+    d: list of floats
+        Optional. Reconstruction distances. Default: 33 planes over SAMPLING_VOLUME
+    pad: integer
+        Pixels of hologram around the particle to reconstruct from; has to
+        hold the particle's diffraction fringes. Default: 64
+    margin: integer
+        Pixels around the bounding box in the crops. Default: 8
+    metric: str
+        see sharpness. Default: 'tenengrad'
+    spacing, medium_index, illum_wavelen, cfsp, precision:
+        see iter_planes
+    cache: TransferFunctionCache
+        Cache of the transfer functions per window size. Default: WINDOW_CACHE
+
+    Returns
+    --------
+    particles: pandas.DataFrame
+        particles with the distance of best focus (z) and its sharpness
+    crops: list
+        amplitude image of each particle at best focus
+    """
+    real, _ = PRECISIONS[precision]
+    holo = np.asarray(holo, dtype = real)
+    d = np.linspace(SAMPLING_VOLUME[0], SAMPLING_VOLUME[1], 33) if d is None else d
+
+    z_best, s_best, crops = [], [], []
+    for p in particles.itertuples():
+        bbox = (p.min_row, p.min_col, p.max_row, p.max_col)
+        rows, cols = _particle_window(bbox, pad, holo.shape)
+
+        # crop in window coordinates
+        r0, c0 = max(bbox[0] - margin, rows.start) - rows.start, max(bbox[1] - margin, cols.start) - cols.start
+        r1, c1 = min(bbox[2] + margin, rows.stop) - rows.start, min(bbox[3] + margin, cols.stop) - cols.start
+
+        best = (-np.inf, np.nan, None)
+        for i, z, field in iter_planes(holo[rows, cols], d, spacing = spacing, medium_index = medium_index,
+                                       illum_wavelen = illum_wavelen, cfsp = cfsp, cache = cache,
+                                       method = 'exact', precision = precision):
+            crop = np.abs(field[r0:r1, c0:c1])
+            s = sharpness(crop, metric = metric)[0]
+            if s > best[0]:
+                best = (s, z, crop)
+        s_best.append(best[0])
+        z_best.append(best[1])
+        crops.append(best[2])
+
+    particles = particles.copy()
+    particles["z"] = z_best
+    particles["sharpness"] = s_best
+    return particles, crops
+
+
+# ---- Synthetic holograms ----
+# Holograms with valid LISST-Holo1/2 metadata trailers, particle diffraction
+# patterns and a cast depth profile, for benchmarks and for trying out the
+# processing without instrument data. A particle is an opaque disc; its
+# pattern is the intensity of the disc's shadow propagated to the hologram
+# plane, computed once per size and distance in a small tapered window and
+# stamped into the frames.
+
+# Steinhart-Hart coefficients of a 10 kOhm thermistor, for the synthetic trailers
+SYNTHETIC_TEMP_COEFS = (1.129e-3, 2.341e-4, 8.775e-8)
+
+
+def particle_pattern(radius, z, size = 256, spacing = SPACING, medium_index = MEDIUM_INDEX,
+                     illum_wavelen = ILLUM_WAVELEN):
+    """
+    Relative intensity change of the hologram of an opaque disc.
+
+    Parameters
+    ----------
+    radius: float
+        Disc radius in pixels
+    z: float
+        Distance of the disc from the hologram plane in um
+    size: integer
+        Window size in pixels; the pattern is tapered to 0 at its edges. Default: 256
+    spacing, medium_index, illum_wavelen:
+        see iter_planes
+
+    Returns
+    --------
+    (size, size) array of hologram / background - 1
+    """
+    r = np.arange(size) - size / 2
+    disc = (r[:, np.newaxis] ** 2 + r[np.newaxis, :] ** 2) <= radius ** 2
+    # the shadow, propagated back from the disc to the hologram plane
+    _, _, field = next(iter_planes(1.0 - disc, [-z], spacing = spacing, medium_index = medium_index,
+                                   illum_wavelen = illum_wavelen, method = 'exact', cache = None))
+    taper = np.hanning(size)
+    return (np.abs(field) ** 2 - 1) * taper[:, np.newaxis] * taper[np.newaxis, :]
+
+
+def synthetic_hologram(particles = (), shape = IMAGE_SHAPE, background = 120.0, noise = 3.0,
+                       patterns = None, seed = None):
+    """
+    Hologram of particles on a uniform background.
+
+    Parameters
+    ----------
+    particles: list
+        (row, col, radius in pixels, z in um) of each particle
+    shape: tuple
+        Image shape. Default: IMAGE_SHAPE
+    background: float
+        Grey value of the background. Default: 120.0
+    noise: float
+        Standard deviation of the pixel noise. Default: 3.0
+    patterns: dict
+        Optional. Cache of particle_pattern by (radius, z), shared between holograms
+    seed: integer
+        Optional. Seed of the noise
+
+    Returns
+    --------
+    uint8 array
+    """
+    patterns = {} if patterns is None else patterns
+    intensity = np.ones(shape)
+    for row, col, radius, z in particles:
+        key = (radius, z)
+        if key not in patterns:
+            patterns[key] = particle_pattern(radius, z)
+        pattern = patterns[key]
+        # stamp the pattern, clipped at the image borders
+        r0, c0 = int(row) - pattern.shape[0] // 2, int(col) - pattern.shape[1] // 2
+        rows = slice(max(r0, 0), min(r0 + pattern.shape[0], shape[0]))
+        cols = slice(max(c0, 0), min(c0 + pattern.shape[1], shape[1]))
+        intensity[rows, cols] += pattern[rows.start - r0:rows.stop - r0, cols.start - c0:cols.stop - c0]
+
+    rng = np.random.default_rng(seed)
+    pixels = background * intensity + rng.normal(0, noise, shape)
+    return np.clip(np.rint(pixels), 0, 255).astype(np.uint8)
+
+
+def _synthetic_counts(depth, temperature, version):
+    """Pressure and temperature counts and calibration coefficients giving depth and temperature"""
+    depth_a, depth_b, depth_c = (0.0, 0.01, -1.5) if version == 2 else (1e-9, 0.01, -1.5)
+    p = (depth - depth_c) / depth_b
+    if version == 1:
+        # solve depth_a * p^2 + depth_b * p + depth_c = depth
+        p = (-depth_b + np.sqrt(depth_b ** 2 - 4 * depth_a * (depth_c - depth))) / (2 * depth_a)
+
+    # thermistor resistance at the temperature: solve the Steinhart-Hart equation by Newton's method
+    a, b, c = SYNTHETIC_TEMP_COEFS
+    x = np.log(10000.0)
+    for _ in range(20):
+        x -= (a + b * x + c * x ** 3 - 1 / (temperature + 273.15)) / (b + 3 * c * x ** 2)
+    Rt = np.exp(x)
+    if version == 1:
+        t = 4.096 * Rt / (10000 + Rt) / 0.001
+    else:
+        t = 4.096 * Rt / (13000.0 + Rt) * 65535 / 4.096
+    return int(round(p)), int(round(t)), (depth_a, depth_b, depth_c)
+
+
+def write_hologram(image_fn, pixels, depth = 0.0, temperature = 10.0, epoch = None, version = 2,
+                   serial_number = "1234"):
+    """
+    Save pixels as raw LISST-Holo hologram (.pgm) with metadata trailers.
+
+    Block 2 holds counts and calibration coefficients that give depth and
+    temperature (see calibrate_metadata); the end of block 2 is filled for the
+    LISST-Holo2. Block 3 holds the same as text.
+
+    Parameters
+    ----------
+    image_fn: str
+        Output file
+    pixels: array
+        (1200, 1600) uint8 hologram
+    depth: float
+        Depth in m. Default: 0.0
+    temperature: float
+        Temperature in degC. Default: 10.0
+    epoch: integer
+        Optional. Time as seconds since 1970. Default: now
+    version: integer
+        1 for LISST-Holo1, 2 for LISST-Holo2. Default: 2
+    serial_number: str
+        Four character serial number. Default: "1234"
+    """
+    pixels = np.asarray(pixels, dtype = np.uint8)
+    epoch = int(time.time()) if epoch is None else int(epoch)
+    pressure_counts, temperature_counts, depth_coefs = _synthetic_counts(depth, temperature, version)
+
+    block2 = np.zeros(1, dtype = BLOCK2_DTYPE)
+    block2['epoch'] = epoch
+    block2['pressure_counts'] = pressure_counts
+    block2['temperature_counts'] = temperature_counts
+    block2['voltage_counts'] = 3000
+    block2['exposure'] = 100
+    block2['laser_power'] = 2000
+    block2['laser_diode'] = 1500
+    block2['brightness'], block2['brightness_min'], block2['brightness_max'] = 128, 0, 255
+    block2['shutter'], block2['shutter_min'], block2['shutter_max'] = 100, 1, 1000
+    block2['gain'], block2['gain_min'], block2['gain_max'] = 16, 0, 48
+    block2['depth_a'], block2['depth_b'], block2['depth_c'] = depth_coefs
+    block2['temp_a'], block2['temp_b'], block2['temp_c'] = SYNTHETIC_TEMP_COEFS
+    block2['temp_slope'], block2['temp_offset'] = 1.0, 0.0
+    block2['frame_delay'] = 1000
+    block2['serial_number'] = serial_number.encode()[:4]
+    if version == 2:
+        block2['reserved'][0, 0] = 1
+
+    # depth is the 12th word of the text, as read by scripts/hologram_reconstruction.py
+    stamp = datetime.datetime.fromtimestamp(epoch)
+    block3 = ("Date: %s Time: %s Serial number: %s Temperature: %.2f C Depth: %.2f m"
+              % (stamp.date(), stamp.time(), serial_number, temperature, depth))
+    block3 = block3.encode().ljust(1024, b' ')
+
+    header = ("P5\n%d %d\n255\n" % (pixels.shape[1], pixels.shape[0])).encode()
+    with open(image_fn, 'wb') as f:
+        f.write(header)
+        f.write(pixels.tobytes())
+        f.write(block2.tobytes())
+        f.write(block3)
+
+
+def synthetic_cast(folder, n_frames = 100, max_depth = 100.0, soak = 5, version = 2, particles = (0, 20),
+                   interval = 2, seed = 0):
+    """
+    Write a synthetic cast of holograms.
+
+    The instrument is lowered to 5 m and soaks there for `soak` frames,
+    returns to the surface, goes down to max_depth and back up, with small
+    depth jitter (the phases of cast_phases). Each hologram holds a random
+    number of particles of random size, position and distance within the
+    sampling volume.
+
+    Parameters
+    ----------
+    folder: str
+        Output folder, made if missing
+    n_frames: integer
+        Number of holograms. Default: 100
+    max_depth: float
+        Deepest point of the cast in m. Default: 100.0
+    soak: integer
+        Number of holograms of the soak, before the return to the surface. Default: 5
+    version: integer
+        LISST-Holo version of the metadata, 1 or 2. Default: 2
+    particles: tuple
+        Range (min, max) of the number of particles per hologram. Default: (0, 20)
+    interval: integer
+        Seconds between holograms. Default: 2
+    seed: integer
+        Seed of the random numbers. Default: 0
+
+    Returns
+    --------
+    pandas.DataFrame
+        File, Depth and Particles of each hologram
+    """
+    folder = Path(folder)
+    if not folder.exists(): folder.mkdir(parents = True)
+    rng = np.random.default_rng(seed)
+
+    # depth profile: soak, return to the surface, then down and up
+    n_return = max(soak // 2, 1)
+    n_cast = max(n_frames - soak - n_return, 1)
+    turn = n_cast // 2
+    profile = np.concatenate([np.linspace(1.0, 5.0, soak),
+                              np.linspace(5.0, 1.0, n_return + 1)[1:],
+                              np.linspace(1.0, max_depth, turn, endpoint = False),
+                              np.linspace(max_depth, 1.0, n_cast - turn)])[:n_frames]
+    depth = np.maximum(profile + rng.normal(0, 0.05, n_frames), 0.5)
+    temperature = 15.0 - 10.0 * depth / max(max_depth, 1.0)
+
+    start = 1650000000
+    patterns = {}
+    radii = (2, 4, 8, 16)
+    distances = np.linspace(SAMPLING_VOLUME[0], SAMPLING_VOLUME[1], 8)
+    rows = []
+    for k in range(n_frames):
+        n = int(rng.integers(particles[0], particles[1] + 1))
+        frame_particles = [(rng.uniform(0, IMAGE_SHAPE[0]), rng.uniform(0, IMAGE_SHAPE[1]),
+                            radii[rng.integers(len(radii))], distances[rng.integers(len(distances))])
+                           for _ in range(n)]
+        pixels = synthetic_hologram(frame_particles, patterns = patterns, seed = seed * 100003 + k)
+        image_fn = folder.joinpath("synthetic_%05d.pgm" % k)
+        write_hologram(image_fn, pixels, depth = depth[k], temperature = temperature[k],
+                       epoch = start + k * interval, version = version)
+        rows.append((image_fn, depth[k], n))
+
+    return pd.DataFrame(rows, columns = ["File", "Depth", "Particles"])
+
+
+# ---- Telemetry ----
+# Wall time, CPU time, bytes read and written and peak memory of the
+# processing stages, per stage and per hologram, for production runs. Off by
+# default: stage() then returns a shared no-op context and costs a function
+# call. I/O and memory are read from /proc on Linux; elsewhere the memory is
+# the peak of the process so far (not recorded on Windows) and I/O is not
+# recorded.
+
+class _NoStage:
+    """Context of a stage while telemetry is off"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+def _proc_io():
+    """(bytes read, bytes written) by this process so far, None if unknown"""
+    try:
+        with open("/proc/self/io") as f:
+            io_counts = dict(line.split(":") for line in f)
+        return int(io_counts["rchar"]), int(io_counts["wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _peak_rss(reset = False):
+    """
+    Peak resident memory of this process in bytes, optionally resetting it
+    afterwards (Linux). None if unknown, e.g. on Windows.
+    """
+    peak = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+                    break
+        if reset:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+    except OSError:
+        pass
+    if peak is None and sys.platform != "win32":
+        try:
+            import resource
+        except ImportError:
+            return None
+        # ru_maxrss is in kB on Linux, in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return peak
+
+
+class _Stage:
+    """Context of a recorded stage, see Telemetry.stage"""
+    def __init__(self, telemetry, name, frame):
+        self.telemetry = telemetry
+        self.name = name
+        self.frame = frame
+        self.peak = 0
+
+    def __enter__(self):
+        active = self.telemetry._active
+        if active:
+            # the peak of the enclosing stage so far, before it is reset
+            active[-1].peak = max(active[-1].peak, _peak_rss() or 0)
+            if self.frame is None:
+                self.frame = active[-1].frame
+        active.append(self)
+        _peak_rss(reset = True)
+        self.io = _proc_io()
+        self.cpu = time.process_time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu
+        io_counts = _proc_io()
+        self.peak = max(self.peak, _peak_rss() or 0)
+        active = self.telemetry._active
+        active.pop()
+        if active:
+            active[-1].peak = max(active[-1].peak, self.peak)
+        read = written = None
+        if self.io is not None and io_counts is not None:
+            read, written = io_counts[0] - self.io[0], io_counts[1] - self.io[1]
+        self.telemetry.records.append({
+            "stage": self.name, "frame": None if self.frame is None else str(self.frame),
+            "start": self.start, "wall": wall, "cpu": cpu, "read_bytes": read,
+            "written_bytes": written, "peak_rss": self.peak or None, "pid": os.getpid()})
+        return False
+
+
+class Telemetry:
+    """
+    Recorder of the processing stages.
+
+    Each stage records its wall time, CPU time of the process (all threads),
+    bytes read and written (including from the page cache), and the peak
+    resident memory while it ran. Stages can be nested, e.g. per hologram
+    and per step; an inner stage takes the hologram of the enclosing one.
+    Batches in worker processes send their records back (see run_batch).
+
+    Parameters
+    ----------
+    enabled: boolean
+        Record stages. Default: False
+    progress: float
+        Optional. Print a throughput and ETA line at most every progress
+        seconds as holograms are done (see advance)
+
+    Example
+    --------
+    TELEMETRY.enable(progress = 30)
+    zmin_batch(raw_folder_path)
+    print(TELEMETRY.summary())
+    TELEMETRY.to_csv("telemetry.csv")
+    """
+    def __init__(self, enabled = False, progress = None):
+        self.enabled = enabled
+        self.progress = progress
+        self.records = []
+        self._active = []
+        self._run = None
+
+    def enable(self, progress = None):
+        """Start recording, optionally with progress lines every progress seconds"""
+        self.enabled = True
+        self.progress = progress
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        self.records = []
+
+    def stage(self, name, frame = None):
+        """Context manager recording a stage, e.g. with TELEMETRY.stage('propagate', image_fn):"""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self, name, frame)
+
+    def drain(self):
+        """Records so far, removed from the recorder"""
+        records, self.records = self.records, []
+        return records
+
+    def start(self, total):
+        """Start the throughput count of a run of total holograms"""
+        self._run = {'total': total, 'done': 0, 'start': time.perf_counter(), 'printed': time.perf_counter()}
+
+    def advance(self, n = 1):
+        """Count n holograms done and print the progress line when due"""
+        run = self._run
+        if run is None:
+            return
+        run['done'] += n
+        now = time.perf_counter()
+        if self.progress is None or (now - run['printed'] < self.progress and run['done'] < run['total']):
+            return
+        run['printed'] = now
+        rate = run['done'] / max(now - run['start'], 1e-9)
+        eta = (run['total'] - run['done']) / rate if rate > 0 else float('inf')
+        print("Progress: %d of %d holograms, %.2f holograms/s, ETA %s"
+              % (run['done'], run['total'], rate, datetime.timedelta(seconds = round(eta))))
+
+    def to_dataframe(self):
+        """Records as pandas.DataFrame, one row per stage run"""
+        columns = ["stage", "frame", "start", "wall", "cpu", "read_bytes", "written_bytes", "peak_rss", "pid"]
+        return pd.DataFrame(self.records, columns = columns)
+
+    def summary(self):
+        """Per stage: count, total and mean wall time, CPU time, bytes read and written, and the peak memory"""
+        df = self.to_dataframe()
+        return df.groupby("stage", sort = False).agg(
+            count = ("wall", "size"), wall = ("wall", "sum"), wall_mean = ("wall", "mean"),
+            cpu = ("cpu", "sum"), read_bytes = ("read_bytes", "sum"),
+            written_bytes = ("written_bytes", "sum"), peak_rss = ("peak_rss", "max"))
+
+    def to_csv(self, fn):
+        """Save the records as .csv"""
+        self.to_dataframe().to_csv(fn, index = False)
+
+    def to_json(self, fn):
+        """Save the records as JSON list"""
+        with open(fn, "w") as f:
+            json.dump(self.records, f, indent = 1)
+
+
+# Recorder of this process; off until TELEMETRY.enable()
+TELEMETRY = Telemetry()
+
+
+def instrument(name = None):
+    """
+    Decorator recording each call of a function as a stage of TELEMETRY
+    (default name: the function's name).
+    """
+    def decorator(func):
+        stage_name = name or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not TELEMETRY.enabled:
+                return func(*args, **kwargs)
+            with TELEMETRY.stage(stage_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# ---- Memory planning ----
+# Nearly all the memory of a reconstruction is in buffers of the hologram
+# shape, so it is estimated per pixel from the settings. plan_reconstruction
+# fits the settings of a batch into a memory budget, e.g. that of a job on a
+# shared node.
+
+# bytes per pixel of the transfer function recurrence (complex128 phase,
+# step and plane, and the temporaries of an exact plane)
+_TRANS_FUNC_BYTES = 81
+# planes between the exact transfer functions the recurrence restarts from
+_RESYNC = 32
+# memory of a process before reconstructing, if it cannot be read
+PROCESS_MEMORY = 200 * 2 ** 20
+# most planes of a spilled stack kept in memory
+PLANE_CHUNK = 16
+_MEMORY_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_memory(size):
+    """Bytes of a memory size: a number of bytes or a string such as '8G', '512MB' or '1.5 GiB'"""
+    if isinstance(size, str):
+        match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([KMGT]?)(?:I?B)?\s*', size.upper())
+        if match is None:
+            raise ValueError("Not a memory size: %r" % (size,))
+        return int(float(match.group(1)) * _MEMORY_UNITS[match.group(2)])
+    return int(size)
+
+
+def _rss():
+    """Resident memory of this process in bytes, None if unknown"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reconstruction_memory(n, shape = IMAGE_SHAPE, precision = 'double', plane_chunk = None, make_stack = False,
+                          make_gif = False, gif_downsample = 1, write_queue = 0, prefetch = 2, background = None):
+    """
+    Estimated peak memory in bytes of reconstructing holograms in one process,
+    on top of the memory of the process itself. See reconstruct_batch for the
+    parameters; plane_chunk is the number of planes of the spilled stack kept
+    in memory (None: all) and write_queue the number of images waiting to be
+    written.
+    """
+    real, cplx = (np.dtype(t).itemsize for t in PRECISIONS[precision])
+    # workspace: hologram, amplitude, z-min and rescale buffer; spectrum, kernel and field; uint8 image
+    per_pixel = 4 * real + 3 * cplx + 1 + _TRANS_FUNC_BYTES
+    # complex128 restart planes of the recurrence, kept in the cache
+    per_pixel += 16 * -(-n // _RESYNC)
+    if make_stack or make_gif:
+        # planes of the float32 stack in memory, and its rescale buffer
+        per_pixel += 4 * (min(plane_chunk or n, n) + 1)
+    if make_gif:
+        # the frames, and their copies while the gif is encoded
+        per_pixel += 2 * n / gif_downsample ** 2
+    # copies of the images waiting to be written and of the holograms read ahead
+    per_pixel += write_queue + prefetch
+    if background is not None:
+        # frames of the rolling background, sorted copy and working arrays
+        per_pixel += 2 * background.get('frames', 20) + 32
+    return int(per_pixel * np.prod(shape))
+
+
+class ReconstructionPlan:
+    """
+    Settings of a batch reconstruction that fit a memory budget, see plan_reconstruction.
+
+    Attributes
+    ----------
+    workers: integer
+        Number of processes
+    precision: str
+        'double' or 'single'
+    plane_chunk: integer
+        Planes of the spilled stack kept in memory, None without stack or gif
+    write_queue: integer
+        Images waiting to be written per process
+    memory: integer
+        Estimated peak memory of the batch in bytes
+    max_memory: integer
+        The budget in bytes
+    """
+    def __init__(self, workers, precision, plane_chunk, write_queue, memory, max_memory):
+        self.workers = workers
+        self.precision = precision
+        self.plane_chunk = plane_chunk
+        self.write_queue = write_queue
+        self.memory = memory
+        self.max_memory = max_memory
+
+    def __repr__(self):
+        return ("ReconstructionPlan(workers = %d, precision = %r, plane_chunk = %s, write_queue = %d, "
+                "memory = %d MB of %d MB)" % (self.workers, self.precision, self.plane_chunk, self.write_queue,
+                                               self.memory // 2 ** 20, self.max_memory // 2 ** 20))
+
+
+def plan_reconstruction(max_memory, n = 51, shape = IMAGE_SHAPE, workers = None, precision = 'double',
+                        make_stack = False, make_gif = False, gif_downsample = 1, encoder_threads = 2,
+                        write_queue = None, prefetch = 2, background = None):
+    """
+    Choose the number of processes, the precision and the planes kept in
+    memory of a batch reconstruction within a memory budget.
+
+    The planes are reconstructed one at a time (see iter_planes); what grows
+    with the number of planes is the spilled stack, of which plane_chunk
+    planes are kept in memory (see SpilledStack), and the gif frames. The
+    plan keeps the requested precision if it fits in one process and falls
+    back to single precision otherwise. It then takes as many processes as
+    fit, up to workers, with the largest plane_chunk that allows them. Each
+    process is counted with the memory of this one. The estimate is
+    conservative, but does not include other programs on the node.
+
+    Parameters
+    ----------
+    max_memory: integer or str
+        Memory budget of the whole batch, bytes or e.g. '8G' (see parse_memory)
+    n: integer
+        Number of focus planes. Default: 51
+    shape: tuple
+        Shape of the holograms. Default: LISST-Holo image shape
+    workers: integer
+        Most processes to use. Default: number of CPUs
+    precision: str
+        Requested precision, 'double' or 'single'. Default: 'double'
+    make_stack, make_gif, gif_downsample, encoder_threads, write_queue, prefetch, background:
+        see reconstruct_batch
+
+    Returns
+    --------
+    ReconstructionPlan
+    """
+    max_memory = parse_memory(max_memory)
+    base = _rss() or PROCESS_MEMORY
+    max_workers = max(1, int(workers or os.cpu_count() or 1))
+    queue = 0 if encoder_threads == 0 else write_queue or 16 * max(1, encoder_threads)
+    spilled = make_stack or make_gif
+    chunks = sorted({min(n, c) for c in (PLANE_CHUNK, 8, 4, 2, 1)}, reverse = True) if spilled else [None]
+
+    for option in ([precision, 'single'] if precision == 'double' else [precision]):
+        best = None
+        for chunk in chunks:
+            # the planes of a stack wait to be written as copies, no more than the planes in memory
+            chunk_queue = queue if chunk is None or not make_stack else min(queue, max(encoder_threads, chunk))
+            memory = reconstruction_memory(n, shape, option, chunk, make_stack, make_gif, gif_downsample,
+                                           chunk_queue, prefetch, background)
+            if base + memory > max_memory:
+                continue
+            # with a pool, the processes come on top of this one
+            n_workers = 1
+            if max_workers > 1:
+                n_workers = int(max(1, min(max_workers, (max_memory - base) // (base + memory))))
+            total = base + memory if n_workers == 1 else base + n_workers * (base + memory)
+            if best is None or n_workers > best.workers:
+                best = ReconstructionPlan(n_workers, option, chunk, chunk_queue, total, max_memory)
+        if best is not None:
+            return best
+
+    memory = base + reconstruction_memory(n, shape, 'single', chunks[-1], make_stack, make_gif, gif_downsample,
+                                          min(queue, encoder_threads), prefetch, background)
+    raise ValueError("max_memory of %d MB is below the %d MB of a single process with the smallest settings "
+                     "(fewer planes or a larger gif_downsample need less)" % (max_memory // 2 ** 20, memory // 2 ** 20))
+
+
+# ---- Batch execution ----
+
+def _read_ahead(image_fns, depth = 2):
+    """
+    Yield (image_fn, RawHologram in memory) with a thread reading up to depth
+    files ahead, so reading overlaps with processing. The hologram is None
+    without reader (depth 0) or if the file could not be read; load_hologram
+    then reads it, and reports the error.
+    """
+    if not depth:
+        for image_fn in image_fns:
+            yield image_fn, None
+        return
+
+    import queue
+    import threading
+
+    loaded = queue.Queue(maxsize = depth)
+    stop = threading.Event()
+
+    def read():
+        for image_fn in image_fns:
+            try:
+                with open(image_fn, 'rb') as f:
+                    holo = RawHologram(image_fn, data = f.read())
+            except Exception:
+                holo = None
+            # wait for room in the queue, unless the consumer is gone
+            while not stop.is_set():
+                try:
+                    loaded.put((image_fn, holo), timeout = 0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stop.is_set():
+                return
+
+    reader = threading.Thread(target = read, daemon = True)
+    reader.start()
+    try:
+        for _ in image_fns:
+            yield loaded.get()
+    finally:
+        stop.set()
+
+
+def _run_chunk(func, image_fns, prefetch = 2, collect = False):
+    """
+    Run func on each file of a chunk, reading prefetch files ahead; errors are captured per file.
+    Returns the results and, if collect, the telemetry records of the chunk (for worker processes).
+    """
+    # a chunk is a sequence of consecutive files, backgrounds start afresh
+    for background in _backgrounds.values():
+        background.reset()
+    results = []
+    for image_fn, holo in _read_ahead(image_fns, prefetch):
+        if holo is not None:
+            _prefetched[str(image_fn)] = holo
+        try:
+            with TELEMETRY.stage("hologram", image_fn):
+                results.append((image_fn, func(image_fn), None))
+        except Exception as e:
+            results.append((image_fn, None, repr(e)))
+        finally:
+            _prefetched.pop(str(image_fn), None)
+
+    # images are written in the background, a file is only done once they are
+    for encoder in _encoders.values():
+        failed = encoder.flush()
+        for k, (image_fn, result, error) in enumerate(results):
+            error = error or _encoding_error(result, failed)
+            if error is not None:
+                results[k] = (image_fn, None, error)
+    return results, TELEMETRY.drain() if collect else []
+
+
+def _init_worker(backend, threads, telemetry):
+    """Set up a worker process: FFT backend and threads, and its own telemetry recorder"""
+    set_fft_backend(backend, threads)
+    TELEMETRY.records = []
+    TELEMETRY.enabled = telemetry
+    TELEMETRY.progress = None
+
+
+def _encoding_error(result, failed):
+    """Error of the first output of result ({output: files}) that failed to be written"""
+    if not failed or not isinstance(result, dict):
+        return None
+    for files in result.values():
+        for fn in files:
+            if str(fn) in failed:
+                return failed[str(fn)]
+    return None
+
+
+def _background_chunksize(background, image_fns, workers, chunksize = None):
+    """Chunk size for a rolling background: one run of consecutive files per process, unless given"""
+    if background is None or chunksize is not None:
+        return chunksize
+    return max(1, -(-len(image_fns) // max(1, int(workers or 1))))
+
+
+def run_batch(func, image_fns, workers = 1, chunksize = None, on_result = None, prefetch = 2):
+    """
+    Apply func to each hologram, optionally spread over a pool of processes.
+
+    Files are processed in sorted order and handed to the processes in chunks
+    of consecutive files. Each process keeps its own transfer function cache
+    and FFT plans, so these are made once per process, and the CPUs are
+    shared between the FFT threads of the processes. An error in one file is
+    reported and does not stop the batch.
+
+    Each process works as a pipeline: a reader thread reads the next
+    holograms while one is processed (taken by load_hologram), and images
+    are written by the threads of an ImageEncoder. The stages are coupled by
+    bounded queues, so a slow stage holds back the others instead of
+    filling memory.
+
+    With TELEMETRY enabled, each hologram and its steps are recorded (the
+    records of the processes are gathered in this one) and a progress line
+    with the throughput and ETA is printed as chunks are done.
+
+    Parameters
+    ----------
+    func: function
+        Function of a single file name, must be picklable for workers > 1
+        (i.e. a module-level function or functools.partial of one)
+    image_fns: list
+        The file locations of the raw holograms
+    workers: integer
+        Number of processes. 1 runs in this process. Default: 1
+    chunksize: integer
+        Number of files per task. Default: about four tasks per process, at most 16 files
+    on_result: function
+        Optional. Called in this process as on_result(image_fn, result, error)
+        as soon as the chunk of a file is done, e.g. BatchManifest.record
+    prefetch: integer
+        Number of holograms read ahead by each process; 0 reads them when
+        they are processed. Default: 2
+
+    Returns
+    --------
+    list
+        (image_fn, result, error) for each file; error is None on success
+    """
+    image_fns = sorted(image_fns)
+    workers = max(1, int(workers or 1))
+    if chunksize is None:
+        chunksize = max(1, min(16, len(image_fns) // (4 * workers)))
+    chunks = [image_fns[i:i + chunksize] for i in range(0, len(image_fns), chunksize)]
+
+    chunk_results = [None] * len(chunks)
+    if TELEMETRY.enabled:
+        TELEMETRY.start(len(image_fns))
+    if workers == 1:
+        for k, chunk in enumerate(chunks):
+            chunk_results[k], _ = _run_chunk(func, chunk, prefetch)
+            _report(chunk_results[k], on_result)
+            TELEMETRY.advance(len(chunk))
+    else:
+        # share the CPUs between the FFT threads of the processes
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with ProcessPoolExecutor(max_workers = workers, initializer = _init_worker,
+                                 initargs = (get_fft_backend().name, threads, TELEMETRY.enabled)) as executor:
+            futures = {executor.submit(_run_chunk, func, chunk, prefetch, True): k for k, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                chunk_results[futures[future]], records = future.result()
+                TELEMETRY.records.extend(records)
+                _report(chunk_results[futures[future]], on_result)
+                TELEMETRY.advance(len(chunks[futures[future]]))
+
+    results = [result for chunk in chunk_results for result in chunk]
+    failed = [(image_fn, error) for image_fn, _, error in results if error is not None]
+    print("Number of images processed:", len(results) - len(failed), "of", len(results))
+
+    return results
+
+
+def _report(results, on_result = None):
+    """Print the failures of a chunk and hand its results to on_result"""
+    for image_fn, result, error in results:
+        if error is not None:
+            print("Failed to process " + str(image_fn) + ": " + error)
+        if on_result is not None:
+            on_result(image_fn, result, error)
+
+
+def file_sha1(fn, block_size = 1 << 20):
+    """sha1 hex digest of the content of a file"""
+    h = hashlib.sha1()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class BatchManifest:
+    """
+    Processing manifest of an output folder, kept as manifest.jsonl in the folder.
+
+    One JSON record is appended per processed hologram: input path, size,
+    mtime and sha1 of the content, the processing parameters, the outputs
+    written, the status ('done' or 'failed') and the error. Records are
+    flushed as soon as a hologram is done, so an interrupted batch resumes
+    where it stopped. The last record of an input counts.
+
+    A hologram is up to date when its last record is 'done' with the same
+    parameters, all its outputs exist and the input is unchanged: same size
+    and mtime or, if these differ, the same content hash. An input that
+    cannot be read is recorded as 'failed', without size, mtime and hash.
+
+    Parameters
+    ----------
+    folder: Path
+        Output folder
+    name: str
+        File name of the manifest. Default: 'manifest.jsonl'
+    """
+    def __init__(self, folder, name = 'manifest.jsonl'):
+        self.fn = Path(folder).joinpath(name)
+        self.records = {}
+        if self.fn.exists():
+            with open(self.fn) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # line cut short by an interrupted run
+                        continue
+                    self.records[record['input']] = record
+
+    @staticmethod
+    def _key(image_fn):
+        return str(Path(image_fn).resolve())
+
+    def is_done(self, image_fn, params):
+        """True if image_fn was processed with params and is unchanged since"""
+        record = self.records.get(self._key(image_fn))
+        if record is None or record['status'] != 'done':
+            return False
+        if record['params'] != json.loads(json.dumps(params)):
+            return False
+        if not all(Path(output).exists() for output in record['outputs']):
+            return False
+        try:
+            stat = os.stat(image_fn)
+            if stat.st_size == record['size'] and stat.st_mtime == record['mtime']:
+                return True
+            return stat.st_size == record['size'] and file_sha1(image_fn) == record['sha1']
+        except OSError:
+            return False
+
+    def fingerprint(self, image_fn):
+        """
+        (size, mtime, sha1) of image_fn, None if it cannot be read. The hash of
+        the last record is reused if size and mtime are unchanged.
+        """
+        try:
+            stat = os.stat(image_fn)
+            record = self.records.get(self._key(image_fn))
+            if (record is not None and record.get('sha1') is not None and record['size'] == stat.st_size
+                    and record['mtime'] == stat.st_mtime):
+                return stat.st_size, stat.st_mtime, record['sha1']
+            return stat.st_size, stat.st_mtime, file_sha1(image_fn)
+        except OSError:
+            return None
+
+    def record(self, image_fn, params, outputs = None, error = None, fingerprint = None):
+        """Append the result of processing image_fn; fingerprint: see BatchManifest.fingerprint, made if None"""
+        if fingerprint is None:
+            fingerprint = self.fingerprint(image_fn)
+        if fingerprint is None:
+            # e.g. a hologram of the cast index that was deleted
+            error = error or "Input not readable: " + str(image_fn)
+            fingerprint = (None, None, None)
+        size, mtime, sha1 = fingerprint
+        record = {'input': self._key(image_fn), 'size': size, 'mtime': mtime,
+                  'sha1': sha1, 'params': params,
+                  'outputs': [str(output) for output in outputs or []],
+                  'status': 'done' if error is None else 'failed', 'error': error,
+                  'time': datetime.datetime.now().isoformat(timespec = 'seconds')}
+        with open(self.fn, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+        self.records[record['input']] = json.loads(json.dumps(record))
+
+
+def _record_results(manifests, params, image_fn, result, error):
+    """on_result of run_resumable_batch: record the outputs of each kind in its manifest"""
+    # the input is hashed once for all manifests
+    fingerprint = next(iter(manifests.values())).fingerprint(image_fn)
+    for kind, manifest in manifests.items():
+        manifest.record(image_fn, params[kind], None if result is None else result[kind], error,
+                        fingerprint = fingerprint)
+
+
+def run_resumable_batch(make_func, image_fns, manifests, params, resume = True, workers = 1, chunksize = None,
+                        prefetch = 2):
+    """
+    run_batch that skips holograms whose outputs are up to date.
+
+    Each kind of output (e.g. 'z_min', 'stack', 'gif') has its own folder and
+    BatchManifest, so a hologram is only redone for the kinds whose outputs
+    are missing, failed, made with other parameters or from a changed file.
+
+    Parameters
+    ----------
+    make_func: function
+        make_func(kinds) returns the function of a single file name that
+        writes the outputs `kinds` and returns {kind: files written}
+    image_fns: list
+        The file locations of the raw holograms
+    manifests: dict
+        BatchManifest of each kind of output
+    params: dict
+        Parameters of the outputs of each kind, compared with its manifest
+        (JSON serialisable). Only the parameters that change an output go in
+        its kind, so that batches writing the same kind (e.g. the z-min of
+        zmin_batch and reconstruct_batch) reuse each other's outputs.
+    resume: bool
+        False redoes all holograms. Default: True
+    workers, chunksize, prefetch:
+        see run_batch
+
+    Returns
+    --------
+    list
+        (image_fn, result, error) for each processed file, see run_batch
+    """
+    image_fns = sorted(image_fns)
+    todo = OrderedDict()
+    for image_fn in image_fns:
+        kinds = tuple(kind for kind, manifest in manifests.items()
+                      if not (resume and manifest.is_done(image_fn, params[kind])))
+        if kinds:
+            todo.setdefault(kinds, []).append(image_fn)
+
+    n_todo = sum(len(fns) for fns in todo.values())
+    if n_todo < len(image_fns):
+        print("Up to date, skipped:", len(image_fns) - n_todo, "of", len(image_fns), "images")
+
+    results = []
+    for kinds, fns in todo.items():
+        on_result = partial(_record_results, {kind: manifests[kind] for kind in kinds},
+                            {kind: params[kind] for kind in kinds})
+        results += run_batch(make_func(kinds), fns, workers = workers, chunksize = chunksize,
+                             on_result = on_result, prefetch = prefetch)
+    return results
+
+
+def export_metadata_batch(raw_folder_path, cruise, event, ext = '*.pgm', csv = False):
     """
     Extract metadata from all LISST-Holo hologram in folder.
+
+    The metadata are kept in an incremental MetadataStore: holograms already
+    in the store are not read again, so re-running after new data arrived
+    only reads the new files.
     
     Parameters
     ----------
@@ -342,13 +3747,17 @@ def export_metadata_batch(raw_folder_path, cruise, event, ext = '*.pgm'):
         Name of event, deployment or profile. E.g. "034"
     ext : str
         Extension of the file to be found. Default: '*.pgm'
+    csv : boolean
+        Also save the whole store as overview table (.csv). Default: False
     
     Returns
     --------
+    Metadata store
+        Saves selected metadata for all holograms in folder as Parquet store
+        ("_metadata_<cruise>_event<event>" folder, see MetadataStore)
     Overview table
-        Saves selected metadata for all holograms in folder as table
-    Metadata files
-        Saves all metadata for a hologram as separate file
+        Optional. Saves selected metadata for all holograms in folder as table
+    store : MetadataStore
     
     Note
     -------
@@ -360,33 +3769,31 @@ def export_metadata_batch(raw_folder_path, cruise, event, ext = '*.pgm'):
     if not output_path.exists(): output_path.mkdir()
     print("Metadata will be saved to: " + str(output_path))
     
-    # --- prepare overview table ---
-    overview = []
-    overview_fn = output_path.joinpath("_metadata_overview_" + cruise + "_event" + event + ".csv")
-
-    # note files
-    file_list = []
+    # --- open metadata store ---
+    store = MetadataStore(output_path.joinpath("_metadata_" + cruise + "_event" + event))
 
     # ---- find images ----
-    # Find .pgm files in input path            
-    for image_fn in Path(raw_folder_path).glob(ext):
-        file_list.append(image_fn.stem)
+    # Find .pgm files in input path
+    file_list = list(Path(raw_folder_path).glob(ext))
 
-        # extract metadata
-        meta = HoloMetadata(image_fn, cruise = cruise, event = event)
+    # extract metadata of the images not in the store yet, all at once
+    meta = store.update(file_list, cruise = cruise, event = event)
+    for f in meta.failed:
+        print("Failed to read metadata of: " + str(f))
 
-        # append to previous metadata
-        overview.append(meta.metadata)
+    print("Number of images analyzed:", len(meta), "new of", len(file_list))
+    print("Metadata store:", store.path)
 
-    df = pd.DataFrame(overview, columns = meta.var_name)
+    if csv:
+        overview_fn = output_path.joinpath("_metadata_overview_" + cruise + "_event" + event + ".csv")
+        store.read().drop(columns = "File").to_csv(overview_fn, index = False)
+        print("Overview saved as:", overview_fn)
 
-    # save metadata to new file    
-    df.to_csv(overview_fn, index = False)
+    return store
 
-    print("Number of images analyzed:", len(file_list))
-    print("Overview saved as:", overview_fn)
-
-def zmin_batch(raw_folder_path, n = 51, ext = '*.pgm'):
+def zmin_batch(raw_folder_path, n = 51, ext = '*.pgm', workers = 1, chunksize = None, precision = 'double',
+               resume = True, index = None, phases = None, background = None, png_compression = 6,
+               encoder_threads = 2, prefetch = 2, write_queue = None, max_memory = None):
   """Generate z-min image for hologram
 
   The z-min image shows the darkest value for a given pixel within the frame.
@@ -403,11 +3810,50 @@ def zmin_batch(raw_folder_path, n = 51, ext = '*.pgm'):
       number of focus planes. Default: 51
   ext : str
       extension of the file to be found. Default: '*.pgm'
+  workers : integer
+      number of processes to spread the holograms over. Default: 1
+  chunksize : integer
+      number of holograms handed to a process at a time. Default: automatic
+  precision : str
+      'double' or 'single'. Single precision halves memory traffic and is
+      about twice as fast; see scripts/benchmark_precision.py for the effect
+      on the outputs. Default: 'double'
+  resume : boolean
+      Skip holograms whose z-min is up to date according to the manifest of
+      the z_min folder (see BatchManifest). False redoes all. Default: True
+  index : str
+      Optional. Cast index (see downcast_index) listing the holograms to
+      process instead of all files in raw_folder_path
+  phases : list
+      Optional. Phases of the index to process, e.g. ['Downcasting']. Default: all but 'Erroneous'
+  background : dict
+      Optional. Remove a rolling background of the preceding holograms before
+      propagation, keyword arguments of RollingBackground, e.g.
+      {'frames': 20, 'statistic': 'median', 'mode': 'subtract'}. Each process
+      then gets one run of consecutive holograms by default (see chunksize).
+  png_compression : integer
+      PNG compression level, 0 (fastest) - 9 (smallest files). Default: 6
+  encoder_threads : integer
+      Number of threads writing the images while the next hologram is
+      reconstructed (see ImageEncoder); 0 writes them in turn. Default: 2
+  prefetch : integer
+      Number of holograms read ahead by each process, see run_batch. Default: 2
+  write_queue : integer
+      Optional. Number of images waiting to be written before the
+      reconstruction waits for the writers. Default: 16 per encoder thread
+  max_memory : integer or str
+      Optional. Memory budget of the batch in bytes or e.g. '8G'. The number
+      of processes (at most workers; None for all CPUs), the precision and
+      the write queue are then chosen to fit, see plan_reconstruction
     
   Returns
   -------
   image (.png)
       saves z-min for all images in separate folder
+  manifest.jsonl
+      processing record of each hologram, in the z_min folder
+  results : list
+      (image_fn, {'z_min': files written}, error) for each processed hologram, see run_batch
   
   """
     
@@ -437,44 +3883,78 @@ def zmin_batch(raw_folder_path, n = 51, ext = '*.pgm'):
   print("z-min images will be saved to: " + str(output_zmin_path))
 
   # --- find images ---
-  # Find .pgm files in input path
+  # Find .pgm files in input path, skip those already done and spread the
+  # others over `workers` processes
+  image_fns = find_holograms(raw_folder_path, ext, index, phases)
+  if max_memory is not None:
+      plan = plan_reconstruction(max_memory, n, workers = workers, precision = precision,
+                                 encoder_threads = encoder_threads, write_queue = write_queue,
+                                 prefetch = prefetch, background = background)
+      print(plan)
+      workers, precision, write_queue = plan.workers, plan.precision, plan.write_queue
 
-  for image_fn in Path(raw_folder_path).glob(ext):
-      # make z_min file name
-      z_min_fn = Path(output_zmin_path).joinpath(PurePath(image_fn).stem + "_z_min.png")
+  def make_func(kinds):
+      return partial(_zmin_one, output_zmin_path = output_zmin_path, n = n, precision = precision,
+                     background = background, encoder = (encoder_threads, png_compression, write_queue))
 
-      # check whether image already exists
-      if z_min_fn.exists():
-        print("Z_min of file already exists and is skipped: " + str(PurePath(image_fn).name))
-        continue
+  params = {'z_min': {'n': n, 'precision': precision, 'background': background}}
+  return run_resumable_batch(make_func, image_fns, {'z_min': BatchManifest(output_zmin_path)}, params,
+                             resume = resume, workers = workers, chunksize = _background_chunksize(background, image_fns, workers,
+                                                                                  chunksize),
+                             prefetch = prefetch)
 
-      # ---- Load hologram ----
-      raw_holo = hp.load_image(image_fn, spacing=4.4, medium_index = 1.333, illum_wavelen = 0.658)
-      
-      # All values based on LISST-Holo manual
-      # spacing: pixel size in um
-      # medium index: refractory index of water
-      # illumination wavelength: 658 nm
-      
-      # ---- Calculate focus stack ----
-      # Next, we use numpy’s linspace to define a set of distances between the 
-      #image plane and the reconstruction plane. We space the 51 planes evenly 
-      #throughout the sampling window. Note, in the LISST-Holo manual, the range 
-      #is 0 - 50 mm + 28 mm offset between window and CCD array.
-       
-      zstack = np.linspace(0, 100000, n)
-      focal_planes = hp.propagate(raw_holo, zstack, cfsp = 3)
-      
-      # ---- Calculate z_min ----
-      z_min = np.abs(focal_planes).min(axis=0) 
-      
+def _zmin_one(image_fn, output_zmin_path, n = 51, precision = 'double', background = None, encoder = None):
+  """z-min of a single hologram, see zmin_batch"""
+  from skimage import io
+
+  # make z_min file name
+  z_min_fn = Path(output_zmin_path).joinpath(PurePath(image_fn).stem + "_z_min.png")
+
+  # ---- Load hologram ----
+  with TELEMETRY.stage("load"):
+      raw_holo = load_hologram(image_fn)
+      pixels = raw_holo.pixels if background is None else get_background(**background)(raw_holo.pixels)
+  
+  # All values based on LISST-Holo manual
+  # spacing: pixel size in um (SPACING)
+  # medium index: refractory index of water (MEDIUM_INDEX)
+  # illumination wavelength: 658 nm (ILLUM_WAVELEN)
+  
+  # ---- Calculate focus stack ----
+  # Next, we use numpy’s linspace to define a set of distances between the 
+  #image plane and the reconstruction plane. We space the 51 planes evenly 
+  #throughout the sampling window. Note, in the LISST-Holo manual, the range 
+  #is 0 - 50 mm + 28 mm offset between window and CCD array.
+  # The planes are reconstructed one at a time and reduced on the fly.
+   
+  # All arrays are buffers of a workspace that is reused for every hologram
+  # handled by this process.
+   
+  zstack = np.linspace(0, 100000, n)
+  ws = get_workspace(pixels.shape, precision = precision)
+  focal_planes = iter_planes(pixels, zstack, cfsp = 3, workspace = ws)
+  
+  # ---- Calculate z_min ----
+  with TELEMETRY.stage("reconstruct"):
+      z_min, = run_reducers(amplitudes(focal_planes, out = ws.amplitude), [ZMin(out = ws.z_min)])
+  
+  with TELEMETRY.stage("encode"):
       # rescale and save as uint8
-      z_min = img_as_ubyte(rescale_intensity(z_min))
+      z_min = rescale_to_ubyte(z_min, out = ws.image, work = ws.buffer('rescale', z_min.dtype))
 
-      # save
-      io.imsave(z_min_fn, z_min)
+      # save, in the background with an encoder (threads, compression level)
+      if encoder is None:
+          io.imsave(z_min_fn, z_min)
+      else:
+          get_encoder(*encoder).save_png(z_min_fn, z_min)
 
-def reconstruct_batch(raw_folder_path, n = 51, ext = '*.pgm', make_stack = True, make_gif = True, make_z_min = True):
+  return {'z_min': [z_min_fn]}
+
+def reconstruct_batch(raw_folder_path, n = 51, ext = '*.pgm', make_stack = True, make_gif = True, make_z_min = True,
+                      workers = 1, chunksize = None, precision = 'double', resume = True, index = None,
+                      phases = None, background = None, stack_format = 'png', png_compression = 6,
+                      gif_downsample = 1, encoder_threads = 2, prefetch = 2, write_queue = None,
+                      max_memory = None):
   """Reconstruct raw LISST-Holo hologram
   
   Steps
@@ -501,18 +3981,64 @@ def reconstruct_batch(raw_folder_path, n = 51, ext = '*.pgm', make_stack = True,
       Save reconstructed focal planes as gif. Default = True.
   make_z_min : boolean
       Save z_min. Default = True.
+  workers : integer
+      Number of processes to spread the holograms over. Default: 1
+  chunksize : integer
+      Number of holograms handed to a process at a time. Default: automatic
+  precision : str
+      'double' or 'single'. Single precision halves memory traffic and is
+      about twice as fast; see scripts/benchmark_precision.py for the effect
+      on the outputs. Default: 'double'
+  resume : boolean
+      Only make the outputs that are not up to date according to the
+      manifest of their folder (see BatchManifest), e.g. after an interrupted
+      run or a change of n. False redoes all. Default: True
+  index : str
+      Optional. Cast index (see downcast_index) listing the holograms to
+      process instead of all files in raw_folder_path
+  phases : list
+      Optional. Phases of the index to process, e.g. ['Downcasting']. Default: all but 'Erroneous'
+  background : dict
+      Optional. Remove a rolling background before propagation, see zmin_batch
+  stack_format : str
+      'png' saves each focal plane as .png, 'hdf5' the whole stack as one
+      chunked, compressed file (see Hdf5StackWriter, read with HoloStackFile). Default: 'png'
+  png_compression : integer
+      PNG compression level, 0 (fastest) - 9 (smallest files). Default: 6
+  gif_downsample : integer
+      Average the gif frames over gif_downsample x gif_downsample pixels, for
+      smaller previews that are faster to write. Default: 1
+  encoder_threads : integer
+      Number of threads writing the images while the next hologram is
+      reconstructed (see ImageEncoder); 0 writes them in turn. Default: 2
+  prefetch : integer
+      Number of holograms read ahead by each process, see run_batch. Default: 2
+  write_queue : integer
+      Optional. Number of images waiting to be written before the
+      reconstruction waits for the writers. Default: 16 per encoder thread
+  max_memory : integer or str
+      Optional. Memory budget of the batch in bytes or e.g. '8G'. The number
+      of processes (at most workers; None for all CPUs), the precision, the
+      write queue and the planes of the stack kept in memory are then chosen
+      to fit, see plan_reconstruction
     
   Returns
   -------
 
-  stacks : img (.png)
-      Reconstructed focal planes for each hologram are saved in a separate subfolder in the folder 'stacks' in the parent directory.
+  stacks : img (.png) or stack file (.h5)
+      Reconstructed focal planes for each hologram are saved in a separate subfolder in the folder 'stacks' in the parent directory, or as <image>.h5 in this folder.
 
   gif :
       A compilation of all focal planes is saved as gif for easy viewing. One gif file per hologram, saved in the folder 'gifs' in the parent directory.
       
   z-min : img (.png)
       The z-min image shows the darkest value for a given pixel within the frame. Function reads in all holograms in folder, reconstructs the images with the given spacing, and calculates the minimum value for each pixel. Results are saved in the folder 'z_min' in the parent directory.
+
+  manifest.jsonl
+      processing record of each hologram, in each output folder
+
+  results : list
+      (image_fn, {output: files written}, error) for each processed hologram, see run_batch
   
   Note
   -------
@@ -521,9 +4047,13 @@ def reconstruct_batch(raw_folder_path, n = 51, ext = '*.pgm', make_stack = True,
   For the stack, only the images from 19 - 51 are in the sampling volume (i.e. image the water).
   """
 
+  if stack_format not in ('png', 'hdf5'):
+      raise ValueError("stack_format must be 'png' or 'hdf5', not %r" % (stack_format,))
+
   print("Images read from: " + str(raw_folder_path))
   
   # --- make directory if not exist ---
+  output_stack_path = output_gif_path = output_zmin_path = None
   if make_stack:
       output_stack_path = Path(raw_folder_path).parent.joinpath("stacks")
       if not output_stack_path.exists(): output_stack_path.mkdir()
@@ -540,77 +4070,434 @@ def reconstruct_batch(raw_folder_path, n = 51, ext = '*.pgm', make_stack = True,
       print("z-min images will be saved to: " + str(output_zmin_path))
 
   # --- find images ---
-  # Find .pgm files in input path
+  # Find .pgm files in input path, skip the outputs already done and spread
+  # the others over `workers` processes
+  output_paths = OrderedDict([('stack', output_stack_path), ('gif', output_gif_path), ('z_min', output_zmin_path)])
+  manifests = OrderedDict((kind, BatchManifest(path)) for kind, path in output_paths.items() if path is not None)
+  image_fns = find_holograms(raw_folder_path, ext, index, phases)
+  plane_chunk = None
+  if max_memory is not None:
+      plan = plan_reconstruction(max_memory, n, workers = workers, precision = precision,
+                                 make_stack = make_stack, make_gif = make_gif, gif_downsample = gif_downsample,
+                                 encoder_threads = encoder_threads, write_queue = write_queue,
+                                 prefetch = prefetch, background = background)
+      print(plan)
+      workers, precision, write_queue, plane_chunk = plan.workers, plan.precision, plan.write_queue, plan.plane_chunk
 
-  for image_fn in Path(raw_folder_path).glob(ext):
-      
-      # ---- Load hologram ----
-      raw_holo = hp.load_image(image_fn, spacing=4.4, medium_index = 1.333, illum_wavelen = 0.658)
-      
-      # All values based on LISST-Holo manual
-      # spacing: pixel size in um
-      # medium index: refractory index of water
-      # illumination wavelength: 658 nm
-      
-      # ---- Calculate focus stack ----
-      # Next, we use numpy’s linspace to define a set of distances between the 
-      #image plane and the reconstruction plane. We space the n planes evenly 
-      #throughout the sampling window. Note, in the LISST-Holo manual, the range 
-      #is 0 - 50 mm + 28 mm offset between window and CCD array.
-       
-      zstack = np.linspace(0, 100000, n)
-      focal_planes = hp.propagate(raw_holo, zstack, cfsp = 3)
-      
-      # correct intensities
-      focal_planes_abs = np.abs(focal_planes)
-          
-      # convert to uint8
-      focal_planes_uint = img_as_ubyte(rescale_intensity(focal_planes_abs))
+  def make_func(kinds):
+      return partial(_reconstruct_one, n = n, precision = precision, background = background,
+                     stack_format = stack_format, gif_downsample = gif_downsample, plane_chunk = plane_chunk,
+                     encoder = (encoder_threads, png_compression, write_queue),
+                     output_stack_path = output_stack_path if 'stack' in kinds else None,
+                     output_gif_path = output_gif_path if 'gif' in kinds else None,
+                     output_zmin_path = output_zmin_path if 'z_min' in kinds else None)
+
+  # same z-min parameters as zmin_batch, so that either reuses the z-mins of the other
+  params = {'n': n, 'precision': precision, 'background': background}
+  params = {'stack': dict(params, stack_format = stack_format), 'gif': dict(params, gif_downsample = gif_downsample),
+            'z_min': params}
+  return run_resumable_batch(make_func, image_fns, manifests, params, resume = resume,
+                             workers = workers, chunksize = _background_chunksize(background, image_fns, workers,
+                                                                                  chunksize),
+                             prefetch = prefetch)
+
+def _reconstruct_one(image_fn, n = 51, output_stack_path = None, output_gif_path = None, output_zmin_path = None,
+                     precision = 'double', background = None, stack_format = 'png', gif_downsample = 1,
+                     encoder = None, plane_chunk = None):
+  """Reconstruct a single hologram, see reconstruct_batch. Outputs are only written where a folder is given.
+  Returns {output: files written} with output 'stack', 'gif' or 'z_min'."""
+  from skimage import io
+
+  make_stack = output_stack_path is not None
+  make_gif = output_gif_path is not None
+  make_z_min = output_zmin_path is not None
+  outputs = {}
+  # images are written in the background with an encoder (threads, compression level)
+  encoder = None if encoder is None else get_encoder(*encoder)
+
+  # ---- Load hologram ----
+  with TELEMETRY.stage("load"):
+      raw_holo = load_hologram(image_fn)
+      pixels = raw_holo.pixels if background is None else get_background(**background)(raw_holo.pixels)
+  
+  # All values based on LISST-Holo manual
+  # spacing: pixel size in um (SPACING)
+  # medium index: refractory index of water (MEDIUM_INDEX)
+  # illumination wavelength: 658 nm (ILLUM_WAVELEN)
+  
+  # ---- Calculate focus stack ----
+  # Next, we use numpy’s linspace to define a set of distances between the 
+  #image plane and the reconstruction plane. We space the n planes evenly 
+  #throughout the sampling window. Note, in the LISST-Holo manual, the range 
+  #is 0 - 50 mm + 28 mm offset between window and CCD array.
+  # The planes are reconstructed one at a time and reduced on the fly;
+  # for the stack and gif they are kept on disk until the range of the
+  # whole stack is known. All arrays are buffers of a workspace that is
+  # reused for every hologram handled by this process.
+   
+  zstack = np.linspace(0, 100000, n)
+  ws = get_workspace(pixels.shape, precision = precision, n_planes = n)
+  focal_planes = iter_planes(pixels, zstack, cfsp = 3, workspace = ws)
+  
+  # correct intensities
+  z_min = ZMin(out = ws.z_min) if make_z_min else None
+  stack = ws.spilled_stack(chunk = plane_chunk) if make_stack or make_gif else None
+  with TELEMETRY.stage("reconstruct"):
+      run_reducers(amplitudes(focal_planes, out = ws.amplitude), [r for r in (z_min, stack) if r is not None])
+  
+  # ---- Save focal planes and make gif stack ----
+  writers = OrderedDict()
+  if make_stack and stack_format == 'hdf5':
+      # save focal planes as uint8 in one file
+      stack_fn = output_stack_path.joinpath(PurePath(image_fn).stem + ".h5")
+      writers['stack'] = Hdf5StackWriter(stack_fn, PurePath(image_fn).stem, zstack, in_range = stack.in_range,
+                                         attrs = {'spacing': SPACING, 'medium_index': MEDIUM_INDEX,
+                                                  'illum_wavelen': ILLUM_WAVELEN}, shared = False)
+  elif make_stack:
+      # make subfolder
+      output_stack_subfolder_path = output_stack_path.joinpath(PurePath(image_fn).stem)
+      if not output_stack_subfolder_path.exists(): output_stack_subfolder_path.mkdir()
       
-      # ---- Save focal planes ----
-      if make_stack:
-          # make subfolder
-          output_stack_subfolder_path = output_stack_path.joinpath(PurePath(image_fn).stem)
-          if not output_stack_subfolder_path.exists(): output_stack_subfolder_path.mkdir()
-          
-          # save focal planes
-          for i in np.arange(0, n):
-              
-              # define file name
-              plane_fn = output_stack_subfolder_path.joinpath(PurePath(image_fn).stem + 
-                                                              "_plane" + str(i).zfill(2) + ".png")
-              
-              # save
-              io.imsave(plane_fn, focal_planes_uint[i,:,:])
-            
-      # --- Make gif stack ---
-      if make_gif:
-          # define gif file name
-          gif_fn = output_gif_path.joinpath(PurePath(image_fn).stem + ".gif")
+      # save focal planes as uint8
+      writers['stack'] = PngStackWriter(output_stack_subfolder_path, PurePath(image_fn).stem, encoder = encoder)
         
-          # save
-          gif_frames = [Image.fromarray(f) for f in focal_planes_uint]
-          gif_frames[0].save(fp=gif_fn, format='GIF', append_images=gif_frames[1:],
-                             save_all=True, duration=200, loop=0)
-          
-      # ---- Calculate z_min ----
-      if make_z_min:
-          z_min = focal_planes_abs.min(axis=0) 
-          
-          # rescae and convert to uint8
-          z_min = img_as_ubyte(rescale_intensity(z_min))
-       
-          # define z_min file name
-          z_min_fn = Path(output_zmin_path).joinpath(PurePath(image_fn).stem + "_z_min.png")
+  if make_gif:
+      # define gif file name
+      gif_fn = output_gif_path.joinpath(PurePath(image_fn).stem + ".gif")
+      writers['gif'] = GifWriter(gif_fn, duration=200, downsample=gif_downsample, encoder=encoder)
+  
+  if writers:
+      with TELEMETRY.stage("encode"):
+          files = run_reducers(stack.rescaled_planes(), list(writers.values()))
+      outputs.update(zip(writers, files))
+      stack.close()
+      
+  # ---- Calculate z_min ----
+  if make_z_min:
+      # rescae and convert to uint8
+      z_min = z_min.finish()
+      z_min = rescale_to_ubyte(z_min, out = ws.image, work = ws.buffer('rescale', z_min.dtype))
+   
+      # define z_min file name
+      z_min_fn = Path(output_zmin_path).joinpath(PurePath(image_fn).stem + "_z_min.png")
+
+      # save
+      with TELEMETRY.stage("encode"):
+          if encoder is None:
+              io.imsave(z_min_fn, z_min)
+          else:
+              encoder.save_png(z_min_fn, z_min)
+      outputs['z_min'] = [z_min_fn]
+
+  return outputs
+
+
+def greyness_profile(raw_folder_path, ext = '*.pgm', bin_size = 5.0, per_bin = 3, n = 20,
+                     medium_index = MEDIUM_INDEX, workers = 1, chunksize = None, precision = 'double',
+                     index = None, phases = None, prefetch = 2):
+    """
+    Depth-binned greyness profile of a cast.
+
+    Depths are read from the metadata trailers only (see HoloMetadataBatch).
+    The holograms below the surface are binned by depth and up to per_bin
+    holograms, spread evenly in time, are taken from each bin. For these the
+    z-min over n planes is reconstructed plane by plane (see ZMin) and its
+    statistics are computed, spread over `workers` processes.
+
+    Parameters
+    ----------
+    raw_folder_path: str
+        The file location of the raw holograms
+    ext : str
+        Extension of the file to be found. Default: '*.pgm'
+    bin_size: float
+        Depth bin size in m. Default: 5.0
+    per_bin: integer
+        Number of holograms per depth bin. Default: 3
+    n: integer
+        Number of focus planes. Default: 20
+    medium_index: float
+        Refractive index of the medium. Default: MEDIUM_INDEX
+    workers, chunksize, prefetch:
+        see run_batch
+    precision: str
+        'double' or 'single'. Default: 'double'
+    index, phases:
+        Optional. Cast index and phases to take the holograms from, see zmin_batch
+
+    Returns
+    --------
+    profile: pandas.DataFrame
+        per depth bin: Bin (top of the bin in m), Depth (mean depth of the
+        holograms used), Greyscale and Greyscale std (mean and standard
+        deviation of the z-min means), Frames used and Frames in bin
+    frames: pandas.DataFrame
+        per hologram used: Image, Depth, Bin, Greyscale (mean of the z-min),
+        z-min std, z-min min, z-min max and Hologram mean
+    """
+    meta = HoloMetadataBatch(find_holograms(raw_folder_path, ext, index, phases))
+    for f in meta.failed:
+        print("Failed to read metadata of: " + str(f))
+
+    # bin the holograms below the surface by depth
+    frames = pd.DataFrame({"File": meta.paths, "Image": meta.images, "Depth": meta.depth})
+    frames = frames[frames["Depth"] > 0].copy()
+    frames["Bin"] = np.floor(frames["Depth"] / bin_size) * bin_size
+    in_bin = frames.groupby("Bin")["Image"].count().rename("Frames in bin")
+
+    # take per_bin holograms spread evenly over each bin
+    rank = frames.groupby("Bin").cumcount().to_numpy()
+    count = frames.groupby("Bin")["Image"].transform('count').to_numpy()
+    step = np.maximum(count / per_bin, 1)
+    frames = frames[(rank % step < 1) & (rank < per_bin * step)].reset_index(drop = True)
+    print("Greyness of", len(frames), "holograms in", len(in_bin), "depth bins of", bin_size, "m")
+
+    results = run_batch(partial(_greyness_one, n = n, medium_index = medium_index, precision = precision),
+                        frames["File"], workers = workers, chunksize = chunksize, prefetch = prefetch)
+    stats = {image_fn: result for image_fn, result, _ in results if result is not None}
+    stats = pd.DataFrame([stats.get(f, {}) for f in frames["File"]], index = frames.index)
+    frames = pd.concat([frames.drop(columns = "File"), stats], axis = 1)
+
+    profile = frames.groupby("Bin").agg(**{"Depth": ("Depth", "mean"),
+                                           "Greyscale": ("Greyscale", "mean"),
+                                           "Greyscale std": ("Greyscale", "std"),
+                                           "Frames used": ("Greyscale", "count")})
+    profile = profile.join(in_bin).reset_index()
+
+    return profile, frames
+
+
+def _greyness_one(image_fn, n = 20, medium_index = MEDIUM_INDEX, precision = 'double'):
+    """z-min statistics of a single hologram, see greyness_profile"""
+    with TELEMETRY.stage("load"):
+        raw_holo = load_hologram(image_fn)
+    ws = get_workspace(raw_holo.pixels.shape, precision = precision)
+
+    zstack = np.linspace(0, 100000, n)
+    focal_planes = iter_planes(raw_holo.pixels, zstack, medium_index = medium_index, cfsp = 3, workspace = ws)
+    with TELEMETRY.stage("reconstruct"):
+        z_min, = run_reducers(amplitudes(focal_planes, out = ws.amplitude), [ZMin(out = ws.z_min)])
+
+    return {"Greyscale": float(z_min.mean()), "z-min std": float(z_min.std()),
+            "z-min min": float(z_min.min()), "z-min max": float(z_min.max()),
+            "Hologram mean": float(raw_holo.pixels.mean())}
+
+
+def particles_batch(raw_folder_path, n = 51, ext = '*.pgm', pad = 64, sigma = 5.0, min_area = 20,
+                    max_particles = None, workers = 1, chunksize = None, precision = 'double', resume = True,
+                    index = None, phases = None):
+    """
+    Reconstruct the particles of each hologram in focus, one window per particle.
+
+    Particles are detected on the z-min image saved by zmin_batch with
+    detect_particles; z-min images that are missing or out of date in the
+    manifest of zmin_batch (same n and precision, no background) are made
+    first, and recorded there. Only a window around each particle
+    is reconstructed (see reconstruct_particles) at the planes of the
+    sampling volume, instead of the whole hologram.
+
+    Parameters
+    ----------
+    raw_folder_path: str
+        The file location of the raw holograms
+    n: integer
+        Number of focus planes of the z-min, see zmin_batch. The particles are
+        reconstructed at the same planes within the sampling volume. Default: 51
+    ext : str
+        Extension of the file to be found. Default: '*.pgm'
+    pad: integer
+        Pixels of hologram around each particle, see reconstruct_particles. Default: 64
+    sigma, min_area, max_particles:
+        see detect_particles
+    workers, chunksize, precision, resume, index, phases:
+        see zmin_batch
+
+    Returns
+    --------
+    Crops (.png)
+        in-focus image of each particle, <image>_particleNNN.png in the folder 'particles'
+    Table (.csv)
+        position, size and focus distance of the particles of each hologram, <image>_particles.csv
+    results : list
+        (image_fn, {kind: files written}, error) for each processed hologram, see run_batch;
+        kinds 'z_min' and 'particles'
+    """
+    output_zmin_path = Path(raw_folder_path).parent.joinpath("z_min")
+    output_particles_path = Path(raw_folder_path).parent.joinpath("particles")
+    for path in (output_zmin_path, output_particles_path):
+        if not path.exists(): path.mkdir()
+    print("Images read from: " + str(raw_folder_path))
+    print("Particles will be saved to: " + str(output_particles_path))
+
+    params = {'n': n, 'pad': pad, 'sigma': sigma, 'min_area': min_area,
+              'max_particles': max_particles, 'precision': precision}
+
+    def make_func(kinds):
+        return partial(_particles_one, output_zmin_path = output_zmin_path, make_z_min = 'z_min' in kinds,
+                       output_particles_path = output_particles_path if 'particles' in kinds else None, **params)
+
+    # the z-min images are shared with zmin_batch, through its manifest
+    manifests = OrderedDict([('z_min', BatchManifest(output_zmin_path)),
+                             ('particles', BatchManifest(output_particles_path))])
+    return run_resumable_batch(make_func, find_holograms(raw_folder_path, ext, index, phases), manifests,
+                               {'z_min': {'n': n, 'precision': precision, 'background': None},
+                                'particles': params},
+                               resume = resume, workers = workers, chunksize = chunksize)
+
+
+def _particles_one(image_fn, output_zmin_path, output_particles_path = None, n = 51, pad = 64, sigma = 5.0,
+                   min_area = 20, max_particles = None, precision = 'double', make_z_min = False):
+    """
+    In-focus particles of a single hologram, see particles_batch. The z-min
+    is made first if make_z_min, the particles only with an output_particles_path.
+    """
+    from skimage import io
+
+    result = {}
+    if make_z_min:
+        result.update(_zmin_one(image_fn, output_zmin_path, n = n, precision = precision))
+    if output_particles_path is None:
+        return result
+
+    stem = PurePath(image_fn).stem
+    z_min_fn = Path(output_zmin_path).joinpath(stem + "_z_min.png")
+
+    with TELEMETRY.stage("detect"):
+        particles = detect_particles(io.imread(z_min_fn), sigma = sigma, min_area = min_area,
+                                     max_particles = max_particles)
+
+    # the planes of the z-min stack within the sampling volume
+    zstack = np.linspace(0, 100000, n)
+    zstack = zstack[(zstack >= SAMPLING_VOLUME[0]) & (zstack <= SAMPLING_VOLUME[1])]
+    with TELEMETRY.stage("load"):
+        raw_holo = load_hologram(image_fn)
+    with TELEMETRY.stage("reconstruct"):
+        particles, crops = reconstruct_particles(raw_holo.pixels, particles, zstack, pad = pad, cfsp = 3,
+                                                 precision = precision)
+
+    outputs = []
+    particles["file"] = ""
+    with TELEMETRY.stage("encode"):
+        for i, crop in enumerate(crops):
+            crop_fn = Path(output_particles_path).joinpath(stem + "_particle" + str(i).zfill(3) + ".png")
+            io.imsave(crop_fn, rescale_to_ubyte(crop), check_contrast = False)
+            particles.loc[i, "file"] = crop_fn.name
+            outputs.append(crop_fn)
+
+    table_fn = Path(output_particles_path).joinpath(stem + "_particles.csv")
+    particles.to_csv(table_fn, index = False)
+    outputs.append(table_fn)
+
+    result['particles'] = outputs
+    return result
+
+
+CAST_INDEX_FN = "cast_index.csv"
+
+
+def downcast_index(raw_folder_path, ext = '*.pgm', index_fn = None, start_depth = 5.0):
+    """
+    Select the downcast of a profile of LISST-Holo holograms without moving any file.
+
+    Only the metadata trailers are read (see HoloMetadataBatch). The selection
+    is that of separate_downcast: the downcast runs from the last hologram at
+    start_depth (rounded to the metre) before the deepest hologram, down to the
+    deepest one. The result is saved as a small index that the batch functions
+    take instead of a folder (see read_cast_index).
     
-          # save
-          io.imsave(z_min_fn, z_min)
+    Parameters
+    ----------
+    raw_folder_path: str
+        The file location of the raw holograms
+    ext : str
+        Extension of the file to be found. Default: '*.pgm'
+    index_fn: str
+        Optional. Where to save the index. Default: cast_index.csv in raw_folder_path
+    start_depth: float
+        Depth in m at which the downcast starts, after the dip at the surface. Default: 5.0
+    
+    Returns
+    --------
+    Index (.csv)
+        File (relative to the index), Image, Depth and Phase of every hologram.
+        Phase is 'Initial' before the downcast, 'Downcasting', 'Upcasting'
+        after the deepest hologram or 'Erroneous' if the metadata can't be read.
+    index : pandas.DataFrame
+        the index
+    """
+    index_fn = Path(index_fn or Path(raw_folder_path).joinpath(CAST_INDEX_FN))
+    meta = HoloMetadataBatch(sorted(Path(raw_folder_path).glob(ext)))
+
+    phase = np.full(len(meta), "Initial", dtype = object)
+    if len(meta):
+        # remove upcast: everything after the maximum depth
+        deepest = int(np.argmax(meta.depth))
+        phase[deepest + 1:] = "Upcasting"
+
+        # remove the dip: start at the last hologram at start_depth before the deepest
+        at_start = np.flatnonzero(np.round(meta.depth[:deepest + 1]) == start_depth)
+        if len(at_start):
+            first = at_start[-1]
+        else:
+            first = 0
+            print("No hologram at", start_depth, "m, downcast starts at the first hologram")
+        phase[first:deepest + 1] = "Downcasting"
+
+    files = meta.paths + meta.failed
+    index = pd.DataFrame({
+        "File": [os.path.relpath(f, index_fn.parent) for f in files],
+        "Image": [Path(f).stem for f in files],
+        "Depth": np.r_[meta.depth, np.full(len(meta.failed), np.nan)],
+        "Phase": np.r_[phase, np.full(len(meta.failed), "Erroneous", dtype = object)],
+    }).sort_values("File", kind = 'stable').reset_index(drop = True)
+    index.to_csv(index_fn, index = False)
+
+    down = index[index["Phase"] == "Downcasting"]
+    if len(down):
+        print("Downcast profile spans from", round(down["Depth"].iloc[0]), "m to", round(down["Depth"].iloc[-1]), "m")
+    print("Index of", len(index), "holograms saved as:", index_fn)
+
+    return index
+
+
+def find_holograms(raw_folder_path, ext = '*.pgm', index = None, phases = None):
+    """Holograms in raw_folder_path, or those of the selected phases of a cast index (see read_cast_index)"""
+    if index is None:
+        return sorted(Path(raw_folder_path).glob(ext))
+    return read_cast_index(index, phases = phases)
+
+
+def read_cast_index(index_fn, phases = None):
+    """
+    Holograms listed in a cast index (see downcast_index).
+
+    Parameters
+    ----------
+    index_fn: str
+        The index file
+    phases: list
+        Optional. Phases to select, e.g. ['Downcasting']. Default: all but 'Erroneous'
 
+    Returns
+    --------
+    list
+        file locations of the selected holograms
+    """
+    index_fn = Path(index_fn)
+    index = pd.read_csv(index_fn)
+    if phases is None:
+        selected = index["Phase"] != "Erroneous"
+    else:
+        selected = index["Phase"].isin([phases] if isinstance(phases, str) else list(phases))
+    return [index_fn.parent.joinpath(f) for f in index.loc[selected, "File"]]
 
 
 def separate_downcast(raw_folder_path, cruise, event, ext='*.pgm'):
     """
     From a profile of LISST-Holo2 .pgm images, separate downcast images by moving them one directory deeper.
+
+    Consider downcast_index, which selects the same holograms without moving
+    them; the batch functions take its index instead of a folder.
     
     Parameters
     ----------
@@ -643,66 +4530,26 @@ def separate_downcast(raw_folder_path, cruise, event, ext='*.pgm'):
     if not output_path.exists(): output_path.mkdir()
     print("Downcast images will be moved to: " + str(output_path))
 
-    # create and sort file list
-    files = Path(raw_folder_path).glob(ext)
-    files = sorted(files)
-    
-    # create empty parameters to append depth and filename information
-    var1 = []
-    var2 = []
+    # select the downcast from the metadata trailers
+    index_fn = Path(raw_folder_path).joinpath(CAST_INDEX_FN)
+    downcast_index(raw_folder_path, ext = ext, index_fn = index_fn)
 
-    # loop to output filename, depth
-    for f in files:
-        fname = ntpath.basename(f) # extract file name from file path
-        
-        # an error occurred so included a try function to determine which file failed.
-        try:
-            metad = HoloMetadata(f, cruise=None, event=None) # get metadata
-            depth = metad.metadata[4] # get depth from metadata
-        except:
-            print(f)
-            erroneous_path = Path(raw_folder_path).joinpath("erroneous")
-            if not erroneous_path.exists(): erroneous_path.mkdir()
-            shutil.move(f, erroneous_path)
-            shutil.remove(f)
-            depth = None
-            print("Erroneous image", f, "will be moved to: " + str(erroneous_path))
-            continue
-                  
-        # append variables to list
-        var1.append(fname)
-        var2.append(depth)
-        
-    # create a dataframe from the lists
-    df = pd.DataFrame(list(zip(var1, var2)))
-    df["id"] = df.index + 1
-    
-    # find index of maximum depth and remove upcast
-    df2 = df.loc[df[1].idxmax()]
-    maxID = df2['id']
-    df = df.loc[(df['id'] <= maxID)]
-    
-    # remove the dip and filter downcast
-    df['dep_r'] = df[1].round(0) # round depth column
-    df2 = df.loc[(df['dep_r'] == 5.0)] # subset df where rounded depth is specified float (10 metres recommended)
-    df3 = df2.loc[df2['id'].idxmax()] # take bottom row
-    maxID = df3['id'] # highest id from specified depth
-    df = df.loc[(df['id'] >= maxID)] # remove everything before
-    downcast = df[0].tolist() # save downcast filenames to list
+    # move erroneous images
+    erroneous = read_cast_index(index_fn, phases = ['Erroneous'])
+    if erroneous:
+        erroneous_path = Path(raw_folder_path).joinpath("erroneous")
+        if not erroneous_path.exists(): erroneous_path.mkdir()
+        for f in erroneous:
+            shutil.move(str(f), str(erroneous_path))
+            print("Erroneous image", f, "moved to: " + str(erroneous_path))
           
     # move files to dst destination
-    for f in downcast:
-        source = os.path.join(raw_folder_path + f)
-        # include if clause in case the file has been moved to erroneous directory
-        if os.path.exists(source):
-            shutil.move(source, output_path)
+    for source in read_cast_index(index_fn, phases = ['Downcasting']):
+        # include if clause in case the file has been moved already
+        if source.exists():
+            shutil.move(str(source), str(output_path))
+    index_fn.unlink()
         
     # test with time stamp
-    duration = timedelta(seconds=time.perf_counter() - cycle_time)
-    t = df.iloc[0]['dep_r']
-    b = df.iloc[-1]['dep_r']
-    
-    print(" ")
-    print("Downcast profile spans from", t, "m to", b, "m")
-    print('Downcast separation run time: ', duration) 
-
+    duration = datetime.timedelta(seconds=time.perf_counter() - cycle_time)
+    print('Downcast separation run time: ', duration)